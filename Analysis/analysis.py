@@ -9,123 +9,267 @@
 # 標準モジュール
 import os
 import sys
+import time
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import util
 # 自作モジュール
 import calculate_summary_stats
 from config import config
+import engine_pool
 import katago_analyzer
+import metrics
 import output
+import result_writer
+import resume
 import sgf_utils
 
+# このプロセスで対局を同時に解析するスレッド (全棋譜で使い回す)
+_executor = None
+# 同時に解析する対局数の空き (GAMES_PER_ENGINE)
+_game_slots = None
+
+###########
+### 1手の結果を分類し、統計とログ用データを作成する関数
+###########
+def classify_move(
+        stats, 
+        color, 
+        move_number, 
+        gtp_move, 
+        ai_best_move, 
+        player_score, 
+        ai_best_score, 
+        score_diff
+    ):
+    current_stats = stats[color]
+    current_stats['total_moves'] += 1
+    category = ""
+    loss_value = 0.0
+    
+    # 好手・悪手・一致の判定
+    if (gtp_move == ai_best_move):
+        current_stats['same'] += 1
+        category = "一致"
+        loss_value = 0.0  # 一致手は損失なし
+    elif ((color == 'b' and score_diff >= 0.0) or (color == 'w' and score_diff <= 0.0)):
+        current_stats['good'] += 1
+        current_stats['good_sum'] += abs(score_diff)
+        category = "好手"
+        loss_value = -score_diff if color == 'b' else score_diff 
+    else:
+        current_stats['bad'] += 1
+        current_stats['bad_sum'] += abs(score_diff)
+        category = "悪手"
+        loss_value = abs(score_diff)
+
+    loss_value = round(abs(score_diff), 3) if (score_diff is not None) else 0.0
+    
+    # 1手ごとの解析結果
+    move_data = {
+        'player_color': color,          # プレイヤーの色(黒/白)
+        'move_number': move_number,     # 手数
+        'gtp_move': gtp_move,           # プレイヤーの着手
+        'ai_best_move': ai_best_move,   # AIが考える最善手
+        'player_score': player_score,   # プレイヤーの評価値
+        'ai_best_score': ai_best_score, # AIの評価値
+        'score_diff': score_diff,       # 評価値の差(プレイヤーの手の評価値 - AIの評価値)
+        'category': category,           # 手の分類
+        'loss_value': loss_value,
+    }
+    return move_data
+
+###########
+### 1手ずつKataGoに問い合わせて解析する関数
+###########
+def analyze_moves_one_by_one(client, board_size, game_moves, stats):
+    moves = [] # これまでの手を記録 (KataGoへの入力用)
+    all_move_data = []
+
+    for color, sgf_move in game_moves:
+        # 着手の解析 (KataGoへの問い合わせ)
+        (player_score, 
+         ai_best_score, 
+         score_diff, 
+         ai_best_move, 
+         gtp_move,
+        ) = katago_analyzer.get_evaluation_and_scorediff(
+            client, 
+            board_size, 
+            list(moves), 
+            sgf_move, 
+            color
+        )
+        
+        moves.append([color, gtp_move])
+
+        # 指標の計算と結果の格納
+        if (player_score is not None):
+            all_move_data.append(classify_move(
+                stats, color, len(moves), gtp_move, 
+                ai_best_move, player_score, ai_best_score, score_diff
+            ))
+    return all_move_data
+
+###########
+### 次の手の着手前の評価値を着手後の評価値として再利用し、1手ずつ解析する関数
+###########
+def analyze_moves_reusing_next_turn(client, board_size, game_moves, stats, known_evaluations=None, on_evaluation=None):
+    moves = [[color, sgf_utils.sgf_to_gtp(sgf_move)] for color, sgf_move in game_moves]
+    evaluations = dict(known_evaluations or {}) # 手数 -> (AIの最善手, 最善手の評価値)
+    all_move_data = []
+
+    # k手目の着手前の局面を解析 (解析済みなら再利用)
+    def evaluate_turn(turn):
+        if (turn not in evaluations):
+            evaluations[turn] = katago_analyzer.get_position_evaluation(client, board_size, moves[:turn], on_evaluation)
+        return evaluations[turn]
+
+    for turn, (color, gtp_move) in enumerate(moves):
+        ai_best_move, ai_best_score = evaluate_turn(turn)
+        if (ai_best_move is None):
+            continue
+
+        # プレイヤーの着手とAIが考える最善手が同じ場合
+        if (gtp_move == ai_best_move):
+            player_score, score_diff = ai_best_score, 0.000
+        else:
+            # 着手後の局面 = 次の手の着手前の局面 (最終手のみ追加の問い合わせとなる)
+            _, player_score = evaluate_turn(turn + 1)
+            if (player_score is None):
+                continue
+            score_diff = player_score - ai_best_score
+
+        all_move_data.append(classify_move(
+            stats, color, turn + 1, gtp_move, 
+            ai_best_move, player_score, ai_best_score, score_diff
+        ))
+    return all_move_data
+
+###########
+### 1局一括の解析で使う探索数の段階を返す関数
+###########
+def get_visit_schedule():
+    if (config.ADAPTIVE_VISITS):
+        return config.ADAPTIVE_VISIT_SCHEDULE
+    return [config.MAX_VISITS]
+
+###########
+### 十分に解析された局面とみなす探索数を返す関数 (解析済みの局面はこの探索数で解析する)
+###########
+def get_final_visits():
+    return get_visit_schedule()[-1] if (config.WHOLE_GAME_ANALYSIS) else config.MAX_VISITS
+
+###########
+### 1局の全局面を1回の問い合わせで解析する関数
+### 戻り値: (1手ごとのデータ, 実際に使った探索数)
+###########
+def analyze_moves_whole_game(
+        client, board_size, game_moves, stats, known_evaluations=None, on_evaluation=None, on_settled=None
+    ):
+    moves = [[color, sgf_utils.sgf_to_gtp(sgf_move)] for color, sgf_move in game_moves]
+    all_move_data = []
+
+    # 探索数の段階 (適応モードでは少ない探索数から始め、判定が微妙な局面だけ増やす)
+    visit_schedule = get_visit_schedule()
+
+    # 着手前の局面(0 ~ n-1手目)と最終手の着手後の局面(n手目)をまとめて解析
+    # k手目の着手後の局面は k+1手目の着手前の局面と同一
+    evaluations, visits_spent = katago_analyzer.get_game_evaluations_adaptive(
+        client, 
+        board_size, 
+        moves, 
+        list(range(len(moves) + 1)),
+        visit_schedule,
+        known_evaluations,
+        on_evaluation,
+        on_settled
+    )
+    if (evaluations is None):
+        # 途中で失敗した対局は出力せず、次回の再開時に途中経過から解析し直す
+        raise IOError("KataGoによる解析に失敗しました")
+
+    for turn, (color, gtp_move) in enumerate(moves):
+        if (turn not in evaluations):
+            continue
+        ai_best_move, ai_best_score = evaluations[turn]
+
+        # プレイヤーの着手とAIが考える最善手が同じ場合
+        if (gtp_move == ai_best_move):
+            player_score, score_diff = ai_best_score, 0.000
+        elif ((turn + 1) in evaluations):
+            player_score = evaluations[turn + 1][1]
+            score_diff = player_score - ai_best_score
+        else:
+            continue
+
+        all_move_data.append(classify_move(
+            stats, color, turn + 1, gtp_move, 
+            ai_best_move, player_score, ai_best_score, score_diff
+        ))
+    return all_move_data, visits_spent
+
 ###########
 ### 1局の解析を行う関数
 ###########
 def analyze_game(
         sgf_file_path,  
-        csv_lock
+        known_evaluations=None # 解析済みの局面 {手数: (AIの最善手, 最善手の評価値)}
     ):
 
     # 初期処理
     print(f"--- {os.path.basename(sgf_file_path)} の解析を開始 ---")
-    proc = None
     start_time = datetime.datetime.now()
+    game_start_time = time.monotonic()
+    is_error = False
+    journal = None
     
     try:
-        # 準備とSGF情報の読み込み
-        (game_tree, 
-         board_size, 
-         black_player, 
-         white_player, 
-         black_rank, 
-         white_rank) = sgf_utils.load_sgf_and_get_game_info(sgf_file_path)
-
-        moves = [] # これまでの手を記録 (KataGoへの入力用)
-        all_move_data = [] # 出力用に1手ごとのデータを保持するリスト
+        # 準備とSGF情報の読み込み (解析対象の着手は最大手数まで)
+        game = sgf_utils.load_game_record(sgf_file_path, config.MAX_MOVE_TO_ANALYSIS)
+        metrics.add('parse_seconds', time.monotonic() - game_start_time)
+        board_size = game.board_size
+        game_moves = game.moves
         
         # 統計データ初期化
         stats = {
-            'b': {'player_name': black_player, 'player_rank': black_rank, 'total_moves': 0, 
+            'b': {'player_name': game.black_player, 'player_rank': game.black_rank, 'total_moves': 0, 
                   'same': 0, 'good': 0, 'bad': 0, 'good_sum': 0.0, 'bad_sum': 0.0},
-            'w': {'player_name': white_player, 'player_rank': white_rank, 'total_moves': 0, 
+            'w': {'player_name': game.white_player, 'player_rank': game.white_rank, 'total_moves': 0, 
                   'same': 0, 'good': 0, 'bad': 0, 'good_sum': 0.0, 'bad_sum': 0.0}
         }
         
-        # KataGoプロセスを起動
-        proc = katago_analyzer.start_katago_process()
+        # 前回中断した解析の途中経過を読み込み、届いた評価を1局面ずつ記録する
+        # (実際の着手列の局面のみを解析するモードが対象)
+        on_evaluation = None
+        on_settled = None
+        if (config.RESUME and (config.WHOLE_GAME_ANALYSIS or config.REUSE_NEXT_TURN_EVALUATION)):
+            game_key = resume.make_game_key(board_size, game_moves)
+            journal_evaluations = resume.load_journal(sgf_file_path, game_key, get_final_visits())
+            if (journal_evaluations):
+                print(f"--- {os.path.basename(sgf_file_path)} の途中経過を再利用: {len(journal_evaluations)} 局面 ---")
+            known_evaluations = {**journal_evaluations, **(known_evaluations or {})}
+            journal = resume.GameJournal(sgf_file_path, game_key)
+            on_evaluation = journal.record
+            on_settled = journal.settle
+
+        # 常駐しているKataGoプロセスを取得 (同じプロセス内の対局と共有)
+        client = engine_pool.acquire_engine()
         
-        if (proc is not None):
-            # 全着手の解析ループ (最大手数まで)
-            for i, node in enumerate(game_tree.nodes):
-                
-                if (i == 0): continue # 最初のノードは情報ノードのためスキップ
-                
-                if (i > config.MAX_MOVE_TO_ANALYSIS): # 解析の最大手数に到達
-                    break 
-
-                # 着手情報の抽出
-                if ('B' in node.properties):
-                    color = 'b'
-                    sgf_move = node.properties['B'][0]
-                elif ('W' in node.properties):
-                    color = 'w'
-                    sgf_move = node.properties['W'][0]
-                else:
-                    continue
-
-                # 着手の解析 (KataGoへの問い合わせ)
-                (player_score, 
-                 ai_best_score, 
-                 score_diff, 
-                 ai_best_move, 
-                 gtp_move,
-                ) = katago_analyzer.get_evaluation_and_scorediff(
-                    proc, 
-                    board_size, 
-                    list(moves), 
-                    sgf_move, 
-                    color
+        if (client is not None):
+            # 全着手の解析
+            if (config.WHOLE_GAME_ANALYSIS):
+                all_move_data, visits_spent = analyze_moves_whole_game(
+                    client, board_size, game_moves, stats, known_evaluations, on_evaluation, on_settled
                 )
-                
-                moves.append([color, gtp_move])
-
-                # 指標の計算と結果の格納
-                if (player_score is not None):
-                    current_stats = stats[color]
-                    current_stats['total_moves'] += 1
-                    category = ""
-                    loss_value = 0.0
-                    
-                    # 好手・悪手・一致の判定
-                    if (gtp_move == ai_best_move):
-                        current_stats['same'] += 1
-                        category = "一致"
-                        loss_value = 0.0  # 一致手は損失なし
-                    elif ((color == 'b' and score_diff >= 0.0) or (color == 'w' and score_diff <= 0.0)):
-                        current_stats['good'] += 1
-                        current_stats['good_sum'] += abs(score_diff)
-                        category = "好手"
-                        loss_value = -score_diff if color == 'b' else score_diff 
-                    else:
-                        current_stats['bad'] += 1
-                        current_stats['bad_sum'] += abs(score_diff)
-                        category = "悪手"
-                        loss_value = abs(score_diff)
-
-                    loss_value = round(abs(score_diff), 3) if (score_diff is not None) else 0.0
-                    
-                    # 1手ごとの解析結果をリストに格納
-                    move_data = {
-                        'player_color': color,          # プレイヤーの色(黒/白)
-                        'move_number': len(moves),      # 手数
-                        'gtp_move': gtp_move,           # プレイヤーの着手
-                        'ai_best_move': ai_best_move,   # AIが考える最善手
-                        'player_score': player_score,   # プレイヤーの評価値
-                        'ai_best_score': ai_best_score, # AIの評価値
-                        'score_diff': score_diff,       # 評価値の差(プレイヤーの手の評価値 - AIの評価値)
-                        'category': category,           # 手の分類
-                        'loss_value': loss_value,
-                    }
-                    all_move_data.append(move_data)
+                print(f"--- {os.path.basename(sgf_file_path)} の探索数: {visits_spent} ---")
+            elif (config.REUSE_NEXT_TURN_EVALUATION):
+                all_move_data = analyze_moves_reusing_next_turn(
+                    client, board_size, game_moves, stats, known_evaluations, on_evaluation
+                )
+            else:
+                all_move_data = analyze_moves_one_by_one(client, board_size, game_moves, stats)
             
             # 統計結果の計算
             calculated_stats = calculate_summary_stats.calculate_summary_stats(stats)
@@ -140,31 +284,72 @@ def analyze_game(
                     all_move_data, 
                     calculated_stats,
                 )
-                # CSVファイルへ統計情報の書き出し
-                output.write_summary_to_csv(
-                    calculated_stats, 
-                    sgf_file_path, 
-                    csv_lock
-                )
-                # CSVファイルへ詳細情報の書き出し
-                output.write_detail_to_csv(
-                    all_move_data, 
-                    sgf_file_path, 
-                    calculated_stats,
-                    csv_lock
+                # 途中経過の記録を終了 (CSVへの書き出し後に書き込み側で削除される)
+                if (journal is not None):
+                    journal.close()
+                # CSVファイルへ統計情報・詳細情報の書き出し (書き込み専用プロセスへ送る)
+                output.submit_result(
+                    sgf_file_path,
+                    all_move_data,
+                    calculated_stats
                 )
             except Exception as e:
+                is_error = True
                 print(f"エラー: {sgf_file_path}の書き出しに失敗 : {e}")
             
         else:
             raise Exception("エラー: KataGoプロセスを開始できません")
 
     except FileNotFoundError:
+        is_error = True
         print(f"エラー: SGFファイル '{sgf_file_path}' が見つかりません", file=sys.stderr)
     except Exception as e:
+        is_error = True
         print(f"解析中のエラー: {e}", file=sys.stderr)
-        
+
     finally:
-        if (proc):
-            # プロセスを終了させる
-            proc.terminate()
+        if (journal is not None):
+            journal.close()
+        metrics.record_game(time.monotonic() - game_start_time, is_error)
+
+###########
+### mp.Poolの各プロセス起動時の初期化関数 (initializer)
+###########
+def init_worker(result_queue, metrics_queue=None):
+    global _executor, _game_slots
+    # 計測値の送り先を設定し、KataGoを起動し、解析結果の送り先を設定
+    metrics.init_worker(metrics_queue)
+    engine_pool.init_worker()
+    result_writer.init_worker(result_queue)
+    # 1つのKataGoで同時に解析する対局のスレッド
+    _executor = ThreadPoolExecutor(max_workers=config.GAMES_PER_ENGINE)
+    _game_slots = threading.BoundedSemaphore(config.GAMES_PER_ENGINE)
+    # プロセスの正常終了時に解析中の対局を待つ (KataGoの終了・計測値の送信より先に実行する)
+    util.Finalize(None, wait_for_games, exitpriority=30)
+
+###########
+### 解析中の対局の終了を待つ関数
+###########
+def wait_for_games():
+    if (_executor is not None):
+        _executor.shutdown(wait=True)
+
+###########
+### 処理をこのプロセスの対局用スレッドに渡す関数
+### 同時解析数 (GAMES_PER_ENGINE) に空きができるまで待ち、処理の Future を返す
+###########
+def submit_to_slot(function, *args):
+    _game_slots.acquire()
+    future = _executor.submit(function, *args)
+    future.add_done_callback(lambda _: _game_slots.release())
+    return future
+
+###########
+### 1局の解析をこのプロセスのスレッドに渡す関数 (mp.Pool の1タスク)
+### task = (棋譜のパス, 解析済みの局面 {手数: 評価})
+### 同時解析数に空きができるまで戻らないため、空きのあるプロセスから順に次の棋譜を受け取る
+### (1局終わるごとに次の対局を始め、KataGoのバッチを埋め続ける)
+###########
+def submit_game(task):
+    sgf_file_path, known_evaluations = task
+    submit_to_slot(analyze_game, sgf_file_path, known_evaluations)
@@ -0,0 +1,228 @@
+# /**
+#  * benchmark.py
+#  * fake_katago.py を使い、解析全体 (main.run_parallel_analysis) の処理速度を計測するプログラム
+#  * KataGoの探索時間を固定した疑似エンジンで計測するため、エンジン以外の処理にかかる時間が分かる
+#  *
+#  * 使い方: python benchmark.py [--processes 1,2,4] [--games 8,32] [--moves 200]
+#  *                             [--seconds-per-visit 0] [--visits 100] [--engine-threads 8] [--output 結果.csv]
+#  */
+
+import argparse
+import csv
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# 計測ごとの設定 (config に上書きする値) を子プロセスへ渡す環境変数
+# (spawn で起動した子プロセスはこのファイルを読み込み直すため、読み込み時に同じ値を上書きする)
+CONFIG_ENV = "BENCHMARK_CONFIG"
+# 疑似エンジンのパス
+FAKE_KATAGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_katago.py")
+# 疑似的な棋譜の着手に使う座標の文字
+SGF_COORDINATES = "abcdefghijklmnopqrs"
+
+from config import config
+
+###########
+### 環境変数に設定された値を config に上書きする関数
+###########
+def apply_config_overrides():
+    overrides = json.loads(os.environ.get(CONFIG_ENV, "{}"))
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+apply_config_overrides()
+
+import main
+import opening_planner
+import result_writer
+
+###########
+### 疑似的な棋譜 (SGF) を作成する関数
+### 序盤の数手は共通の定石にし、共通の序盤を先に解析する処理も計測の対象にする
+###########
+def write_corpus(input_dir, num_games, num_moves, seed=0):
+    rng = random.Random(seed)
+    opening = ["pd", "dp", "pp", "dd", "fq", "cn"]
+    for i in range(num_games):
+        moves = opening[:rng.randint(0, len(opening))]
+        while (len(moves) < num_moves):
+            moves.append(rng.choice(SGF_COORDINATES) + rng.choice(SGF_COORDINATES))
+        nodes = "".join(f";{'BW'[turn % 2]}[{move}]" for turn, move in enumerate(moves))
+        sgf = f"(;GM[1]FF[4]SZ[19]KM[6.5]PB[black{i}]PW[white{i}]BR[5k]WR[5k]{nodes})"
+        with open(os.path.join(input_dir, f"bench_{i:05d}.sgf"), 'w', encoding='utf-8') as f:
+            f.write(sgf)
+
+###########
+### 疑似エンジンを使い、入出力を指定したディレクトリにまとめる設定 (config に上書きする値) を返す関数
+###########
+def make_config_overrides(input_dir, output_dir):
+    return {
+        'KATAGO_PATH': FAKE_KATAGO_PATH,
+        'INPUT_DIR': input_dir,
+        'INPUT_MANIFEST': None,
+        'OUTPUT_DIR': output_dir,
+        'DETAIL_CSV_PATH': os.path.join(output_dir, "detail.csv"),
+        'SUMMARY_CSV_PATH': os.path.join(output_dir, "summary.csv"),
+        'DETAIL_NPY_PATH': os.path.join(output_dir, "detail.npy"),
+        'DETAIL_META_CSV_PATH': os.path.join(output_dir, "detail_meta.csv"),
+        'JOURNAL_DIR': os.path.join(output_dir, "Journal"),
+        'EVALUATION_CACHE_PATH': os.path.join(output_dir, "evaluation_cache.sqlite3"),
+        'METRICS_PATH': os.path.join(output_dir, "metrics.prom"),
+    }
+
+###########
+### 関数の処理時間を stage_seconds[name] に加算するように置き換える関数
+###########
+def time_stage(module, function_name, stage_seconds, name):
+    function = getattr(module, function_name)
+    def timed(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stage_seconds[name] = stage_seconds.get(name, 0.0) + time.perf_counter() - start_time
+    setattr(module, function_name, timed)
+    return function
+
+###########
+### 疑似エンジンの処理件数と処理時間を集計する関数 (エンジンごとの記録を合計する)
+###########
+def read_engine_stats(stats_path):
+    totals = {'engines': 0, 'queries': 0, 'positions': 0, 'query_seconds': 0.0, 'max_query_seconds': 0.0}
+    if (not os.path.exists(stats_path)):
+        return totals
+    with open(stats_path, encoding='utf-8') as f:
+        for line in f:
+            stats = json.loads(line)
+            totals['engines'] += 1
+            totals['queries'] += stats['queries']
+            totals['positions'] += stats['positions']
+            totals['query_seconds'] += stats['query_seconds']
+            totals['max_query_seconds'] = max(totals['max_query_seconds'], stats['max_query_seconds'])
+    return totals
+
+###########
+### 1つの条件で解析全体を実行し、処理時間を計測する関数
+###########
+def run_case(num_processes, num_games, args, work_dir):
+    case_dir = os.path.join(work_dir, f"p{num_processes}_g{num_games}")
+    input_dir = os.path.join(case_dir, "Input")
+    output_dir = os.path.join(case_dir, "Output")
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    write_corpus(input_dir, num_games, args.moves)
+    stats_path = os.path.join(case_dir, "engine_stats.jsonl")
+
+    overrides = {
+        **make_config_overrides(input_dir, output_dir),
+        'NUM_PROCESSES': num_processes,
+        'MAX_VISITS': args.visits,
+        'MAX_MOVE_TO_ANALYSIS': args.moves,
+        'USE_EVALUATION_CACHE': args.cache,
+    }
+    os.environ[CONFIG_ENV] = json.dumps(overrides)
+    os.environ["FAKE_KATAGO_SECONDS_PER_VISIT"] = str(args.seconds_per_visit)
+    os.environ["FAKE_KATAGO_THREADS"] = str(args.engine_threads)
+    os.environ["FAKE_KATAGO_STATS_PATH"] = stats_path
+    apply_config_overrides()
+
+    # 親プロセスで行う処理の時間 (残りが棋譜の解析)
+    stage_seconds = {}
+    originals = [
+        (opening_planner, 'evaluate_shared_openings', time_stage(opening_planner, 'evaluate_shared_openings', stage_seconds, 'opening')),
+        (result_writer, 'start_writer_process', time_stage(result_writer, 'start_writer_process', stage_seconds, 'writer')),
+        (result_writer, 'stop_writer_process', time_stage(result_writer, 'stop_writer_process', stage_seconds, 'writer')),
+        (result_writer, 'merge_shards', time_stage(result_writer, 'merge_shards', stage_seconds, 'merge')),
+    ]
+    start_time = time.perf_counter()
+    try:
+        main.run_parallel_analysis()
+    finally:
+        for module, function_name, function in originals:
+            setattr(module, function_name, function)
+    wall_seconds = time.perf_counter() - start_time
+
+    engine_stats = read_engine_stats(stats_path)
+    analysis_seconds = wall_seconds - sum(stage_seconds.values())
+    # エンジンの探索だけにかかる時間 (局面数 × 探索数 × 1探索の時間 / 同時に解析できる局面数)
+    num_parallel_positions = max(1, engine_stats['engines']) * args.engine_threads
+    engine_seconds = engine_stats['positions'] * args.visits * args.seconds_per_visit / num_parallel_positions
+    return {
+        'processes': num_processes,
+        'games': num_games,
+        'wall_seconds': round(wall_seconds, 3),
+        'games_per_second': round(num_games / wall_seconds, 3),
+        'queries_per_second': round(engine_stats['queries'] / wall_seconds, 3),
+        'positions_per_second': round(engine_stats['positions'] / wall_seconds, 3),
+        'mean_query_seconds': round(engine_stats['query_seconds'] / max(1, engine_stats['queries']), 4),
+        'max_query_seconds': round(engine_stats['max_query_seconds'], 4),
+        'opening_seconds': round(stage_seconds.get('opening', 0.0), 3),
+        'analysis_seconds': round(analysis_seconds, 3),
+        'writer_seconds': round(stage_seconds.get('writer', 0.0), 3),
+        'merge_seconds': round(stage_seconds.get('merge', 0.0), 3),
+        'overhead_seconds': round(wall_seconds - engine_seconds, 3),
+    }
+
+###########
+### 計測結果を表で表示する関数
+###########
+def print_results(results):
+    header = (
+        f"{'proc':>4} | {'games':>5} | {'wall(s)':>8} | {'games/s':>8} | {'query/s':>8} | {'pos/s':>8} |"
+        f" {'query平均(s)':>10} | {'序盤(s)':>7} | {'解析(s)':>7} | {'書込(s)':>7} | {'結合(s)':>7} | {'エンジン外(s)':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['processes']:>4} | {result['games']:>5} | {result['wall_seconds']:>8.3f} |"
+            f" {result['games_per_second']:>8.3f} | {result['queries_per_second']:>8.2f} |"
+            f" {result['positions_per_second']:>8.1f} | {result['mean_query_seconds']:>12.4f} |"
+            f" {result['opening_seconds']:>8.3f} | {result['analysis_seconds']:>8.3f} |"
+            f" {result['writer_seconds']:>8.3f} | {result['merge_seconds']:>8.3f} | {result['overhead_seconds']:>13.3f}"
+        )
+
+###########
+### メイン関数
+###########
+def run_benchmark():
+    parser = argparse.ArgumentParser(description="疑似エンジンを使った解析の処理速度の計測")
+    parser.add_argument("--processes", default="1,2,4", help="プロセス数 (カンマ区切り)")
+    parser.add_argument("--games", default="8,32", help="棋譜数 (カンマ区切り)")
+    parser.add_argument("--moves", type=int, default=200, help="1局の手数")
+    parser.add_argument("--visits", type=int, default=100, help="1局面あたりの探索数")
+    parser.add_argument("--seconds-per-visit", type=float, default=0.0, help="疑似エンジンの探索1回あたりの時間(秒)")
+    parser.add_argument("--engine-threads", type=int, default=8, help="疑似エンジン1つが同時に解析する局面数")
+    parser.add_argument("--cache", action="store_true", help="局面評価のキャッシュを使う")
+    parser.add_argument("--output", help="計測結果を書き込むCSVファイル")
+    parser.add_argument("--keep", action="store_true", help="作成した棋譜と出力を残す")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="analysis_benchmark_")
+    results = []
+    try:
+        for num_games in [int(x) for x in args.games.split(',') if x.strip()]:
+            for num_processes in [int(x) for x in args.processes.split(',') if x.strip()]:
+                print(f"--- プロセス数 {num_processes}, 棋譜数 {num_games} ---")
+                results.append(run_case(num_processes, num_games, args, work_dir))
+    finally:
+        if (args.keep):
+            print(f"作業ディレクトリ: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_results(results)
+    if (args.output and results):
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+
+if __name__ == '__main__':
+    sys.exit(run_benchmark())
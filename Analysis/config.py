@@ -12,26 +12,99 @@ class Config:
     # KataGoのモデルファイル(AIの頭脳)
     MODEL_FILE = "/Users/satoshinarita/GradReserch/Analysis2/g170-b40c256x2-s5095420928-d1229425124.bin.gz"
     # KataGo自体へのパス
+    # (KataGoがない環境で動作確認・計測する場合は、疑似エンジン fake_katago.py のパスを指定する)
     KATAGO_PATH = "/opt/homebrew/Cellar/katago/1.16.4/bin/katago"
 
     # === パスの設定 (固定値) ===
     # 入力のパス
     INPUT_DIR = "../Input/SelectedKifus"
+    # 入力する棋譜の一覧ファイル (1行に1つのSGFファイルのパス, Selectの manifest モードで作成)
+    # 指定した場合は INPUT_DIR を探索せずに一覧の棋譜を解析する (None: INPUT_DIR を探索)
+    INPUT_MANIFEST = None
     # 出力のパス
     OUTPUT_DIR = "../Output"
     # 1手ごとの詳細な解析結果用
     DETAIL_CSV_PATH = "../Output/detail.csv"
     # 対局全体の統計結果用
     SUMMARY_CSV_PATH = "../Output/summary.csv"
+    # 詳細な解析結果を.npy形式で出力する場合の損失 (1局1行の float32 配列) と基本情報
+    DETAIL_NPY_PATH = "../Output/detail.npy"
+    DETAIL_META_CSV_PATH = "../Output/detail_meta.csv"
+    # 解析途中の経過 (中断からの再開用)
+    JOURNAL_DIR = "../Output/Journal"
+    # 局面評価のキャッシュ (SQLite)
+    EVALUATION_CACHE_PATH = "../Output/evaluation_cache.sqlite3"
     # KataGoの設定ファイル
     SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
     CONFIG_FILE = os.path.join(SCRIPT_DIR, "analysis.cfg")
     
+    # === 対局条件 ===
+    # コミ(目)
+    KOMI = 6.5
+    # ルールセット
+    RULES = "japanese"
+    # 1局面あたりの探索数 (analysis.cfg の maxVisits と同じ値)
+    MAX_VISITS = 1000
+
     # === その他のパラメータ ===
     # 最大解析手数
     MAX_MOVE_TO_ANALYSIS = 400
+    # UTF-8として読めないSGFの文字コードを推定する際に読む先頭のバイト数
+    SGF_ENCODING_DETECT_BYTES = 4096
     # Pythonプロセス数
     NUM_PROCESSES = 2
+    # 1局の全手を1回のクエリ(analyzeTurns)でまとめて解析するか
+    # (False の場合は1手ごとに問い合わせる)
+    WHOLE_GAME_ANALYSIS = True
+    # 1手ごとに問い合わせる場合、着手後の評価値に次の手の着手前の評価値を再利用するか
+    # (False の場合は着手後の局面を別途問い合わせる)
+    REUSE_NEXT_TURN_EVALUATION = True
+    # 1つのKataGoで同時に解析する対局数 (リクエストを並行して送り、NNのバッチを埋める)
+    GAMES_PER_ENGINE = 4
+    # KataGoの応答が途絶えてから解析リクエストを打ち切るまでの時間(秒)
+    # (どのリクエストの応答でも届けば待ち直すため、1局の長さや探索数によらない。超えた対局はエラーとし、KataGoの死活確認を行う)
+    ENGINE_QUERY_TIMEOUT = 300
+    # KataGoの死活確認の待ち時間(秒)
+    ENGINE_HEALTH_CHECK_TIMEOUT = 60
+    # KataGo終了時の待ち時間(秒)
+    ENGINE_SHUTDOWN_TIMEOUT = 10
+    # 1局一括の解析で、探索数を局面ごとに調整するか (適応モード)
+    ADAPTIVE_VISITS = False
+    # 適応モードの探索数の段階 (判定が微妙な局面だけ次の段階で再解析する)
+    ADAPTIVE_VISIT_SCHEDULE = [100, 300, 1000]
+    # 着手と最善手が異なる場合、評価値の差がこの値(目)未満なら再解析 (好手/悪手の境界付近)
+    ADAPTIVE_SCORE_MARGIN = 1.0
+    # 着手と最善手が一致した場合、最善手と次善手の差がこの値(目)未満なら再解析
+    ADAPTIVE_BEST_MOVE_MARGIN = 1.0
+    # 複数の対局で共通する序盤の局面を先に1度だけ解析するか
+    SHARE_OPENING_EVALUATIONS = True
+    # 共通する局面を探す序盤の手数
+    OPENING_PREFIX_MAX_MOVES = 30
+    # 出力済みの棋譜を飛ばし、中断した棋譜は途中経過から再開するか
+    # (True の場合、起動時に summary.csv と detail.csv から書きかけ・重複した行を取り除いて書き直す)
+    RESUME = False
+    # 1手ごとの詳細な解析結果の出力形式 ("csv": detail.csv, "npy": detail.npy + detail_meta.csv)
+    DETAIL_OUTPUT_FORMAT = "csv"
+    # 解析結果をCSVへ書き出す間隔 (局数・秒) (書き込み専用プロセスがまとめて書き込む)
+    RESULT_BATCH_SIZE = 16
+    RESULT_FLUSH_INTERVAL = 5
+    # 書き込み専用プロセスを使わず、各プロセスが専用のファイル(シャード)に書き込み、最後に結合するか
+    RESULT_SHARDS = False
+    # 局面評価のキャッシュを使うか
+    # (True の場合、EVALUATION_CACHE_PATH のデータベースが実行をまたいで最大 EVALUATION_CACHE_MAX_ENTRIES 件まで増える)
+    USE_EVALUATION_CACHE = False
+    # キャッシュの最大件数 (超えた分は使用日時の古い順に削除)
+    EVALUATION_CACHE_MAX_ENTRIES = 10000000
+    # キャッシュの件数を確認する間隔 (追加件数)
+    EVALUATION_CACHE_EVICTION_INTERVAL = 10000
+    # キャッシュのヒット数・ミス数と使用日時をまとめて書き込む間隔(秒)
+    EVALUATION_CACHE_FLUSH_INTERVAL = 30
+    # 解析中の計測値 (待ち時間・処理速度など) を集計して書き出し、進捗を表示する間隔(秒) (0: 計測しない)
+    METRICS_INTERVAL = 10
+    # 計測値の出力先
+    METRICS_PATH = "../Output/metrics.prom"
+    # 計測値の出力形式 ("prometheus": Prometheusのテキスト形式で上書き, "jsonl": 1回分を1行のJSONで追記)
+    METRICS_FORMAT = "prometheus"
 
 # Configクラスのインスタンスを作成し、外部にエクスポート
 config = Config()
\ No newline at end of file
@@ -0,0 +1,80 @@
+# /**
+#  * engine_pool.py
+#  * 解析プロセスごとに常駐させるKataGoエンジンの管理
+#  */
+
+import threading
+from multiprocessing import util
+from config import config
+import katago_analyzer
+
+# このプロセスで常駐しているKataGoのクライアント
+_engine = None
+# 同じプロセス内の複数スレッドからの起動・再起動を保護
+_engine_lock = threading.Lock()
+
+###########
+### KataGoを起動し、クライアントを作成する関数
+###########
+def start_engine():
+    proc = katago_analyzer.start_katago_process()
+    if (proc is None):
+        return None
+    return katago_analyzer.KataGoClient(proc)
+
+###########
+### KataGoが応答可能かを確認する関数
+### バージョン問い合わせは、応答のないリクエストがあった場合のみ行う
+###########
+def is_engine_healthy(client):
+    # プロセスが終了していないか
+    if ((client is None) or (not client.is_alive())):
+        return False
+    if (not client.failed):
+        return True
+
+    # バージョン問い合わせに応答するか
+    try:
+        client.query({"action": "query_version"}, timeout=config.ENGINE_HEALTH_CHECK_TIMEOUT)
+    except Exception:
+        return False
+    client.failed = False
+    return True
+
+###########
+### 常駐しているKataGoを終了する関数
+###########
+def shutdown_engine():
+    global _engine
+    with _engine_lock:
+        client, _engine = _engine, None
+    if (client is not None):
+        client.close(timeout=config.ENGINE_SHUTDOWN_TIMEOUT)
+
+###########
+### mp.Poolの各プロセス起動時にKataGoを起動する関数 (initializer)
+###########
+def init_worker():
+    global _engine
+    _engine = start_engine()
+    # プロセスの正常終了時にKataGoを終了させる
+    util.Finalize(None, shutdown_engine, exitpriority=10)
+
+###########
+### 常駐しているKataGoを取得する関数 (応答がなければ再起動する)
+###########
+def acquire_engine():
+    global _engine
+    # 動作中で応答のないリクエストもなければ、ロックを取らずにそのまま使う
+    client = _engine
+    if ((client is not None) and client.is_alive() and (not client.failed)):
+        return client
+
+    with _engine_lock:
+        if (not is_engine_healthy(_engine)):
+            if (_engine is not None):
+                print("警告: KataGoが応答しないため再起動します")
+                # 新しいKataGoに切り替え、古い方は他の対局の応答待ちのリクエストが終わってから終了させる
+                _engine.retire(timeout=config.ENGINE_SHUTDOWN_TIMEOUT)
+            _engine = start_engine()
+        return _engine
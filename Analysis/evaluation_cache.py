@@ -0,0 +1,190 @@
+# /**
+#  * evaluation_cache.py
+#  * 局面ごとの解析結果をSQLiteに保存し、再実行時に再利用するキャッシュ
+#  */
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from multiprocessing import util
+from config import config
+
+# このプロセスで開いている接続 (fork後は開き直す)
+_connection = None
+_connection_pid = None
+_lock = threading.Lock()
+# 前回の容量確認以降に追加した件数
+_inserts_since_eviction = 0
+# まだデータベースに書き込んでいないヒット数・ミス数と、使用日時を更新する局面のキー
+_pending_hits = 0
+_pending_misses = 0
+_pending_used_keys = set()
+_last_usage_flush = time.monotonic()
+# 1回の SELECT で検索するキーの数 (SQLiteの変数の上限より少なくする)
+LOOKUP_BATCH_SIZE = 500
+
+###########
+### キャッシュのデータベースに接続する関数
+###########
+def get_connection():
+    global _connection, _connection_pid, _pending_hits, _pending_misses, _pending_used_keys
+    if ((_connection is not None) and (_connection_pid == os.getpid())):
+        return _connection
+
+    os.makedirs(os.path.dirname(os.path.abspath(config.EVALUATION_CACHE_PATH)), exist_ok=True)
+    connection = sqlite3.connect(config.EVALUATION_CACHE_PATH, timeout=60, check_same_thread=False)
+    # 複数プロセスからの同時読み書きに対応
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    with connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            " key TEXT PRIMARY KEY, best_move TEXT, score_lead REAL, visits INTEGER, last_used REAL,"
+            " score_gap REAL)"
+        )
+        # 旧形式のキャッシュには最善手と次善手の評価値の差の列を追加
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(evaluations)")]
+        if ('score_gap' not in columns):
+            connection.execute("ALTER TABLE evaluations ADD COLUMN score_gap REAL")
+        connection.execute("CREATE INDEX IF NOT EXISTS evaluations_last_used ON evaluations (last_used)")
+        connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+        connection.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+
+    _connection, _connection_pid = connection, os.getpid()
+    # fork元のプロセスで書き込んでいない値は引き継がない
+    _pending_hits, _pending_misses, _pending_used_keys = 0, 0, set()
+    # プロセスの終了時に、書き込んでいないヒット数・ミス数と使用日時を書き込む
+    util.Finalize(None, flush_usage, exitpriority=5)
+    return connection
+
+###########
+### 局面ごとのキーを計算する関数
+### キー = (盤面サイズ, コミ, ルール, 探索数, モデル, 着手列) のハッシュ
+###########
+def make_position_keys(board_size, moves, turns, max_visits):
+    header = json.dumps([
+        board_size, config.KOMI, config.RULES, max_visits, os.path.basename(config.MODEL_FILE)
+    ])
+    digest = hashlib.sha256(header.encode()).hexdigest()
+
+    # 着手列のハッシュを1手ずつ連鎖させ、全手数分を O(手数) で求める
+    keys = {}
+    wanted = set(turns)
+    for turn in range(max(wanted) + 1):
+        if (turn in wanted):
+            keys[turn] = digest
+        if (turn < len(moves)):
+            digest = hashlib.sha256(f"{digest}|{moves[turn][0]}{moves[turn][1]}".encode()).hexdigest()
+    return keys
+
+###########
+### キャッシュから解析結果を取得する関数
+### 読み込みのみで書き込みのトランザクションを開かないため、各プロセスの検索は並行して行える
+### (ヒット数・ミス数と使用日時はメモリに貯め、一定間隔でまとめて書き込む)
+### 戻り値: {手数: (AIの最善手, 最善手の評価値, 探索数, 最善手と次善手の評価値の差)}
+###########
+def lookup(position_keys):
+    global _pending_hits, _pending_misses
+    turns_by_key = {}
+    for turn, key in position_keys.items():
+        turns_by_key.setdefault(key, []).append(turn)
+    keys = list(turns_by_key)
+
+    found = {}
+    with _lock:
+        connection = get_connection()
+        for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[i : i + LOOKUP_BATCH_SIZE]
+            rows = connection.execute(
+                "SELECT key, best_move, score_lead, visits, score_gap FROM evaluations"
+                f" WHERE key IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+            for key, *evaluation in rows:
+                for turn in turns_by_key[key]:
+                    found[turn] = tuple(evaluation)
+                _pending_used_keys.add(key)
+
+        _pending_hits += len(found)
+        _pending_misses += len(position_keys) - len(found)
+        if (time.monotonic() - _last_usage_flush >= config.EVALUATION_CACHE_FLUSH_INTERVAL):
+            _flush_usage(connection)
+    return found
+
+###########
+### メモリに貯めたヒット数・ミス数と使用日時をデータベースに書き込む関数 (_lock を取得して呼び出す)
+###########
+def _flush_usage(connection):
+    global _pending_hits, _pending_misses, _pending_used_keys, _last_usage_flush
+    _last_usage_flush = time.monotonic()
+    if ((_pending_hits == 0) and (_pending_misses == 0) and (not _pending_used_keys)):
+        return
+    now = time.time()
+    with connection:
+        # 使用日時の更新 (古いものから削除するため)
+        connection.executemany(
+            "UPDATE evaluations SET last_used = ? WHERE key = ?", [(now, key) for key in _pending_used_keys]
+        )
+        # ヒット数・ミス数の記録
+        connection.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (_pending_hits,))
+        connection.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (_pending_misses,))
+    _pending_hits, _pending_misses, _pending_used_keys = 0, 0, set()
+
+###########
+### メモリに貯めたヒット数・ミス数と使用日時を書き込む関数
+###########
+def flush_usage():
+    with _lock:
+        if ((_connection is None) or (_connection_pid != os.getpid())):
+            return
+        try:
+            _flush_usage(_connection)
+        except sqlite3.Error as e:
+            print(f"警告: キャッシュの使用状況を書き込めません - {e}")
+
+###########
+### 解析結果をキャッシュに保存する関数
+### evaluations: {手数: (AIの最善手, 最善手の評価値, 探索数, 最善手と次善手の評価値の差)}
+###########
+def store(position_keys, evaluations):
+    global _inserts_since_eviction
+    if (not evaluations):
+        return
+
+    with _lock:
+        connection = get_connection()
+        now = time.time()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO evaluations"
+                " (key, best_move, score_lead, visits, last_used, score_gap) VALUES (?, ?, ?, ?, ?, ?)",
+                [(position_keys[turn], best_move, score_lead, visits, now, score_gap)
+                 for turn, (best_move, score_lead, visits, score_gap) in evaluations.items()]
+            )
+        _inserts_since_eviction += len(evaluations)
+        # 書き込みのついでに、貯めたヒット数・ミス数と使用日時も書き込む
+        _flush_usage(connection)
+
+        # 一定件数ごとに容量を確認し、上限を超えた分を使用日時の古い順に削除
+        if (_inserts_since_eviction >= config.EVALUATION_CACHE_EVICTION_INTERVAL):
+            _inserts_since_eviction = 0
+            with connection:
+                count = connection.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+                if (count > config.EVALUATION_CACHE_MAX_ENTRIES):
+                    connection.execute(
+                        "DELETE FROM evaluations WHERE key IN "
+                        "(SELECT key FROM evaluations ORDER BY last_used LIMIT ?)",
+                        (count - config.EVALUATION_CACHE_MAX_ENTRIES,)
+                    )
+
+###########
+### キャッシュのヒット数・ミス数を取得する関数
+###########
+def get_stats():
+    with _lock:
+        connection = get_connection()
+        _flush_usage(connection)
+        rows = connection.execute("SELECT name, value FROM stats").fetchall()
+    return dict(rows)
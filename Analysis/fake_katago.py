@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# /**
+#  * fake_katago.py
+#  * KataGoの解析エンジン (analysis) の代わりに動作するプログラム
+#  * KataGo本体とモデルがない環境で、解析の流れの確認や処理時間の計測に使う
+#  * (config.KATAGO_PATH にこのファイルのパスを指定する)
+#  *
+#  * 評価値と最善手は局面 (これまでの着手) だけから決まる疑似的な値で、同じ局面には常に同じ値を返す
+#  * (実際に次に打たれた手は見ないため、1手ごと・1局一括のどちらの問い合わせ方でも同じ結果になる)
+#  * 動作は環境変数で変更する
+#  *   FAKE_KATAGO_SECONDS_PER_VISIT : 探索1回あたりの待ち時間(秒) (既定: 0)
+#  *   FAKE_KATAGO_STARTUP_SECONDS   : 起動にかかる時間(秒) (既定: 0)
+#  *   FAKE_KATAGO_THREADS           : 同時に解析する局面数 (既定: 8)
+#  *   FAKE_KATAGO_LOCAL_RATE        : 最善手を直前の着手の周囲から選ぶ割合 (既定: 0.4)
+#  *   FAKE_KATAGO_STATS_PATH        : 終了時に処理件数と処理時間を1行のJSONで追記するファイル (既定: なし)
+#  */
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# KataGoが起動を知らせる標準エラー出力の行
+READY_MESSAGE = "Started, ready to begin handling requests"
+# 最善手が pass の場合の次善手
+SECOND_MOVE_AFTER_PASS = "D16"
+# GTP形式の列の文字 (I を除く)
+GTP_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+
+SECONDS_PER_VISIT = float(os.environ.get("FAKE_KATAGO_SECONDS_PER_VISIT", "0"))
+STARTUP_SECONDS = float(os.environ.get("FAKE_KATAGO_STARTUP_SECONDS", "0"))
+NUM_THREADS = int(os.environ.get("FAKE_KATAGO_THREADS", "8"))
+LOCAL_RATE = float(os.environ.get("FAKE_KATAGO_LOCAL_RATE", "0.4"))
+STATS_PATH = os.environ.get("FAKE_KATAGO_STATS_PATH")
+
+_output_lock = threading.Lock()
+_terminated_lock = threading.Lock()
+_terminated_ids = set() # 中止 (terminate) されたリクエストのID
+_stats_lock = threading.Lock()
+# 処理件数と処理時間 (queries: リクエスト数, positions: 解析した局面数, query_seconds: 受信から最後の応答までの時間の合計)
+_stats = {'queries': 0, 'positions': 0, 'visits': 0, 'query_seconds': 0.0, 'max_query_seconds': 0.0}
+
+###########
+### 応答を1行のJSONとして標準出力に書き込む関数
+###########
+def write_response(response):
+    with _output_lock:
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+###########
+### 局面と条件から決まるハッシュ値を返す関数
+###########
+def position_hash(query, turn_number):
+    key = json.dumps([
+        query.get("moves", [])[:turn_number], query.get("initialStones", []),
+        query.get("boardXSize"), query.get("komi"), query.get("rules")
+    ])
+    return hashlib.md5(key.encode()).digest()
+
+###########
+### GTP形式の座標を (列, 行) に変換する関数 (pass・読めない座標は None)
+###########
+def parse_gtp_move(move):
+    try:
+        return GTP_COLUMNS.index(move[0].upper()), int(move[1:]) - 1
+    except (ValueError, IndexError):
+        return None
+
+###########
+### 局面の最善手を選ぶ関数 (その局面までの着手だけを使う)
+### 一定の割合で直前の着手の周囲の空点、それ以外は盤上の空点から、局面のハッシュで選ぶ
+### (石が取られることは考えず、一度打たれた点は空点としない)
+###########
+def choose_best_move(previous_moves, board_size, digest):
+    points = [parse_gtp_move(move) for _, move in previous_moves]
+    occupied = {point for point in points if point is not None}
+
+    candidates = []
+    if (points and (points[-1] is not None) and (digest[0] / 256 < LOCAL_RATE)):
+        last_column, last_row = points[-1]
+        candidates = [
+            (last_column + dc, last_row + dr) for dc in (-1, 0, 1) for dr in (-1, 0, 1)
+            if ((0 <= last_column + dc < board_size) and (0 <= last_row + dr < board_size))
+        ]
+        candidates = [point for point in candidates if point not in occupied]
+    if (not candidates):
+        candidates = [
+            (column, row) for column in range(board_size) for row in range(board_size)
+            if (column, row) not in occupied
+        ]
+    if (not candidates):
+        return "pass"
+    column, row = candidates[int.from_bytes(digest[1:5], 'big') % len(candidates)]
+    return f"{GTP_COLUMNS[column]}{row + 1}"
+
+###########
+### 1局面の疑似的な解析結果を返す関数
+###########
+def evaluate_position(query, turn_number):
+    digest = position_hash(query, turn_number)
+    max_visits = int(query.get("maxVisits", 1000))
+    moves = query.get("moves", [])
+    board_size = int(query.get("boardXSize", 19))
+    best_move = choose_best_move(moves[:turn_number], board_size, digest)
+
+    # 評価値 (-15目〜+15目) と、最善手と次善手の差 (0〜5目)
+    score_lead = round((int.from_bytes(digest[5:7], 'big') / 65535 - 0.5) * 30, 3)
+    score_gap = round(digest[7] / 255 * 5, 3)
+    second_move = "pass" if (best_move != "pass") else SECOND_MOVE_AFTER_PASS
+
+    if (SECONDS_PER_VISIT > 0):
+        time.sleep(max_visits * SECONDS_PER_VISIT)
+
+    return {
+        "id": query["id"],
+        "isDuringSearch": False,
+        "turnNumber": turn_number,
+        "moveInfos": [
+            {"move": best_move, "order": 0, "scoreLead": score_lead, "visits": max_visits * 3 // 4},
+            {"move": second_move, "order": 1, "scoreLead": round(score_lead - score_gap, 3), "visits": max_visits // 4}
+        ],
+        "rootInfo": {"scoreLead": score_lead, "visits": max_visits}
+    }
+
+###########
+### 1つのリクエストを処理する関数 (解析する局面ごとに応答を返す)
+###########
+def handle_query(query, executor):
+    received_time = time.time()
+
+    if (query.get("action") == "query_version"):
+        write_response({"id": query.get("id"), "version": "fake", "git_hash": "fake"})
+        return
+    if (query.get("action") == "terminate"):
+        # 未処理の局面は解析せずに終える (KataGoと同じく、中止を受け付けたことを応答する)
+        with _terminated_lock:
+            _terminated_ids.add(query.get("terminateId"))
+        write_response({"id": query.get("id"), "action": "terminate", "terminateId": query.get("terminateId")})
+        return
+    if ("action" in query):
+        write_response({"id": query.get("id"), "error": f"unsupported action: {query['action']}"})
+        return
+    if ("moves" not in query):
+        write_response({"id": query.get("id"), "error": "missing field: moves"})
+        return
+
+    analyze_turns = query.get("analyzeTurns", [len(query["moves"])])
+    remaining = [len(analyze_turns)]
+    remaining_lock = threading.Lock()
+
+    def analyze_turn(turn_number):
+        with _terminated_lock:
+            is_terminated = (query["id"] in _terminated_ids)
+        if (not is_terminated):
+            write_response(evaluate_position(query, turn_number))
+        with remaining_lock:
+            remaining[0] -= 1
+            is_last = (remaining[0] == 0)
+        if (is_last):
+            record_query(len(analyze_turns), int(query.get("maxVisits", 1000)), time.time() - received_time)
+
+    for turn_number in analyze_turns:
+        executor.submit(analyze_turn, turn_number)
+
+###########
+### 処理件数と処理時間を記録する関数
+###########
+def record_query(num_positions, max_visits, seconds):
+    with _stats_lock:
+        _stats['queries'] += 1
+        _stats['positions'] += num_positions
+        _stats['visits'] += num_positions * max_visits
+        _stats['query_seconds'] += seconds
+        _stats['max_query_seconds'] = max(_stats['max_query_seconds'], seconds)
+
+###########
+### メイン関数 (標準入力が閉じられるまでリクエストを処理する)
+###########
+def main():
+    start_time = time.time()
+    if (STARTUP_SECONDS > 0):
+        time.sleep(STARTUP_SECONDS)
+    sys.stderr.write(f"{READY_MESSAGE}\n")
+    sys.stderr.flush()
+
+    with ThreadPoolExecutor(max_workers=NUM_THREADS) as executor:
+        for line in sys.stdin:
+            line = line.strip()
+            if (not line):
+                continue
+            try:
+                query = json.loads(line)
+            except json.JSONDecodeError as e:
+                write_response({"error": f"could not parse json: {e}"})
+                continue
+            handle_query(query, executor)
+
+    # 標準入力が閉じられたら、処理中のリクエストを終えてから終了する (KataGoと同じ動作)
+    if (STATS_PATH):
+        with open(STATS_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(_stats, pid=os.getpid(), seconds=time.time() - start_time)) + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,12 @@
 import subprocess
 import json
 import time
+import itertools
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 from config import config
+import evaluation_cache
+import metrics
 import sgf_utils
 
 ###########
@@ -51,56 +56,251 @@ def start_katago_process():
         return None
 
 ###########
-### KataGoに解析を依頼し、評価値を取得する関数
+### 1つのKataGoに複数のリクエストを同時に送り、応答をIDごとに振り分けるクライアント
 ###########
-def get_evaluation_and_scorediff(katago_proc, board_size, moves_before_player_move, sgf_move, player_color):
-    # 各リクエストにユニークなIDを割り当てる
-    req_id_before = f"analysis_before_{time.time()}"
-    req_id_after = f"analysis_after_{time.time()}"
-    
-    gtp_player_move = sgf_utils.sgf_to_gtp(sgf_move)
+class KataGoClient:
+    def __init__(self, proc):
+        self.proc = proc
+        self._write_lock = threading.Lock()   # 標準入力への書き込みを保護
+        self._pending_lock = threading.Lock() # 応答待ちのリクエストを保護
+        self._pending = {}                    # ID -> (Future, 応答待ちの手数, 受信済みの応答)
+        self._id_counter = itertools.count()
+        self._closed = False
+        self._last_response_time = time.monotonic() # 最後に応答を受け取った時刻
+        self.failed = False                   # 応答のないリクエストがあったか (死活確認が必要)
 
-    # 1回目の解析リクエスト
-    input_data_before = {
-        "id": req_id_before,
-        "moves": moves_before_player_move,               # これまでの着手
-        "initialStones": [],                             # 盤上の初期配置
-        "boardXSize": board_size,                        # 碁盤の横の大きさ
-        "boardYSize": board_size,                        # 碁盤の縦の大きさ
-        "komi": 6.5,                                     # コミ(目)
-        "rules": "japanese",                             # ルールセット
-        "analyzeTurns": [len(moves_before_player_move)], # 解析対象の手
-    }
+        # 応答の読み取りと標準エラー出力の読み捨てを別スレッドで行う
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
 
-    try:
-        katago_proc.stdin.write(json.dumps(input_data_before) + "\n")
-        katago_proc.stdin.flush()
-        
-        # 1回目の応答が来るまで読み取りを繰り返す
+    ###########
+    ### リクエストを送信し、全応答がそろうと完了するFutureを返す関数
+    ### Futureの結果は {手数: 応答} の辞書 (action のリクエストは {None: 応答})
+    ### on_response を指定すると、応答が1つ届くたびに呼び出す
+    ###########
+    def submit(self, query, on_response=None):
+        req_id = f"req_{next(self._id_counter)}"
+        query = dict(query, id=req_id)
+        future = Future()
+        pending_turns = set(query.get("analyzeTurns", [])) or {None}
+        if ("analyzeTurns" in query):
+            # 解析リクエストの待ち時間を計測 (エラーで終わった場合も含む)
+            metrics.query_started()
+            start_time = time.monotonic()
+            future.add_done_callback(lambda _: metrics.query_finished(time.monotonic() - start_time))
+
+        with self._pending_lock:
+            if (self._closed):
+                future.set_exception(IOError("KataGoプロセスは終了しています。"))
+                return future
+            self._pending[req_id] = (future, pending_turns, {}, on_response)
+
+        try:
+            self._send(query)
+        except Exception as e:
+            with self._pending_lock:
+                self._pending.pop(req_id, None)
+            future.set_exception(e)
+        return future
+
+    ###########
+    ### リクエストを1行のJSONとしてKataGoの標準入力に書き込む関数
+    ###########
+    def _send(self, query):
+        with self._write_lock:
+            self.proc.stdin.write(json.dumps(query) + "\n")
+            self.proc.stdin.flush()
+
+    ###########
+    ### リクエストを送信し、全応答がそろうまで待つ関数
+    ### timeout はKataGoの応答が途絶えてから待つのをやめるまでの時間
+    ### (他のリクエストを含め、応答が届くたびに待ち直すため、長いリクエストも打ち切らない)
+    ###########
+    def query(self, query, timeout=None, on_response=None):
+        future = self.submit(query, on_response)
+        if (timeout is None):
+            return future.result()
+
+        start_time = time.monotonic()
         while True:
-            line = katago_proc.stdout.readline()
-            if (not line):
-                raise IOError("KataGoプロセスが予期せず終了しました。")
-            
+            remaining = max(self._last_response_time, start_time) + timeout - time.monotonic()
+            if (remaining <= 0):
+                # 応答がないリクエストは待つのをやめてエラーにし、次の取得時に死活確認させる
+                self.failed = True
+                self._abandon(future)
+                return future.result(timeout=0) # 取り消したリクエストはタイムアウトのエラーになる
             try:
-                response = json.loads(line)
-                # リクエストIDと応答のIDが一致するか確認
-                if (response.get("id") == req_id_before):
-                    # 応答に 'moveInfos' が存在するか確認
-                    if ('moveInfos' in response):
-                        ai_best_move = response['moveInfos'][0]['move']
-                        ai_best_score = response['moveInfos'][0]['scoreLead']
-                        break # 正しい応答を見つけたらループを抜ける
-                    else:
-                        print(f"警告: KataGoからの応答に 'moveInfos' が見つかりません。応答: {response}")
-                        # 無関係な応答なので、次の行を読み取る
-                        return None, None, None, None, None
-            except json.JSONDecodeError as e:
-                # JSON形式でないログ行は無視して次の行へ
-                print(f"警告: JSON形式でない行を無視します。行: {line.strip()}")
-                return None, None, None, None, None
-    except Exception as e:
-        print(f"KataGo応答解析中にエラーが発生しました (1回目): {e}")
+                return future.result(timeout=remaining)
+            except FutureTimeoutError:
+                continue # 待っている間に応答が届いていれば待ち直す
+
+    ###########
+    ### 応答待ちのリクエストを取り消し、Futureをエラーにする関数
+    ### KataGoにも解析の中止 (terminate) を送り、取り消したリクエストの探索を続けさせない
+    ###########
+    def _abandon(self, future):
+        with self._pending_lock:
+            req_ids = [req_id for req_id, entry in self._pending.items() if entry[0] is future]
+            for req_id in req_ids:
+                del self._pending[req_id]
+        for req_id in req_ids:
+            try:
+                self._send({"id": f"{req_id}_terminate", "action": "terminate", "terminateId": req_id})
+            except Exception as e:
+                print(f"警告: 解析の中止を送信できませんでした: {e}")
+        if (req_ids):
+            future.set_exception(FutureTimeoutError("KataGoの応答がタイムアウトしました。"))
+
+    ###########
+    ### KataGoの応答を読み取り、対応するFutureに振り分ける関数 (読み取りスレッド)
+    ###########
+    def _read_responses(self):
+        try:
+            for line in self.proc.stdout:
+                self._last_response_time = time.monotonic()
+                try:
+                    response = json.loads(line)
+                except json.JSONDecodeError:
+                    # JSON形式でないログ行は無視して次の行へ
+                    print(f"警告: JSON形式でない行を無視します。行: {line.strip()}")
+                    continue
+                self._dispatch(response)
+        except Exception as e:
+            print(f"KataGo応答の読み取り中にエラーが発生しました: {e}")
+        finally:
+            # プロセスが終了したら、応答待ちのリクエストを全てエラーにする
+            with self._pending_lock:
+                self._closed = True
+                pending, self._pending = self._pending, {}
+            for future, _, _, _ in pending.values():
+                future.set_exception(IOError("KataGoプロセスが予期せず終了しました。"))
+
+    ###########
+    ### 1つの応答を対応するリクエストに格納する関数
+    ###########
+    def _dispatch(self, response):
+        req_id = response.get("id")
+        if ('warning' in response and 'error' not in response):
+            return # 警告のみの応答は解析結果を含まない
+
+        with self._pending_lock:
+            entry = self._pending.get(req_id)
+            if (entry is None):
+                return # 無関係な応答
+            future, pending_turns, responses, on_response = entry
+
+            if ('error' in response):
+                del self._pending[req_id]
+                future.set_exception(ValueError(f"KataGoがリクエストを拒否しました。応答: {response}"))
+                return
+
+            turn_number = response.get("turnNumber")
+            pending_turns.discard(turn_number)
+            responses[turn_number] = response
+            is_complete = (not pending_turns)
+            if (is_complete):
+                del self._pending[req_id]
+
+        if (turn_number is not None):
+            metrics.record_position(response.get('rootInfo', {}).get('visits'))
+
+        if (on_response is not None):
+            try:
+                on_response(turn_number, response)
+            except Exception as e:
+                print(f"警告: 応答の処理中にエラーが発生しました: {e}")
+        if (is_complete):
+            future.set_result(responses)
+
+    ###########
+    ### KataGoの標準エラー出力を読み捨てる関数 (パイプの詰まりを防ぐ)
+    ###########
+    def _drain_stderr(self):
+        try:
+            for _ in self.proc.stderr:
+                pass
+        except Exception:
+            pass
+
+    ###########
+    ### KataGoプロセスが動作中かを返す関数
+    ###########
+    def is_alive(self):
+        return (not self._closed) and (self.proc.poll() is None)
+
+    ###########
+    ### 応答待ちのリクエストがなくなってからKataGoプロセスを終了する関数 (別スレッドで待つ)
+    ### 再起動時に使い、他のスレッドが送信済みのリクエストを途中で打ち切らない
+    ###########
+    def retire(self, timeout=None):
+        def close_when_idle():
+            while (self.is_alive()):
+                with self._pending_lock:
+                    if (not self._pending):
+                        break
+                time.sleep(1)
+            self.close(timeout=timeout)
+        threading.Thread(target=close_when_idle, daemon=True).start()
+
+    ###########
+    ### KataGoプロセスを終了する関数
+    ###########
+    def close(self, timeout=None):
+        try:
+            # 標準入力を閉じると、KataGoは処理中のリクエストを終えて終了する
+            with self._write_lock:
+                self.proc.stdin.close()
+            self.proc.wait(timeout=timeout)
+        except Exception:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=timeout)
+            except Exception:
+                self.proc.kill()
+
+###########
+### 解析リクエストを作成する関数
+###########
+def build_query(board_size, moves, analyze_turns, max_visits=None):
+    return {
+        "moves": moves,                 # これまでの着手
+        "initialStones": [],            # 盤上の初期配置
+        "boardXSize": board_size,       # 碁盤の横の大きさ
+        "boardYSize": board_size,       # 碁盤の縦の大きさ
+        "komi": config.KOMI,            # コミ(目)
+        "rules": config.RULES,          # ルールセット
+        "analyzeTurns": analyze_turns,  # 解析対象の手
+        "maxVisits": max_visits or config.MAX_VISITS, # 1局面あたりの探索数
+    }
+
+###########
+### 応答から最善手とその評価値を取り出す関数
+###########
+def get_best_move_and_score(response):
+    if (response.get('moveInfos')):
+        return response['moveInfos'][0]['move'], response['moveInfos'][0]['scoreLead']
+    print(f"警告: KataGoからの応答に 'moveInfos' が見つかりません。応答: {response}")
+    return None, None
+
+###########
+### 1局面を解析し、最善手とその評価値を取得する関数
+###########
+def get_position_evaluation(katago_client, board_size, moves, on_evaluation=None):
+    evaluations = get_game_evaluations(katago_client, board_size, moves, [len(moves)], on_evaluation=on_evaluation)
+    if ((evaluations is None) or (len(moves) not in evaluations)):
+        return None, None
+    return evaluations[len(moves)]
+
+###########
+### KataGoに解析を依頼し、評価値を取得する関数
+###########
+def get_evaluation_and_scorediff(katago_client, board_size, moves_before_player_move, sgf_move, player_color):
+    gtp_player_move = sgf_utils.sgf_to_gtp(sgf_move)
+
+    # 1回目の解析リクエスト
+    ai_best_move, ai_best_score = get_position_evaluation(katago_client, board_size, moves_before_player_move)
+    if (ai_best_move is None):
         return None, None, None, None, None
 
     # プレイヤーの着手とAIが考える最善手が同じ場合
@@ -110,46 +310,161 @@ def get_evaluation_and_scorediff(katago_proc, board_size, moves_before_player_mo
 
     # 2回目の解析リクエスト
     moves_after_player_move = moves_before_player_move + [[('b' if len(moves_before_player_move) % 2 == 0 else 'w'), gtp_player_move]]
-    input_data_after = { # 項目は1回目と同じ
-        "id": req_id_after,
-        "moves": moves_after_player_move,
-        "initialStones": [],
-        "boardXSize": board_size,
-        "boardYSize": board_size,
-        "komi": 6.5,
-        "rules": "japanese",
-        "analyzeTurns": [len(moves_after_player_move)],
-    }
-    
-    try:
-        katago_proc.stdin.write(json.dumps(input_data_after) + "\n")
-        katago_proc.stdin.flush()
-        
-        # 2回目の応答が来るまで読み取りを繰り返す
-        while True:
-            line = katago_proc.stdout.readline()
-            if (not line):
-                raise IOError("KataGoプロセスが予期せず終了しました。")
-            
-            try:
-                response = json.loads(line)
-                if response.get("id") == req_id_after:
-                    if ('moveInfos' in response):
-                        player_score = response['moveInfos'][0]['scoreLead']
-                        break
-                    else:
-                        print(f"警告: KataGoからの応答に 'moveInfos' が見つかりません。応答: {response}")
-                        return None, None, None, None, None
-            except json.JSONDecodeError as e:
-                print(f"警告: JSON形式でない行を無視します。行: {line.strip()}")
-                return None, None, None, None, None
-
-    except Exception as e:
-        print(f"KataGo応答解析中にエラーが発生しました (2回目): {e}")
+    _, player_score = get_position_evaluation(katago_client, board_size, moves_after_player_move)
+    if (player_score is None):
         return None, None, None, None, gtp_player_move
     
     # 評価値の差を計算 (プレイヤーの手の評価値 - AIの評価値)
     score_diff = player_score - ai_best_score
 
     # 着手の評価値、最善手の評価値、評価値の差、AIの最善手を返す
-    return player_score, ai_best_score, score_diff, ai_best_move, gtp_player_move
\ No newline at end of file
+    return player_score, ai_best_score, score_diff, ai_best_move, gtp_player_move
+
+###########
+### 応答から最善手と次善手の評価値の差を取り出す関数
+###########
+def get_score_gap(response):
+    move_infos = response.get('moveInfos') or []
+    if (len(move_infos) < 2):
+        return None
+    return abs(move_infos[0]['scoreLead'] - move_infos[1]['scoreLead'])
+
+###########
+### 指定した探索数で複数の局面を1回のリクエストで解析する関数 (キャッシュにある局面は問い合わせない)
+### on_evaluation を指定すると、局面の評価が届くたびに (手数, AIの最善手, 最善手の評価値, 探索数) で呼び出す
+### 戻り値: ({手数: (AIの最善手, 最善手の評価値, 探索数, 最善手と次善手の評価値の差)}, 実際に使った探索数)
+###########
+def get_position_details(katago_client, board_size, game_moves, analyze_turns, max_visits, on_evaluation=None):
+    details = {}
+    pending_turns = sorted(analyze_turns)
+    if (not pending_turns):
+        return details, 0
+
+    # キャッシュから取得
+    if (config.USE_EVALUATION_CACHE):
+        position_keys = evaluation_cache.make_position_keys(board_size, game_moves, pending_turns, max_visits)
+        details.update(evaluation_cache.lookup(position_keys))
+        pending_turns = [turn for turn in pending_turns if turn not in details]
+        if (not pending_turns):
+            return details, 0
+
+    # 届いた応答を1つずつ通知
+    on_response = None
+    if (on_evaluation is not None):
+        def on_response(turn_number, response):
+            ai_best_move, ai_best_score = get_best_move_and_score(response)
+            if (ai_best_move is not None):
+                on_evaluation(turn_number, ai_best_move, ai_best_score, max_visits)
+
+    try:
+        # 応答は手数の順不同で届くため、全手数がそろうまで待つ
+        responses = katago_client.query(
+            build_query(board_size, game_moves, pending_turns, max_visits), 
+            timeout=config.ENGINE_QUERY_TIMEOUT,
+            on_response=on_response
+        )
+    except Exception as e:
+        print(f"KataGo応答解析中にエラーが発生しました (1局一括): {e}")
+        return None, 0
+
+    new_details = {} # キャッシュへの保存用
+    visits_spent = 0
+    for turn_number, response in responses.items():
+        visits = response.get('rootInfo', {}).get('visits')
+        visits_spent += visits or 0
+        ai_best_move, ai_best_score = get_best_move_and_score(response)
+        if (ai_best_move is not None):
+            new_details[turn_number] = (ai_best_move, ai_best_score, visits, get_score_gap(response))
+    details.update(new_details)
+
+    if (config.USE_EVALUATION_CACHE):
+        evaluation_cache.store(position_keys, new_details)
+
+    return details, visits_spent
+
+###########
+### 1局分の全局面を1回のリクエストで解析し、手数ごとの評価値を取得する関数
+### (解析済み・キャッシュにある局面は問い合わせない)
+###########
+def get_game_evaluations(katago_client, board_size, game_moves, analyze_turns, known_evaluations=None, on_evaluation=None):
+    known_evaluations = known_evaluations or {}
+    # 手数 -> (AIの最善手, 最善手の評価値)
+    evaluations = {turn: known_evaluations[turn] for turn in analyze_turns if turn in known_evaluations}
+    pending_turns = [turn for turn in analyze_turns if turn not in evaluations]
+
+    details, _ = get_position_details(
+        katago_client, board_size, game_moves, pending_turns, config.MAX_VISITS, on_evaluation
+    )
+    if (details is None):
+        return None
+    for turn, (ai_best_move, ai_best_score, _, _) in details.items():
+        evaluations[turn] = (ai_best_move, ai_best_score)
+
+    return evaluations
+
+###########
+### 判定が微妙な手番を求める関数 (探索数を増やして再解析する対象)
+### ・着手が最善手と一致したが、次善手との差が小さい
+### ・着手が最善手と異なり、評価値の差が「好手/悪手」の境界(0)に近い
+###########
+def find_uncertain_turns(game_moves, details):
+    uncertain_turns = set()
+    for turn, (color, gtp_move) in enumerate(game_moves):
+        if (turn not in details):
+            continue
+        ai_best_move, ai_best_score, _, score_gap = details[turn]
+
+        if (gtp_move == ai_best_move):
+            if ((score_gap is not None) and (score_gap < config.ADAPTIVE_BEST_MOVE_MARGIN)):
+                uncertain_turns.add(turn)
+        elif ((turn + 1) in details):
+            score_diff = details[turn + 1][1] - ai_best_score
+            if (abs(score_diff) < config.ADAPTIVE_SCORE_MARGIN):
+                uncertain_turns.update((turn, turn + 1))
+    return uncertain_turns
+
+###########
+### 少ない探索数から始め、判定が微妙な局面だけ探索数を増やして再解析する関数
+### visit_schedule: 段階ごとの探索数 (例: [100, 300, 1000])
+### on_settled を指定すると、途中の段階で確定した (再解析しない) 局面を (手数のリスト, 探索数) で通知する
+### 戻り値: ({手数: (AIの最善手, 最善手の評価値)}, 実際に使った探索数)
+###########
+def get_game_evaluations_adaptive(
+        katago_client, board_size, game_moves, analyze_turns, visit_schedule, 
+        known_evaluations=None, on_evaluation=None, on_settled=None
+    ):
+    known_evaluations = known_evaluations or {}
+    # 解析済みの局面は十分な探索数で解析されているものとして扱う
+    details = {
+        turn: known_evaluations[turn] + (None, None) 
+        for turn in analyze_turns if turn in known_evaluations
+    }
+    pending_turns = [turn for turn in analyze_turns if turn not in details]
+    total_visits = 0
+
+    for level, max_visits in enumerate(visit_schedule):
+        new_details, visits_spent = get_position_details(
+            katago_client, board_size, game_moves, pending_turns, max_visits, on_evaluation
+        )
+        if (new_details is None):
+            if (level == 0):
+                return None, total_visits
+            break # 再解析に失敗した場合は前の段階の結果を使う
+        details.update(new_details)
+        total_visits += visits_spent
+
+        if (level == len(visit_schedule) - 1):
+            break # 上限の探索数に達した
+
+        # 判定が微妙な局面を次の段階の探索数で再解析
+        pending_turns = sorted(
+            turn for turn in find_uncertain_turns(game_moves, details) 
+            if turn not in known_evaluations
+        )
+        if (on_settled is not None):
+            on_settled(sorted(set(new_details) - set(pending_turns)), max_visits)
+        if (not pending_turns):
+            break
+
+    evaluations = {turn: (detail[0], detail[1]) for turn, detail in details.items()}
+    return evaluations, total_visits
@@ -0,0 +1,127 @@
+# /**
+#  * loss_store.py
+#  * 1手ごとの損失を、1局1行の float32 の2次元配列(.npy形式)として保存する
+#  * (Estimateでは numpy.load(mmap_mode='r') でテキストを解析せずに読み込める)
+#  */
+
+import ast
+import math
+import os
+import struct
+
+# .npy形式 (version 1.0) のヘッダー
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# ヘッダーの長さ (行数が増えても書き直せるよう固定長にする, 64の倍数)
+HEADER_LENGTH = 128
+# 要素の型 (リトルエンディアンの float32)
+DTYPE = '<f4'
+ITEM_SIZE = 4
+
+###########
+### .npy形式のヘッダーを作成する関数
+###########
+def make_header(num_rows, num_columns):
+    header = f"{{'descr': '{DTYPE}', 'fortran_order': False, 'shape': ({num_rows}, {num_columns}), }}"
+    # マジック(8バイト) + ヘッダー長(2バイト) + ヘッダー + 改行 が HEADER_LENGTH になるよう空白で埋める
+    header = header.ljust(HEADER_LENGTH - len(NPY_MAGIC) - 2 - 1) + "\n"
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+###########
+### .npy形式のヘッダーを読み込む関数
+### 戻り値: (行数, 列数)
+###########
+def read_header(f):
+    f.seek(0)
+    if (f.read(len(NPY_MAGIC)) != NPY_MAGIC):
+        raise ValueError("対応していない形式の損失ファイルです")
+    header_length = struct.unpack('<H', f.read(2))[0]
+    header = ast.literal_eval(f.read(header_length).decode('latin1'))
+    if ((header['descr'] != DTYPE) or header['fortran_order'] or (len(NPY_MAGIC) + 2 + header_length != HEADER_LENGTH)):
+        raise ValueError("対応していない形式の損失ファイルです")
+    return header['shape']
+
+###########
+### 損失の1行をバイト列に変換する関数 (空欄は NaN)
+###########
+def pack_row(losses, num_columns):
+    values = [math.nan if (value is None) else value for value in losses[:num_columns]]
+    values += [math.nan] * (num_columns - len(values))
+    return struct.pack(f'<{num_columns}f', *values)
+
+###########
+### 損失ファイルを開いたまま、行を追記するクラス
+###########
+class LossStore:
+    def __init__(self, npy_path, num_columns):
+        self._num_columns = num_columns
+        if (os.path.exists(npy_path) and (os.path.getsize(npy_path) > 0)):
+            self._file = open(npy_path, mode='r+b')
+            self._num_rows, stored_columns = read_header(self._file)
+            if (stored_columns != num_columns):
+                self._file.close()
+                raise ValueError(f"損失ファイルの列数 ({stored_columns}) が解析手数 ({num_columns}) と一致しません")
+            # ヘッダーの行数より後ろは書きかけのデータ
+            self._file.truncate(HEADER_LENGTH + self._num_rows * num_columns * ITEM_SIZE)
+        else:
+            self._file = open(npy_path, mode='w+b')
+            self._num_rows = 0
+            self._file.write(make_header(0, num_columns))
+        self._file.seek(0, os.SEEK_END)
+
+    def __len__(self):
+        return self._num_rows
+
+    ###########
+    ### 行を追記する関数
+    ###########
+    def append(self, rows):
+        self.append_raw([pack_row(row, self._num_columns) for row in rows])
+
+    ###########
+    ### バイト列に変換済みの行を追記し、ヘッダーの行数を書き直す関数
+    ###########
+    def append_raw(self, raw_rows):
+        if (not raw_rows):
+            return
+        self._file.seek(HEADER_LENGTH + self._num_rows * self._num_columns * ITEM_SIZE)
+        self._file.write(b"".join(raw_rows))
+        self._file.flush()
+        # データを書き終えてから行数を更新 (中断時も読み込める状態を保つ)
+        self._num_rows += len(raw_rows)
+        self._file.seek(0)
+        self._file.write(make_header(self._num_rows, self._num_columns))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+###########
+### 損失ファイルの行数を返す関数 (ファイルがなければ 0)
+###########
+def count_rows(npy_path):
+    if ((not os.path.exists(npy_path)) or (os.path.getsize(npy_path) == 0)):
+        return 0
+    with open(npy_path, mode='rb') as f:
+        num_rows, _ = read_header(f)
+    return num_rows
+
+###########
+### 損失ファイルの行を読み込む関数
+### 戻り値: (行のバイト列のリスト, 列数)
+###########
+def read_raw_rows(npy_path):
+    with open(npy_path, mode='rb') as f:
+        num_rows, num_columns = read_header(f)
+        f.seek(HEADER_LENGTH)
+        row_size = num_columns * ITEM_SIZE
+        data = f.read(num_rows * row_size)
+    return [data[i * row_size : (i + 1) * row_size] for i in range(num_rows)], num_columns
+
+###########
+### 損失ファイルを指定した行だけに書き直す関数
+###########
+def keep_rows(npy_path, row_indices):
+    raw_rows, num_columns = read_raw_rows(npy_path)
+    with open(npy_path, mode='wb') as f:
+        f.write(make_header(len(row_indices), num_columns))
+        f.write(b"".join(raw_rows[i] for i in row_indices))
@@ -7,48 +7,118 @@
 # */
 
 import multiprocessing as mp
-from multiprocessing import Manager
 import os
 import sys
 import glob
 import analysis
 from config import config
+import evaluation_cache
+import metrics
+import opening_planner
+import result_writer
+import resume
+
+###########
+### 一覧ファイルからSGFファイルのパスを読み込む関数
+### 相対パスは一覧ファイルのあるディレクトリからのパスとして扱う
+###########
+def read_input_manifest(manifest_path):
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    sgf_files = set()
+    num_missing = 0
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            path = line.strip()
+            if (not path):
+                continue
+            path = os.path.join(manifest_dir, path)
+            if (not os.path.exists(path)):
+                num_missing += 1
+                continue
+            sgf_files.add(path)
+    if (num_missing > 0):
+        print(f"警告: 一覧ファイルの {num_missing} 件のSGFファイルが見つかりません")
+    return list(sgf_files)
 
 ###########
 ### 並列で解析を行う関数
 ###########
 def run_parallel_analysis():
     # SGFファイルパスのリストを取得
-    sgf_files = glob.glob(os.path.join(config.INPUT_DIR, '**', '*.sgf'), recursive=True) 
+    if (config.INPUT_MANIFEST):
+        input_source = config.INPUT_MANIFEST
+        sgf_files = read_input_manifest(config.INPUT_MANIFEST)
+    else:
+        input_source = config.INPUT_DIR
+        sgf_files = glob.glob(os.path.join(config.INPUT_DIR, '**', '*.sgf'), recursive=True) 
     sgf_files.sort()
     if (not sgf_files):
-        print(f"エラー: SGFファイル '{config.INPUT_DIR}' が見つかりません")
+        print(f"エラー: SGFファイル '{input_source}' が見つかりません")
         sys.exit(1)
+
+    # 前回中断した実行のシャードファイルを結合
+    result_writer.merge_shards()
+
+    # 再開モード: 出力済みの棋譜を除外 (途中まで書かれた行はCSVから取り除く)
+    num_finished = 0
+    if (config.RESUME):
+        finished_files = resume.collect_finished_files()
+        num_all = len(sgf_files)
+        sgf_files = [path for path in sgf_files if os.path.basename(path) not in finished_files]
+        num_finished = num_all - len(sgf_files)
     
     # 定数の値を表示
     print("=" * 60)
-    print(f"棋譜数      : {len(sgf_files)}")
-    print(f"入力フォルダ: {config.INPUT_DIR}")
+    print(f"棋譜数      : {len(sgf_files)} (出力済み {num_finished} 局を除く)")
+    print(f"入力フォルダ: {input_source}")
     print(f"出力フォルダ: {config.OUTPUT_DIR}")
     print(f"解析手数    : {config.MAX_MOVE_TO_ANALYSIS}")
     print(f"スレッド数  : {config.NUM_PROCESSES}")
+    print(f"同時解析数  : {config.GAMES_PER_ENGINE} 局/KataGo")
     print("=" * 60 + "\n")
+    if (not sgf_files):
+        print("--- 全ての棋譜が解析済みです ---")
+        return
+
+    if (config.USE_EVALUATION_CACHE):
+        initial_cache_stats = evaluation_cache.get_stats()
+
+    # 計測を開始 (各プロセスの計測値を一定間隔で集計し、ファイルと進捗の表示に出力)
+    metrics_queue, metrics_reporter = metrics.start_reporter(len(sgf_files))
+
+    # 解析結果の書き込み専用プロセスを起動 (各プロセスはキューへ結果を送るだけ)
+    result_queue, writer_process = result_writer.start_writer_process(metrics_queue)
+
+    # 解析の並列処理 (各プロセスでKataGoを1度だけ起動し、全棋譜で使い回す)
+    with mp.Pool(
+            processes=config.NUM_PROCESSES, initializer=analysis.init_worker, initargs=(result_queue, metrics_queue)
+        ) as pool:
+        # 複数の対局で共通する序盤の局面を先に1度だけ解析
+        known_evaluations = {}
+        if (config.SHARE_OPENING_EVALUATIONS):
+            known_evaluations = opening_planner.evaluate_shared_openings(pool, sgf_files)
+
+        # 1タスク = 1局 (各プロセスは常駐スレッドで同時解析数まで対局を並行して解析する)
+        tasks = [(path, known_evaluations.get(path)) for path in sgf_files]
+        for _ in pool.imap_unordered(analysis.submit_game, tasks):
+            pass
+        # プロセスを正常終了させ、常駐しているKataGoを終了させる
+        pool.close()
+        pool.join()
+
+    # 残りの結果の書き込みを待ち、シャードモードでは各プロセスのファイルを結合
+    result_writer.stop_writer_process(result_queue, writer_process)
+    result_writer.merge_shards()
+    metrics.stop_reporter(metrics_reporter)
+    print("\n--- 全ての棋譜の並列解析が完了 ---")
 
-    # ManagerとLockの生成、並列処理の実行
-    with Manager() as manager:
-        # Managerを使って共有ロックオブジェクトを生成し、CSVアクセスを保護
-        csv_lock = manager.Lock() 
-        
-        tasks = []
-        for filepath in sgf_files:
-            # タスクリストの構築
-            tasks.append((filepath, csv_lock))
-
-        # 解析の並列処理
-        with mp.Pool(processes=config.NUM_PROCESSES) as pool:
-            pool.starmap(analysis.analyze_game, tasks)
-        
-        print("\n--- 全ての棋譜の並列解析が完了 ---")
+    # キャッシュのヒット率を表示
+    if (config.USE_EVALUATION_CACHE):
+        cache_stats = evaluation_cache.get_stats()
+        hits = cache_stats['hits'] - initial_cache_stats['hits']
+        misses = cache_stats['misses'] - initial_cache_stats['misses']
+        hit_rate = hits / (hits + misses) if ((hits + misses) > 0) else 0
+        print(f"キャッシュ  : ヒット {hits} / ミス {misses} (ヒット率 {hit_rate * 100:.1f}%)")
 
 if __name__ == '__main__':
     run_parallel_analysis()
\ No newline at end of file
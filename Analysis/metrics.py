@@ -0,0 +1,360 @@
+# /**
+#  * metrics.py
+#  * 解析中の計測値 (クエリの待ち時間・処理中のクエリ数・局面数・探索数・1局の処理時間・書き込み待ちの局数など)
+#  * 各プロセスは自分の累計値を一定間隔でキューに送り、親プロセスが合計してファイルに書き出す
+#  */
+
+import copy
+import json
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing import util
+from config import config
+import evaluation_cache
+
+# クエリの待ち時間 (送信から全応答がそろうまで) のヒストグラムの区切り(秒)
+QUERY_SECONDS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+# 1局の処理時間のヒストグラムの区切り(秒)
+GAME_SECONDS_BUCKETS = [1, 5, 10, 30, 60, 120, 300, 600, 1800]
+
+# このプロセスの累計値 (計測しない場合は None)
+_values = None
+_values_lock = threading.Lock()
+# 累計値の送り先 (親プロセスへ)
+_metrics_queue = None
+
+###########
+### 累計値の初期値を返す関数
+###########
+def new_values():
+    return {
+        'queries': 0,                 # 完了したクエリ数
+        'query_seconds': 0.0,         # クエリの待ち時間の合計
+        'query_buckets': [0] * (len(QUERY_SECONDS_BUCKETS) + 1),
+        'queries_in_flight': 0,       # 応答待ちのクエリ数
+        'positions': 0,               # 解析された局面数
+        'visits': 0,                  # 探索数の合計
+        'games': 0,                   # 処理した局数 (エラーを含む)
+        'game_errors': 0,             # エラーで終わった局数
+        'game_seconds': 0.0,          # 1局の処理時間の合計
+        'game_buckets': [0] * (len(GAME_SECONDS_BUCKETS) + 1),
+        'parse_seconds': 0.0,         # SGFの読み込みにかかった時間の合計
+        'results_submitted': 0,       # 書き込みに回した局数
+        'results_written': 0,         # ファイルに書き込んだ局数
+        'write_seconds': 0.0,         # ファイルへの書き込みにかかった時間の合計
+    }
+
+###########
+### 区切りのリストから、値が入るヒストグラムの位置を返す関数
+###########
+def get_bucket_index(buckets, value):
+    for i, upper_bound in enumerate(buckets):
+        if (value <= upper_bound):
+            return i
+    return len(buckets)
+
+###########
+### 累計値に加算する関数 (計測しない場合は何もしない)
+###########
+def add(name, amount=1):
+    if (_values is None):
+        return
+    with _values_lock:
+        _values[name] += amount
+
+###########
+### クエリの送信を記録する関数
+###########
+def query_started():
+    add('queries_in_flight')
+
+###########
+### クエリの完了 (全応答の受信またはエラー) を記録する関数
+###########
+def query_finished(seconds):
+    if (_values is None):
+        return
+    with _values_lock:
+        _values['queries_in_flight'] -= 1
+        _values['queries'] += 1
+        _values['query_seconds'] += seconds
+        _values['query_buckets'][get_bucket_index(QUERY_SECONDS_BUCKETS, seconds)] += 1
+
+###########
+### 1局面の応答を記録する関数
+###########
+def record_position(visits):
+    if (_values is None):
+        return
+    with _values_lock:
+        _values['positions'] += 1
+        _values['visits'] += visits or 0
+
+###########
+### 1局の処理の終了を記録する関数
+###########
+def record_game(seconds, is_error=False):
+    if (_values is None):
+        return
+    with _values_lock:
+        _values['games'] += 1
+        _values['game_errors'] += int(is_error)
+        _values['game_seconds'] += seconds
+        _values['game_buckets'][get_bucket_index(GAME_SECONDS_BUCKETS, seconds)] += 1
+
+###########
+### このプロセスの累計値を親プロセスへ送る関数
+###########
+def send_values():
+    if ((_values is None) or (_metrics_queue is None)):
+        return
+    with _values_lock:
+        values = copy.deepcopy(_values)
+    try:
+        _metrics_queue.put((os.getpid(), values))
+    except Exception:
+        pass # 計測値が送れなくても解析は続ける
+
+###########
+### 一定間隔で累計値を送り続ける関数 (デーモンスレッド)
+###########
+def run_sender():
+    while (True):
+        time.sleep(config.METRICS_INTERVAL)
+        send_values()
+
+###########
+### 解析・書き込みを行うプロセスの起動時に、計測値の送り先を設定する関数 (initializer)
+###########
+def init_worker(metrics_queue):
+    global _values, _metrics_queue
+    if (metrics_queue is None):
+        return
+    _values = new_values()
+    _metrics_queue = metrics_queue
+    threading.Thread(target=run_sender, daemon=True).start()
+    # プロセスの正常終了時に最後の値を送る
+    # (キューの送信スレッドは優先度 10 の終了処理で止まるため、それより先に実行する)
+    util.Finalize(None, send_values, exitpriority=20)
+
+###########
+### 各プロセスの累計値を受け取って合計し、一定間隔でファイルと進捗を出力するクラス (親プロセス)
+###########
+class MetricsReporter:
+    def __init__(self, num_games):
+        self.queue = mp.Queue()
+        self._num_games = num_games
+        self._latest_values = {} # プロセスID -> 累計値
+        self._start_time = time.monotonic()
+        self._last_report = None # 前回出力した時刻と合計値 (1秒あたりの値の計算用)
+        self._stop_event = threading.Event()
+        self._initial_cache_stats = evaluation_cache.get_stats() if (config.USE_EVALUATION_CACHE) else None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    ###########
+    ### 累計値を受け取り、一定間隔で出力する関数 (スレッド)
+    ###########
+    def _run(self):
+        next_report_time = time.monotonic() + config.METRICS_INTERVAL
+        while (not self._stop_event.is_set()):
+            self._receive(timeout=max(0.0, min(1.0, next_report_time - time.monotonic())))
+            if (time.monotonic() >= next_report_time):
+                self.report()
+                next_report_time = time.monotonic() + config.METRICS_INTERVAL
+
+    ###########
+    ### キューにある累計値を受け取る関数
+    ###########
+    def _receive(self, timeout):
+        try:
+            pid, values = self.queue.get(timeout=timeout)
+            self._latest_values[pid] = values
+            while (True):
+                pid, values = self.queue.get_nowait()
+                self._latest_values[pid] = values
+        except queue.Empty:
+            pass
+
+    ###########
+    ### 全プロセスの累計値を合計する関数
+    ###########
+    def get_totals(self):
+        totals = new_values()
+        for values in list(self._latest_values.values()):
+            for name, value in values.items():
+                if (isinstance(value, list)):
+                    totals[name] = [a + b for a, b in zip(totals[name], value)]
+                else:
+                    totals[name] += value
+        return totals
+
+    ###########
+    ### 合計値から出力する値 (1秒あたりの値・残り時間など) を計算する関数
+    ###########
+    def get_snapshot(self):
+        now = time.monotonic()
+        totals = self.get_totals()
+        elapsed = now - self._start_time
+
+        # 前回の出力からの1秒あたりの値
+        last_time, last_totals = self._last_report or (self._start_time, new_values())
+        interval = max(now - last_time, 1e-9)
+        self._last_report = (now, totals)
+
+        # 全体の平均の速度から残り時間を推定
+        games_per_second = totals['games'] / elapsed if (elapsed > 0) else 0.0
+        remaining_games = max(0, self._num_games - totals['games'])
+        eta_seconds = remaining_games / games_per_second if (games_per_second > 0) else None
+
+        snapshot = dict(
+            totals,
+            timestamp=time.time(),
+            elapsed_seconds=elapsed,
+            games_target=self._num_games,
+            games_remaining=remaining_games,
+            games_per_second=games_per_second,
+            eta_seconds=eta_seconds,
+            positions_per_second=(totals['positions'] - last_totals['positions']) / interval,
+            visits_per_second=(totals['visits'] - last_totals['visits']) / interval,
+            writer_queue_depth=totals['results_submitted'] - totals['results_written'],
+        )
+
+        # キャッシュのヒット率 (今回の実行の分)
+        if (self._initial_cache_stats is not None):
+            try:
+                cache_stats = evaluation_cache.get_stats()
+                snapshot['cache_hits'] = cache_stats['hits'] - self._initial_cache_stats['hits']
+                snapshot['cache_misses'] = cache_stats['misses'] - self._initial_cache_stats['misses']
+                lookups = snapshot['cache_hits'] + snapshot['cache_misses']
+                snapshot['cache_hit_ratio'] = snapshot['cache_hits'] / lookups if (lookups > 0) else 0.0
+            except Exception:
+                pass
+        return snapshot
+
+    ###########
+    ### 計測値をファイルに書き出し、進捗を表示する関数
+    ###########
+    def report(self):
+        snapshot = self.get_snapshot()
+        try:
+            if (config.METRICS_FORMAT == "jsonl"):
+                with open(config.METRICS_PATH, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+            else:
+                # 読み込み途中のファイルが見えないよう、一時ファイルに書いてから置き換える
+                temp_path = f"{config.METRICS_PATH}.tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(format_prometheus(snapshot))
+                os.replace(temp_path, config.METRICS_PATH)
+        except Exception as e:
+            print(f"警告: 計測値の書き出しに失敗 - {e}")
+        print(format_progress(snapshot))
+
+    ###########
+    ### 残りの累計値を受け取り、最後の値を出力して終了する関数
+    ###########
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        self._receive(timeout=0.5)
+        self.report()
+
+###########
+### 進捗の1行を作成する関数
+###########
+def format_progress(snapshot):
+    games = snapshot['games']
+    games_target = snapshot['games_target']
+    percent = games / games_target * 100 if (games_target > 0) else 100.0
+    eta = format_seconds(snapshot['eta_seconds']) if (snapshot['eta_seconds'] is not None) else "--"
+    line = (
+        f"[進捗] {games}/{games_target} 局 ({percent:.1f}%) | {snapshot['games_per_second'] * 60:.2f} 局/分"
+        f" | 局面 {snapshot['positions_per_second']:.1f}/秒 | 探索 {snapshot['visits_per_second']:.0f}/秒"
+        f" | 応答待ち {snapshot['queries_in_flight']} | 書き込み待ち {snapshot['writer_queue_depth']} 局"
+    )
+    if ('cache_hit_ratio' in snapshot):
+        line += f" | キャッシュ {snapshot['cache_hit_ratio'] * 100:.1f}%"
+    return line + f" | 経過 {format_seconds(snapshot['elapsed_seconds'])} | 残り {eta}"
+
+###########
+### 秒数を 時:分:秒 の文字列にする関数
+###########
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+###########
+### ヒストグラムを Prometheus のテキスト形式の行にする関数
+###########
+def format_histogram(name, buckets, counts, total_seconds):
+    lines = [f"# TYPE {name} histogram"]
+    cumulative = 0
+    for upper_bound, count in zip(buckets + ["+Inf"], counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{upper_bound}"}} {cumulative}')
+    lines.append(f"{name}_sum {total_seconds}")
+    lines.append(f"{name}_count {cumulative}")
+    return lines
+
+###########
+### 計測値を Prometheus のテキスト形式にする関数
+###########
+def format_prometheus(snapshot):
+    counters = [
+        ('analysis_queries_total', 'queries'),
+        ('analysis_positions_total', 'positions'),
+        ('analysis_visits_total', 'visits'),
+        ('analysis_games_total', 'games'),
+        ('analysis_game_errors_total', 'game_errors'),
+        ('analysis_parse_seconds_total', 'parse_seconds'),
+        ('analysis_results_written_total', 'results_written'),
+        ('analysis_write_seconds_total', 'write_seconds'),
+        ('analysis_cache_hits_total', 'cache_hits'),
+        ('analysis_cache_misses_total', 'cache_misses'),
+    ]
+    gauges = [
+        ('analysis_queries_in_flight', 'queries_in_flight'),
+        ('analysis_positions_per_second', 'positions_per_second'),
+        ('analysis_visits_per_second', 'visits_per_second'),
+        ('analysis_games_per_second', 'games_per_second'),
+        ('analysis_games_remaining', 'games_remaining'),
+        ('analysis_eta_seconds', 'eta_seconds'),
+        ('analysis_writer_queue_depth', 'writer_queue_depth'),
+        ('analysis_cache_hit_ratio', 'cache_hit_ratio'),
+        ('analysis_elapsed_seconds', 'elapsed_seconds'),
+    ]
+    lines = []
+    for metric_type, metrics in (('counter', counters), ('gauge', gauges)):
+        for name, key in metrics:
+            if (snapshot.get(key) is None):
+                continue
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {snapshot[key]}")
+    lines += format_histogram(
+        'analysis_query_seconds', QUERY_SECONDS_BUCKETS, snapshot['query_buckets'], snapshot['query_seconds']
+    )
+    lines += format_histogram(
+        'analysis_game_seconds', GAME_SECONDS_BUCKETS, snapshot['game_buckets'], snapshot['game_seconds']
+    )
+    return "\n".join(lines) + "\n"
+
+###########
+### 計測を開始する関数 (親プロセス)
+### 戻り値: (各プロセスから累計値を受け取るキュー, MetricsReporter)  計測しない場合は (None, None)
+###########
+def start_reporter(num_games):
+    if (config.METRICS_INTERVAL <= 0):
+        return None, None
+    reporter = MetricsReporter(num_games)
+    return reporter.queue, reporter
+
+###########
+### 計測を終了する関数 (親プロセス)
+###########
+def stop_reporter(reporter):
+    if (reporter is not None):
+        reporter.stop()
@@ -0,0 +1,136 @@
+# /**
+#  * opening_planner.py
+#  * 複数の対局で共通する序盤の局面をまとめて1度だけ解析する
+#  */
+
+from config import config
+import analysis
+import engine_pool
+import katago_analyzer
+import sgf_utils
+
+###########
+### 着手列の木(トライ)のノードを作成する関数
+###########
+def new_node():
+    return {'count': 0, 'children': {}, 'evaluation': None}
+
+###########
+### 棋譜から盤面サイズとKataGo入力用の着手列を読み込む関数 (並列処理用)
+###########
+def load_game_moves(sgf_file_path):
+    try:
+        # 序盤の手数までのみ読み込む
+        game = sgf_utils.load_game_record(
+            sgf_file_path, min(config.MAX_MOVE_TO_ANALYSIS, config.OPENING_PREFIX_MAX_MOVES)
+        )
+        return game.board_size, [[color, sgf_utils.sgf_to_gtp(sgf_move)] for color, sgf_move in game.moves]
+    except Exception as e:
+        print(f"警告: {sgf_file_path} の序盤を読み込めません : {e}")
+        return None
+
+###########
+### 全対局の序盤の着手列から木(トライ)を構築する関数
+### ノード = 局面 (深さ k のノード = k手目の着手前の局面)
+###########
+def build_opening_trie(games):
+    roots = {} # 盤面サイズ -> 根ノード(初期局面)
+    for board_size, moves in games.values():
+        node = roots.setdefault(board_size, new_node())
+        node['count'] += 1
+        for move in moves[:config.OPENING_PREFIX_MAX_MOVES]:
+            node = node['children'].setdefault(tuple(move), new_node())
+            node['count'] += 1
+    return roots
+
+###########
+### 2局以上が通過する局面を、1本の着手列につき1回のリクエストにまとめる関数
+### 戻り値: [(盤面サイズ, 着手列, 解析する手数, 対応するノード)]
+###########
+def plan_shared_queries(roots):
+    queries = []
+    for board_size, root in roots.items():
+        if (root['count'] < 2):
+            continue
+        # 共有されている部分木の葉までの経路ごとに、未割り当ての局面を解析対象とする
+        stack = [(root, [], [root])]
+        planned = set()
+        while (stack):
+            node, moves, path = stack.pop()
+            shared_children = [(move, child) for move, child in node['children'].items() if child['count'] >= 2]
+            if (shared_children):
+                for move, child in shared_children:
+                    stack.append((child, moves + [list(move)], path + [child]))
+                continue
+
+            turns = [turn for turn, path_node in enumerate(path) if id(path_node) not in planned]
+            planned.update(id(path_node) for path_node in path)
+            queries.append((board_size, moves, turns, [path[turn] for turn in turns]))
+    return queries
+
+###########
+### 序盤の局面を解析する関数
+### 各対局では解析済みの局面を再解析しないため、対局の解析で最終的に使う探索数で解析する
+### 戻り値: {手数: (AIの最善手, 最善手の評価値)}
+###########
+def evaluate_positions(board_size, moves, turns):
+    client = engine_pool.acquire_engine()
+    if (client is None):
+        return {}
+    details, _ = katago_analyzer.get_position_details(client, board_size, moves, turns, analysis.get_final_visits())
+    return {turn: (detail[0], detail[1]) for turn, detail in (details or {}).items()}
+
+###########
+### 複数のリクエストを対局の解析と同じ同時解析数で並行して解析する関数 (mp.Pool の1タスク)
+### 戻り値: リクエストごとの {手数: (AIの最善手, 最善手の評価値)} のリスト
+###########
+def evaluate_query_batch(batch):
+    futures = [analysis.submit_to_slot(evaluate_positions, board_size, moves, turns) for board_size, moves, turns in batch]
+    return [future.result() for future in futures]
+
+###########
+### 対局ごとに、共有された局面の解析結果を取り出す関数
+### 戻り値: {手数: (AIの最善手, 最善手の評価値)}
+###########
+def collect_known_evaluations(roots, board_size, moves):
+    known_evaluations = {}
+    node = roots.get(board_size)
+    turn = 0
+    while ((node is not None) and (node['count'] >= 2)):
+        if (node['evaluation'] is not None):
+            known_evaluations[turn] = node['evaluation']
+        if (turn >= len(moves)):
+            break
+        node = node['children'].get(tuple(moves[turn]))
+        turn += 1
+    return known_evaluations
+
+###########
+### 共通する序盤の局面を解析し、対局ごとに結果を振り分ける関数
+### 戻り値: {棋譜のパス: {手数: (AIの最善手, 最善手の評価値)}}
+###########
+def evaluate_shared_openings(pool, sgf_files):
+    # 全棋譜の序盤を読み込み、木を構築
+    loaded = pool.map(load_game_moves, sgf_files)
+    games = {path: game for path, game in zip(sgf_files, loaded) if game is not None}
+    roots = build_opening_trie(games)
+
+    # 共通する局面を1度だけ解析
+    # (1つのKataGoに GAMES_PER_ENGINE 件ずつ並行して送るため、その数倍ずつ各プロセスへ渡す)
+    queries = plan_shared_queries(roots)
+    requests = [(board_size, moves, turns) for board_size, moves, turns, _ in queries]
+    batch_size = config.GAMES_PER_ENGINE * 2
+    batches = [requests[i : i + batch_size] for i in range(0, len(requests), batch_size)]
+    results = [evaluations for batch_results in pool.imap(evaluate_query_batch, batches) for evaluations in batch_results]
+    num_positions = 0
+    for (_, _, turns, nodes), evaluations in zip(queries, results):
+        for turn, node in zip(turns, nodes):
+            node['evaluation'] = evaluations.get(turn)
+        num_positions += len(turns)
+    print(f"共通する序盤の局面: {num_positions} 局面 ({len(queries)} リクエスト)")
+
+    # 各対局へ振り分け
+    return {
+        path: collect_known_evaluations(roots, board_size, moves)
+        for path, (board_size, moves) in games.items()
+    }
@@ -1,4 +1,5 @@
 # output.py
 
-from csv_writer import write_summary_to_csv, write_detail_to_csv
+from csv_writer import get_summary_header, make_summary_rows, get_detail_header, make_detail_row
 from text_writer import write_log_to_text
+from result_writer import submit_result
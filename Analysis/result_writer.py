@@ -0,0 +1,256 @@
+# /**
+#  * result_writer.py
+#  * 解析結果のCSVへの書き込み
+#  * 各プロセスはキューに結果を送るだけにし、書き込み専用のプロセスがまとめて書き込む
+#  * (シャードモードでは各プロセスが自分専用のファイルに書き込み、最後に結合する)
+#  */
+
+import csv
+import glob
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
+from multiprocessing import util
+from config import config
+import csv_writer
+import loss_store
+import metrics
+import resume
+
+# このプロセスから結果を送るキュー (書き込み専用プロセスへ)
+_result_queue = None
+# シャードモードでこのプロセスが書き込むファイル
+_shard_writer = None
+# 詳細情報の基本情報の列数 (ファイル名, ランク(黒), プレイヤー(黒), プレイヤー(白))
+NUM_DETAIL_INFO_COLUMNS = 4
+
+###########
+### CSVファイルを開いたまま、行をまとめて書き込むクラス
+###########
+### detail_npy_path を指定した場合、損失は .npy に、基本情報は detail_csv_path に書き込む
+###########
+class ResultWriter:
+    def __init__(self, summary_csv_path, detail_csv_path, detail_npy_path=None):
+        self._lock = threading.Lock()
+        self._loss_store = None
+        if (detail_npy_path is not None):
+            self._loss_store = loss_store.LossStore(detail_npy_path, config.MAX_MOVE_TO_ANALYSIS)
+        self._summary_file = open_csv(summary_csv_path, csv_writer.get_summary_header())
+        self._detail_file = open_csv(detail_csv_path, get_detail_header(detail_npy_path))
+        self._summary_writer = csv.writer(self._summary_file)
+        self._detail_writer = csv.writer(self._detail_file)
+        self._pending_summary_rows = []
+        self._pending_detail_rows = []
+        self._pending_files = [] # 書き込み後に途中経過を削除する棋譜
+        self._last_flush_time = time.monotonic()
+
+    ###########
+    ### 1局分の行を追加する関数 (一定局数・一定時間ごとにファイルへ書き出す)
+    ###########
+    def add(self, sgf_file_path, summary_rows, detail_row):
+        with self._lock:
+            self._pending_summary_rows.extend(summary_rows)
+            self._pending_detail_rows.append(detail_row)
+            self._pending_files.append(sgf_file_path)
+            if ((len(self._pending_files) >= config.RESULT_BATCH_SIZE)
+                    or (time.monotonic() - self._last_flush_time >= config.RESULT_FLUSH_INTERVAL)):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush_time = time.monotonic()
+        if (not self._pending_files):
+            return
+        write_start_time = time.monotonic()
+        try:
+            # 統計情報 → 詳細情報の順に書き出す (再開時は両方そろった棋譜を出力済みとみなす)
+            self._summary_writer.writerows(self._pending_summary_rows)
+            self._summary_file.flush()
+            if (self._loss_store is not None):
+                # 損失 → 基本情報の順に書き出す (基本情報の行数が書き出し済みの局数となる)
+                self._loss_store.append([row[NUM_DETAIL_INFO_COLUMNS:] for row in self._pending_detail_rows])
+                self._detail_writer.writerows([row[:NUM_DETAIL_INFO_COLUMNS] for row in self._pending_detail_rows])
+            else:
+                self._detail_writer.writerows(self._pending_detail_rows)
+            self._detail_file.flush()
+        except Exception as e:
+            print(f"エラー: CSVファイルへの解析結果の書き込みに失敗 - {e}")
+            return
+        finally:
+            self._pending_summary_rows = []
+            self._pending_detail_rows = []
+            pending_files, self._pending_files = self._pending_files, []
+        metrics.add('write_seconds', time.monotonic() - write_start_time)
+        metrics.add('results_written', len(pending_files))
+
+        # 出力が完了したので途中経過は不要
+        if (config.RESUME):
+            for sgf_file_path in pending_files:
+                resume.remove_journal(sgf_file_path)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._summary_file.close()
+            self._detail_file.close()
+            if (self._loss_store is not None):
+                self._loss_store.close()
+
+###########
+### CSVを追記モードで開く関数 (新規・空のファイルならヘッダーを書き込む)
+###########
+def open_csv(csv_file, header):
+    f = open(csv_file, mode='a', newline='', encoding='utf-8-sig')
+    if (f.tell() == 0):
+        csv.writer(f).writerow(header)
+    return f
+
+###########
+### 詳細情報の出力先 (CSV, 損失の.npy) を返す関数
+### 戻り値: (CSVのパス, .npyのパス)  CSV形式で出力する場合 .npyのパスは None
+###########
+def get_detail_paths():
+    if (config.DETAIL_OUTPUT_FORMAT == "npy"):
+        return config.DETAIL_META_CSV_PATH, config.DETAIL_NPY_PATH
+    return config.DETAIL_CSV_PATH, None
+
+###########
+### 詳細情報のCSVのヘッダーを返す関数 (損失を.npyに書き出す場合は基本情報の列のみ)
+###########
+def get_detail_header(detail_npy_path):
+    header = csv_writer.get_detail_header()
+    if (detail_npy_path is not None):
+        return header[:NUM_DETAIL_INFO_COLUMNS]
+    return header
+
+###########
+### 書き込み専用プロセスの処理
+### キューから結果を受け取り、None を受け取ったら残りを書き出して終了する
+###########
+def run_writer_process(result_queue, metrics_queue=None):
+    metrics.init_worker(metrics_queue)
+    writer = ResultWriter(config.SUMMARY_CSV_PATH, *get_detail_paths())
+    try:
+        while (True):
+            try:
+                result = result_queue.get(timeout=config.RESULT_FLUSH_INTERVAL)
+            except queue.Empty:
+                writer.flush() # 結果が途切れた間に書き出す
+                continue
+            if (result is None):
+                break
+            writer.add(*result)
+    finally:
+        writer.close()
+
+###########
+### 書き込み専用プロセスを起動する関数
+### 戻り値: (結果を送るキュー, プロセス)  シャードモードでは (None, None)
+###########
+def start_writer_process(metrics_queue=None):
+    if (config.RESULT_SHARDS):
+        return None, None
+    result_queue = mp.Queue()
+    process = mp.Process(target=run_writer_process, args=(result_queue, metrics_queue))
+    process.start()
+    return result_queue, process
+
+###########
+### 書き込み専用プロセスを終了する関数 (全ての結果の書き込みを待つ)
+###########
+def stop_writer_process(result_queue, process):
+    if (process is None):
+        return
+    result_queue.put(None)
+    process.join()
+
+###########
+### mp.Poolの各プロセス起動時に結果の送り先を設定する関数
+###########
+def init_worker(result_queue):
+    global _result_queue, _shard_writer
+    _result_queue = result_queue
+    if (result_queue is None):
+        # シャードモード: このプロセス専用のファイルに書き込む
+        detail_csv_path, detail_npy_path = get_detail_paths()
+        _shard_writer = ResultWriter(
+            get_shard_path(config.SUMMARY_CSV_PATH),
+            get_shard_path(detail_csv_path),
+            get_shard_path(detail_npy_path) if (detail_npy_path is not None) else None
+        )
+        # プロセスの正常終了時に残りを書き出す
+        util.Finalize(None, _shard_writer.close, exitpriority=5)
+
+###########
+### 1局の解析結果を書き込みに回す関数
+###########
+def submit_result(
+        sgf_file_path,
+        all_move_data,
+        calculated_stats
+    ):
+    summary_rows = csv_writer.make_summary_rows(calculated_stats, sgf_file_path)
+    detail_row = csv_writer.make_detail_row(all_move_data, sgf_file_path, calculated_stats)
+    metrics.add('results_submitted')
+    if (_result_queue is not None):
+        _result_queue.put((sgf_file_path, summary_rows, detail_row))
+    elif (_shard_writer is not None):
+        _shard_writer.add(sgf_file_path, summary_rows, detail_row)
+    else:
+        raise Exception("解析結果の書き込み先が設定されていません")
+
+###########
+### このプロセスのシャードファイルのパスを返す関数
+###########
+def get_shard_path(csv_file):
+    return f"{csv_file}.shard-{os.getpid()}"
+
+###########
+### シャードファイルを本来の出力に結合し、削除する関数
+### (前回中断した実行のシャードも結合する)
+###########
+def merge_shards():
+    summary_shards = sorted(glob.glob(f"{glob.escape(config.SUMMARY_CSV_PATH)}.shard-*"))
+    if (summary_shards):
+        with open_csv(config.SUMMARY_CSV_PATH, csv_writer.get_summary_header()) as f:
+            writer = csv.writer(f)
+            for shard_file in summary_shards:
+                # 中断時に書きかけだった行は除く
+                _, rows, _ = resume.read_complete_rows(shard_file)
+                writer.writerows(rows)
+                f.flush()
+                os.remove(shard_file)
+
+    detail_csv_path, detail_npy_path = get_detail_paths()
+    detail_shards = sorted(glob.glob(f"{glob.escape(detail_csv_path)}.shard-*"))
+    if (not detail_shards):
+        return
+    store = None
+    if (detail_npy_path is not None):
+        store = loss_store.LossStore(detail_npy_path, config.MAX_MOVE_TO_ANALYSIS)
+    try:
+        with open_csv(detail_csv_path, get_detail_header(detail_npy_path)) as f:
+            writer = csv.writer(f)
+            for shard_file in detail_shards:
+                _, rows, _ = resume.read_complete_rows(shard_file)
+                if (store is not None):
+                    # 基本情報と損失の両方がそろった行のみ結合
+                    npy_shard_file = detail_npy_path + shard_file[len(detail_csv_path):]
+                    raw_rows = []
+                    if (os.path.exists(npy_shard_file)):
+                        raw_rows, _ = loss_store.read_raw_rows(npy_shard_file)
+                    rows = rows[:len(raw_rows)]
+                    store.append_raw(raw_rows[:len(rows)])
+                writer.writerows(rows)
+                f.flush()
+                os.remove(shard_file)
+                if ((store is not None) and os.path.exists(npy_shard_file)):
+                    os.remove(npy_shard_file)
+    finally:
+        if (store is not None):
+            store.close()
@@ -0,0 +1,228 @@
+# /**
+#  * resume.py
+#  * 中断した解析の再開 (1手ごとの途中経過の記録と、出力済みの棋譜の判定)
+#  */
+
+import csv
+import hashlib
+import json
+import os
+import threading
+from config import config
+import loss_store
+
+###########
+### 棋譜ごとの途中経過ファイルのパスを返す関数
+### 別のフォルダにある同じ名前の棋譜と混ざらないよう、絶対パスのハッシュを付ける
+###########
+def get_journal_path(sgf_file_path):
+    sgf_filename = os.path.basename(sgf_file_path)
+    path_hash = hashlib.sha256(os.path.abspath(sgf_file_path).encode()).hexdigest()[:16]
+    return os.path.join(config.JOURNAL_DIR, f"{sgf_filename}.{path_hash}.jsonl")
+
+###########
+### 途中経過が同じ対局・同じ条件のものかを確かめるハッシュを返す関数
+### (盤面サイズ, コミ, ルール, モデル, 着手列)
+###########
+def make_game_key(board_size, game_moves):
+    key = json.dumps([board_size, config.KOMI, config.RULES, os.path.basename(config.MODEL_FILE), game_moves])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+###########
+### 途中経過を1局面ずつ追記するクラス
+### 新しいファイルの1行目には対局と条件のハッシュ (game_key) を書き込む
+###########
+class GameJournal:
+    def __init__(self, sgf_file_path, game_key):
+        os.makedirs(config.JOURNAL_DIR, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(get_journal_path(sgf_file_path), mode='a', encoding='utf-8')
+        if (self._file.tell() == 0):
+            self._file.write(json.dumps({'game_key': game_key}) + "\n")
+            self._file.flush()
+
+    ###########
+    ### 局面の評価を1行追記する関数 (KataGoの応答が届くたびに呼び出される)
+    ###########
+    def record(self, turn, ai_best_move, ai_best_score, max_visits):
+        line = json.dumps({
+            'turn': turn,
+            'best_move': ai_best_move,
+            'score_lead': ai_best_score,
+            'max_visits': max_visits
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    ###########
+    ### 探索数を増やさずに確定した局面を1行追記する関数 (適応モードの各段階の終了時に呼び出される)
+    ###########
+    def settle(self, turns, max_visits):
+        line = json.dumps({'settled': turns, 'max_visits': max_visits})
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+###########
+### 途中経過を読み込む関数
+### 1行目のハッシュが game_key と異なる (別の対局・条件の) 途中経過は削除し、使わない
+### 確定した局面のみ返す: {手数: (AIの最善手, 最善手の評価値)}
+### (final_visits の探索数で解析された局面と、適応モードでその探索数のまま確定した局面)
+###########
+def load_journal(sgf_file_path, game_key, final_visits):
+    evaluations = {}
+    journal_path = get_journal_path(sgf_file_path)
+    if (not os.path.exists(journal_path)):
+        return evaluations
+
+    with open(journal_path, mode='r', encoding='utf-8') as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError:
+            header = None
+        if ((not isinstance(header, dict)) or (header.get('game_key') != game_key)):
+            print(f"警告: {os.path.basename(sgf_file_path)} の途中経過は別の対局・条件のものなので破棄します")
+            f.close()
+            remove_journal(sgf_file_path)
+            return evaluations
+
+        latest = {}  # 手数 -> (AIの最善手, 最善手の評価値, 探索数)
+        settled = {} # 手数 -> 確定した探索数
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue # 中断時に書きかけだった行
+            if ('settled' in entry):
+                settled.update((turn, entry['max_visits']) for turn in entry['settled'])
+            else:
+                # 同じ手数は後の行(探索数を増やした再解析)で上書き
+                latest[entry['turn']] = (entry['best_move'], entry['score_lead'], entry['max_visits'])
+
+    for turn, (ai_best_move, ai_best_score, max_visits) in latest.items():
+        if ((max_visits == final_visits) or (settled.get(turn) == max_visits)):
+            evaluations[turn] = (ai_best_move, ai_best_score)
+    return evaluations
+
+###########
+### 途中経過ファイルを削除する関数 (出力の書き出し後に呼び出す)
+###########
+def remove_journal(sgf_file_path):
+    try:
+        os.remove(get_journal_path(sgf_file_path))
+    except FileNotFoundError:
+        pass
+
+###########
+### CSVを読み込み、列数のそろった行と書きかけの行数を返す関数
+###########
+def read_complete_rows(csv_file):
+    if (not os.path.exists(csv_file)):
+        return None, [], 0
+    with open(csv_file, mode='r', newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    if (not rows):
+        return None, [], 0
+    header = rows[0]
+    # 中断時に書きかけだった行は列数が足りない
+    complete_rows = [row for row in rows[1:] if len(row) == len(header)]
+    return header, complete_rows, len(rows) - 1 - len(complete_rows)
+
+###########
+### 出力済みの棋譜の行(1局につき rows_per_game 行)の位置を求める関数
+###########
+def select_rows(rows, finished_files, rows_per_game):
+    kept_indices = []
+    counts = {}
+    for i, row in enumerate(rows):
+        if ((row[0] in finished_files) and (counts.get(row[0], 0) < rows_per_game)):
+            kept_indices.append(i)
+            counts[row[0]] = counts.get(row[0], 0) + 1
+    return kept_indices
+
+###########
+### CSVを指定した行だけに書き直す関数
+###########
+def write_rows(csv_file, header, rows):
+    with open(csv_file, mode='w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+###########
+### CSVを出力済みの棋譜の行だけ(1局につき rows_per_game 行)に書き直す関数
+###########
+def rewrite_rows(csv_file, header, rows, num_incomplete, finished_files, rows_per_game):
+    kept_indices = select_rows(rows, finished_files, rows_per_game)
+    removed = len(rows) - len(kept_indices) + num_incomplete
+    if (removed > 0):
+        write_rows(csv_file, header, [rows[i] for i in kept_indices])
+    return removed
+
+###########
+### 詳細情報(基本情報のCSV + 損失の.npy)を出力済みの棋譜の行だけに書き直す関数
+###########
+def rewrite_npy_rows(csv_file, npy_file, header, rows, num_incomplete, num_stored, finished_files):
+    kept_indices = select_rows(rows, finished_files, 1)
+    removed = len(rows) - len(kept_indices) + num_incomplete
+    if ((removed > 0) or (num_stored != len(rows))):
+        write_rows(csv_file, header, [rows[i] for i in kept_indices])
+        loss_store.keep_rows(npy_file, kept_indices)
+    return removed
+
+###########
+### 詳細情報の行を読み込む関数
+### 損失を.npyに書き出す場合、損失が書き出されていない行は書きかけとみなす
+### 戻り値: (ヘッダー, 行, 書きかけの行数, .npyの行数)
+###########
+def read_detail_rows():
+    if (config.DETAIL_OUTPUT_FORMAT != "npy"):
+        return (*read_complete_rows(config.DETAIL_CSV_PATH), None)
+    header, rows, num_incomplete = read_complete_rows(config.DETAIL_META_CSV_PATH)
+    num_stored = loss_store.count_rows(config.DETAIL_NPY_PATH)
+    num_incomplete += max(len(rows) - num_stored, 0)
+    return header, rows[:num_stored], num_incomplete, num_stored
+
+###########
+### 統計情報と詳細情報の両方が出力済みの棋譜を求め、
+### 途中まで書かれた行・重複した行を出力から取り除く関数
+### 戻り値: 出力済みの棋譜のファイル名の集合
+###########
+def collect_finished_files():
+    summary_header, summary_rows, summary_incomplete = read_complete_rows(config.SUMMARY_CSV_PATH)
+    detail_header, detail_rows, detail_incomplete, num_stored = read_detail_rows()
+    # 統計情報は1局につき黒白の2行
+    summary_counts = {}
+    for row in summary_rows:
+        summary_counts[row[0]] = summary_counts.get(row[0], 0) + 1
+    finished_files = {
+        row[0] for row in detail_rows if summary_counts.get(row[0], 0) >= 2
+    }
+
+    # 1局につき1組の行となるよう、出力途中の行と重複した行を取り除く
+    removed = 0
+    if (summary_header is not None):
+        removed += rewrite_rows(
+            config.SUMMARY_CSV_PATH, summary_header, summary_rows, summary_incomplete, finished_files, 2
+        )
+    if ((detail_header is None) and num_stored):
+        # 基本情報が1行も書かれていない損失は取り除く
+        loss_store.keep_rows(config.DETAIL_NPY_PATH, [])
+    elif ((detail_header is not None) and (num_stored is not None)):
+        removed += rewrite_npy_rows(
+            config.DETAIL_META_CSV_PATH, config.DETAIL_NPY_PATH,
+            detail_header, detail_rows, detail_incomplete, num_stored, finished_files
+        )
+    elif (detail_header is not None):
+        removed += rewrite_rows(
+            config.DETAIL_CSV_PATH, detail_header, detail_rows, detail_incomplete, finished_files, 1
+        )
+    if (removed > 0):
+        print(f"出力途中・重複した行を削除: {removed} 行")
+
+    return finished_files
@@ -3,8 +3,22 @@
 #  * SGFファイルの読み込みや座標変換など、SGF関連のユーティリティ関数
 #  */
 
-import sgf     # type:ignore
+import re
+from collections import namedtuple
 import chardet # type:ignore
+from config import config
+
+# 1局の対局情報と本譜の着手 [(色, SGF座標)]
+GameRecord = namedtuple(
+    'GameRecord', ['board_size', 'black_player', 'white_player', 'black_rank', 'white_rank', 'moves']
+)
+
+# SGFの字句 (分岐の開始・終了, ノード, 属性名, 属性値)
+SGF_TOKEN_PATTERN = re.compile(r'[();]|[A-Za-z]+|\[(?:[^\\\]]|\\.)*\]', re.DOTALL)
+# 属性値のエスケープ
+ESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+# 情報ノードから取得する属性 (盤面サイズ・プレイヤー名・ランク)
+ROOT_PROPERTIES = ('SZ', 'PB', 'PW', 'BR', 'WR')
 
 ###########
 ### SGF形式の座標(x,y) を GTP形式(col,rol) に変換する関数
@@ -29,31 +43,86 @@ def sgf_to_gtp(sgf_move_coords):
     return f"{col_gtp}{row_gtp}"
 
 ###########
-### SGFファイルを読み込み、ゲーム情報を取得する関数
+### SGFファイルを文字列として読み込む関数
+### UTF-8として読めない場合のみ、先頭部分から文字コードを推定する
 ###########
-def load_sgf_and_get_game_info(sgf_file_path):
-    # ファイルの文字コードを自動で検出
+def read_sgf_text(sgf_file_path):
     with open(sgf_file_path, 'rb') as f:
         raw_data = f.read()
-        detected_encoding = chardet.detect(raw_data)['encoding']
-        if detected_encoding is None:
-            # 検出できなかった場合、一般的なエンコーディングを試行
-            detected_encoding = 'utf-8' 
-    
-    # 検出された文字コードでファイルを読み込み
-    with open(sgf_file_path, 'r', encoding=detected_encoding, errors='ignore') as f:
-        sgf_string = f.read()
-    
-    # テキストを解析できる形式に変換
-    collection = sgf.parse(sgf_string)
-    game_tree = collection.children[0]
-
-    # ボードサイズ・プレイヤー名・ランクを取得
-    board_size = int(game_tree.root.properties.get('SZ', [19])[0])
-    black_player = game_tree.root.properties.get('PB', [None])[0]
-    white_player = game_tree.root.properties.get('PW', [None])[0]
-    black_rank = game_tree.root.properties.get('BR', [None])[0]
-    white_rank = game_tree.root.properties.get('WR', [None])[0]
-
-    # 取得した値を返す
-    return game_tree, board_size, black_player, white_player, black_rank, white_rank
\ No newline at end of file
+
+    try:
+        return raw_data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        pass
+
+    # ファイルの文字コードを先頭部分から検出
+    detected_encoding = chardet.detect(raw_data[:config.SGF_ENCODING_DETECT_BYTES])['encoding']
+    if detected_encoding is None:
+        # 検出できなかった場合、一般的なエンコーディングを試行
+        detected_encoding = 'utf-8'
+    try:
+        return raw_data.decode(detected_encoding, errors='ignore')
+    except LookupError:
+        return raw_data.decode('utf-8', errors='ignore')
+
+###########
+### ノードの着手を着手リストに追加する関数 (黒の着手を優先)
+###########
+def append_node_move(moves, node_moves):
+    if ('B' in node_moves):
+        moves.append(('b', node_moves['B']))
+    elif ('W' in node_moves):
+        moves.append(('w', node_moves['W']))
+
+###########
+### SGFファイルを読み込み、対局情報と本譜の着手を取得する関数
+### 先頭から順に読み、本譜(各分岐の最初の変化)の終わり、または max_moves 手目で読み込みを終える
+###########
+def load_game_record(sgf_file_path, max_moves=None):
+    sgf_string = read_sgf_text(sgf_file_path)
+
+    root_properties = {}
+    moves = []
+    node_index = -1  # 現在のノードの番号 (0 = 情報ノード)
+    node_moves = {}  # 現在のノードの着手 {'B' or 'W': SGF座標}
+    property_name = None
+    started = False
+    for match in SGF_TOKEN_PATTERN.finditer(sgf_string):
+        token = match.group(0)
+        if (not started):
+            started = (token == '(') # 最初の ( より前は無視
+            continue
+
+        if (token[0] == '['):
+            # 属性値
+            if (node_index == 0):
+                if (property_name in ROOT_PROPERTIES):
+                    # \ の次の文字はそのまま
+                    root_properties.setdefault(property_name, ESCAPE_PATTERN.sub(r'\1', token[1:-1]))
+            elif (property_name in ('B', 'W')):
+                node_moves.setdefault(property_name, token[1:-1])
+        elif (token == ';'):
+            # 前のノードの着手を確定し、次のノードへ
+            append_node_move(moves, node_moves)
+            node_moves = {}
+            property_name = None
+            node_index += 1
+            if ((max_moves is not None) and (node_index > max_moves)): # 解析の最大手数に到達
+                break
+        elif (token == '('):
+            continue # 分岐の最初の変化(本譜)に入る
+        elif (token == ')'):
+            break # 本譜の終わり (以降は別の変化)
+        else:
+            # 属性名 (FF[3]以前の小文字は無視)
+            property_name = token if (token.isupper()) else ''.join(c for c in token if c.isupper())
+    append_node_move(moves, node_moves)
+
+    return GameRecord(
+        board_size=int(root_properties.get('SZ', 19)),
+        black_player=root_properties.get('PB'),
+        white_player=root_properties.get('PW'),
+        black_rank=root_properties.get('BR'),
+        white_rank=root_properties.get('WR'),
+        moves=moves
+    )
@@ -0,0 +1,115 @@
+# /**
+#  * test_smoke.py
+#  * fake_katago.py を使い、解析全体 (main.run_parallel_analysis) を小さな疑似棋譜で実行する動作確認
+#  * 途中経過からの再開 (RESUME) と局面評価のキャッシュ (USE_EVALUATION_CACHE) を使っても、
+#  * 出力のCSVが使わない場合と同じになることを確かめる
+#  *
+#  * 使い方: python -m pytest test_smoke.py (または python -m unittest test_smoke)
+#  */
+
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import benchmark # 疑似棋譜の作成と config の上書き (子プロセスでも読み込み時に上書きする)
+import main
+
+# 疑似棋譜の数と1局の手数
+NUM_GAMES = 6
+NUM_MOVES = 40
+
+###########
+### CSVの行を並べ替えて返す関数 (棋譜の処理順によらず比較する)
+###########
+def read_sorted_rows(csv_file):
+    with open(csv_file, mode='r', newline='', encoding='utf-8-sig') as f:
+        rows = list(csv.reader(f))
+    return rows[:1] + sorted(rows[1:])
+
+class SmokeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix="analysis_smoke_")
+        cls.input_dir = os.path.join(cls.work_dir, "Input")
+        os.makedirs(cls.input_dir)
+        benchmark.write_corpus(cls.input_dir, NUM_GAMES, NUM_MOVES)
+        cls.cache_path = os.path.join(cls.work_dir, "evaluation_cache.sqlite3")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir, ignore_errors=True)
+
+    ###########
+    ### 解析全体を別のプロセスで実行し、出力先のディレクトリを返す関数
+    ### (このファイルを子プロセスの main とし、spawn で起動したプロセスにも設定を引き継ぐ)
+    ###########
+    def run_analysis(self, name, **overrides):
+        output_dir = os.path.join(self.work_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        config_overrides = {
+            **benchmark.make_config_overrides(self.input_dir, output_dir),
+            'NUM_PROCESSES': 2,
+            'MAX_MOVE_TO_ANALYSIS': NUM_MOVES,
+            'RESUME': False,
+            'USE_EVALUATION_CACHE': False,
+            **overrides,
+        }
+        env = dict(os.environ)
+        env[benchmark.CONFIG_ENV] = json.dumps(config_overrides)
+        env["FAKE_KATAGO_SECONDS_PER_VISIT"] = "0"
+        env.pop("FAKE_KATAGO_STATS_PATH", None)
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL
+        )
+        return output_dir
+
+    ###########
+    ### 2つの出力の統計情報・詳細情報のCSVが同じことを確かめる関数
+    ###########
+    def assert_same_output(self, expected_dir, actual_dir):
+        for file_name in ("summary.csv", "detail.csv"):
+            expected_rows = read_sorted_rows(os.path.join(expected_dir, file_name))
+            actual_rows = read_sorted_rows(os.path.join(actual_dir, file_name))
+            self.assertEqual(len(expected_rows), len(actual_rows), file_name)
+            self.assertEqual(expected_rows, actual_rows, file_name)
+
+    def test_resume_and_cache_match_plain_run(self):
+        plain_dir = self.run_analysis("plain")
+        self.assertEqual(len(read_sorted_rows(os.path.join(plain_dir, "summary.csv"))), 1 + 2 * NUM_GAMES)
+
+        # 空のキャッシュに書き込みながら解析した場合
+        cold_dir = self.run_analysis(
+            "cold_cache", RESUME=True, USE_EVALUATION_CACHE=True, EVALUATION_CACHE_PATH=self.cache_path
+        )
+        self.assert_same_output(plain_dir, cold_dir)
+        self.assertEqual(os.listdir(os.path.join(cold_dir, "Journal")), []) # 出力済みの棋譜の途中経過は削除される
+
+        # キャッシュにある評価を使って解析した場合
+        warm_dir = self.run_analysis(
+            "warm_cache", RESUME=True, USE_EVALUATION_CACHE=True, EVALUATION_CACHE_PATH=self.cache_path
+        )
+        self.assert_same_output(plain_dir, warm_dir)
+
+        # 出力の途中で中断した場合 (統計情報の最後の1局分を消し、その棋譜を解析し直させる)
+        summary_csv = os.path.join(warm_dir, "summary.csv")
+        with open(summary_csv, mode='r', newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.reader(f))
+        with open(summary_csv, mode='w', newline='', encoding='utf-8-sig') as f:
+            csv.writer(f).writerows(rows[:-2])
+        self.run_analysis("warm_cache", RESUME=True)
+        self.assert_same_output(plain_dir, warm_dir)
+
+if __name__ == '__main__':
+    if (benchmark.CONFIG_ENV in os.environ):
+        main.run_parallel_analysis() # run_analysis から子プロセスとして実行された場合
+    else:
+        unittest.main()
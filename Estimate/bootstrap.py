@@ -0,0 +1,57 @@
+# /**
+#  * bootstrap.py
+#  * ブートストラップ法による RMSE と相関係数の信頼区間
+#  * 再標本するのはプレイヤーのみで、再標本はインデックスの行列でまとめて作り、全ての再標本を一度に計算する
+# */
+
+from collections import namedtuple
+import numpy as np
+
+# 信頼区間の信頼水準
+CONFIDENCE_LEVEL = 0.95
+
+# ブートストラップの結果
+#   r                   : 相関係数 (全プレイヤー)
+#   rmse_low, rmse_high : RMSE の信頼区間
+#   r_low, r_high       : 相関係数の信頼区間
+BootstrapResult = namedtuple('BootstrapResult', ['r', 'rmse_low', 'rmse_high', 'r_low', 'r_high'])
+
+###########
+### プレイヤーを再標本し、RMSE と相関係数の信頼区間を求める関数
+### 各プレイヤーの推定ランクは元の値のまま使う (棋譜まで再標本するとばらつきを二重に加えることになり、
+### 区間が元の RMSE を含まないほど偏るため行わない)
+### r は全プレイヤーの相関係数 (結果にそのまま含める)
+###########
+def bootstrap_confidence_intervals(actual_indices, estimated_indices, r, num_resamples, rng):
+    actual_indices = np.asarray(actual_indices, dtype=np.float64)
+    estimated_indices = np.asarray(estimated_indices, dtype=np.float64)
+    num_players = len(actual_indices)
+
+    # 再標本ごとのプレイヤーのインデックス (再標本 × プレイヤー)
+    player_indices = rng.integers(0, num_players, size=(num_resamples, num_players))
+    x = actual_indices[player_indices]
+    y = estimated_indices[player_indices]
+
+    rmse = np.sqrt(np.mean((x - y) ** 2, axis=1))
+    x_centered = x - x.mean(axis=1, keepdims=True)
+    y_centered = y - y.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r_samples = np.sum(x_centered * y_centered, axis=1) / np.sqrt(
+            np.sum(x_centered ** 2, axis=1) * np.sum(y_centered ** 2, axis=1)
+        )
+
+    # パーセンタイル法 (全ての値が同じで相関係数が求まらない再標本は除く)
+    alpha = (1 - CONFIDENCE_LEVEL) / 2
+    rmse_low, rmse_high = get_percentile_interval(rmse, alpha)
+    r_low, r_high = get_percentile_interval(r_samples, alpha)
+    return BootstrapResult(r, rmse_low, rmse_high, r_low, r_high)
+
+###########
+### NaN を除いた値のパーセンタイルの区間を返す関数 (有効な値がなければ NaN)
+###########
+def get_percentile_interval(samples, alpha):
+    samples = samples[~np.isnan(samples)]
+    if (len(samples) == 0):
+        return np.nan, np.nan
+    low, high = np.quantile(samples, [alpha, 1 - alpha])
+    return float(low), float(high)
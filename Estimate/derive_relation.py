@@ -6,10 +6,126 @@
 import numpy as np
 import os
 import csv
+from collections import namedtuple
 import pandas as pd
-from remove_outliers import remove_outliers
+from rank_data import load_rank_data_cached, get_losses, list_ranks, iter_rank_data_chunks
+from quantile_sketch import create_sketch, update_sketch, merge_sketches, sketch_median_mad, sketch_quantiles, save_sketches
 from go_ranks import RANK_NAME_TO_INDEX # type:ignore
 
+# 計算済みのランクごとの平均損失と標準偏差 ((ディレクトリ, ランク, 評価開始手数, 評価終点手数) -> (平均, 標準偏差))
+# 閾値 τ には依存しないため、τ を変えても同じ EEM では計算し直さない
+_rank_loss_stats = {}
+
+# 列 (手数) ごとの損失の件数・平均・偏差平方和と分位点スケッチ (1列目が空の行を除く。スケッチを作らない場合は None)
+ColumnStats = namedtuple('ColumnStats', ['counts', 'means', 'm2s', 'sketches'])
+# 計算済みの列ごとの統計 ((ディレクトリ, ランク) -> ColumnStats または読み込み時の例外)
+_column_stats = {}
+# 計算済みの評価区間の分位点スケッチ ((ディレクトリ, ランク, 評価開始手数, 評価終点手数) -> スケッチ)
+_window_sketches = {}
+
+# 全体を読み込まずに列ごとの統計を求める場合に、既定でチャンクごとに読み込む行数
+DEFAULT_CHUNK_ROWS = 100000
+
+###########
+### 1ランク分のデータを chunk_rows 行ずつ読み込み、列ごとの件数・平均・偏差平方和を求める関数
+### チャンクごとの値を Chan らの方法で合わせるため、メモリ使用量はチャンクの大きさで決まる
+### sketch_k が 0 でなければ、列ごとの分位点スケッチも同時に作る
+###########
+def compute_column_stats(DATA_RELATION_DIR, actual_rank, chunk_rows, sketch_k=0):
+    counts = means = m2s = sketches = None
+    for files, losses in iter_rank_data_chunks(DATA_RELATION_DIR, actual_rank, chunk_rows):
+        losses = losses[pd.notna(files)] # 1列目が空の行をカット
+        if (counts is None):
+            counts = np.zeros(losses.shape[1], dtype=np.int64)
+            means = np.zeros(losses.shape[1])
+            m2s = np.zeros(losses.shape[1])
+            if (sketch_k):
+                sketches = [create_sketch(sketch_k)] * losses.shape[1]
+
+        # チャンク内の列ごとの件数・平均・偏差平方和
+        is_valid = ~np.isnan(losses)
+        chunk_counts = is_valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk_means = np.where(is_valid, losses, 0.0).sum(axis=0) / chunk_counts
+        chunk_means[chunk_counts == 0] = 0.0
+        chunk_m2s = np.where(is_valid, losses - chunk_means, 0.0)
+        chunk_m2s = (chunk_m2s * chunk_m2s).sum(axis=0)
+
+        # これまでの値と合わせる
+        total_counts = counts + chunk_counts
+        delta = chunk_means - means
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(total_counts > 0, chunk_counts / total_counts, 0.0)
+        means += delta * weight
+        m2s += chunk_m2s + delta * delta * counts * weight
+        counts = total_counts
+
+        if (sketch_k):
+            for column in range(losses.shape[1]):
+                sketches[column] = update_sketch(sketches[column], losses[:, column])
+
+    if (counts is None):
+        return ColumnStats(np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), [] if (sketch_k) else None)
+    return ColumnStats(counts, means, m2s, sketches)
+
+###########
+### 列ごとの統計を返す関数 (1ランクにつき1回だけ読み込み、全ての評価区間で使う)
+###########
+def get_column_stats_cached(DATA_RELATION_DIR, actual_rank, chunk_rows=None, sketch_k=0):
+    key = (os.path.abspath(DATA_RELATION_DIR), actual_rank)
+    if (key not in _column_stats):
+        try:
+            _column_stats[key] = compute_column_stats(
+                DATA_RELATION_DIR, actual_rank, chunk_rows or DEFAULT_CHUNK_ROWS, sketch_k
+            )
+        except Exception as e:
+            _column_stats[key] = e
+
+    column_stats = _column_stats[key]
+    if (isinstance(column_stats, Exception)):
+        raise column_stats
+    return column_stats
+
+###########
+### 計算済みの列ごとの統計を登録する関数 (並列実行で親プロセスの値を使う用)
+###########
+def set_column_stats(DATA_RELATION_DIR, actual_rank, column_stats):
+    _column_stats[(os.path.abspath(DATA_RELATION_DIR), actual_rank)] = column_stats
+
+###########
+### 評価開始手数から評価終点手数までの列の統計を合わせ、平均と標準偏差を返す関数
+### 戻り値: (平均, 標準偏差) (損失が1つもない場合は None, None)
+###########
+def get_window_stats(column_stats, evaluation_endpoint_move, evaluation_start_move=1):
+    window = slice(evaluation_start_move - 1, evaluation_endpoint_move)
+    counts = column_stats.counts[window]
+    means = column_stats.means[window]
+    total_count = counts.sum()
+    if (total_count == 0):
+        return None, None
+
+    mean = np.sum(counts * means) / total_count
+    m2 = np.sum(column_stats.m2s[window]) + np.sum(counts * (means - mean) ** 2)
+    return mean, np.sqrt(m2 / total_count)
+
+###########
+### 評価開始手数から評価終点手数までの列のスケッチを合わせた、評価区間の分位点スケッチを返す関数
+###########
+def get_window_sketch(
+        DATA_RELATION_DIR,
+        actual_rank,
+        evaluation_endpoint_move,
+        evaluation_start_move=1,
+        stream_chunk_rows=None,
+        sketch_k=0
+    ):
+    key = (os.path.abspath(DATA_RELATION_DIR), actual_rank, evaluation_start_move, evaluation_endpoint_move)
+    if (key not in _window_sketches):
+        column_stats = get_column_stats_cached(DATA_RELATION_DIR, actual_rank, stream_chunk_rows, sketch_k)
+        window = slice(evaluation_start_move - 1, evaluation_endpoint_move)
+        _window_sketches[key] = merge_sketches(column_stats.sketches[window])
+    return _window_sketches[key]
+
 ###########
 ### ランクごとに平均損失を計算する関数
 ###########
@@ -18,24 +134,41 @@ def analyze_turn_loss(
         actual_rank,             
         evaluation_endpoint_move,
         threshold,  
+        evaluation_start_move=1,
+        stream_chunk_rows=None,
+        sketch_k=0,
+        out=None,
     ):
+    key = (os.path.abspath(DATA_RELATION_DIR), actual_rank, evaluation_start_move, evaluation_endpoint_move)
+    if (key in _rank_loss_stats):
+        return _rank_loss_stats[key]
+
     try:
-        # CSV読み込み
-        file_path = os.path.join(DATA_RELATION_DIR, f"{actual_rank}.csv")
-        df = pd.read_csv(file_path, header=None)
-        df = df.iloc[1:] # ヘッダ行をカット
-        df = df.dropna(subset=[0]) # 1列目が空の行をカット
+        if (stream_chunk_rows):
+            # 全体を読み込まず、チャンクごとに集計した列ごとの統計を使う
+            column_stats = get_column_stats_cached(DATA_RELATION_DIR, actual_rank, stream_chunk_rows, sketch_k)
+        else:
+            # データ読み込み (.npy があればメモリマップ、なければCSV。2回目以降はメモリ上のデータ)
+            data = load_rank_data_cached(DATA_RELATION_DIR, actual_rank)
 
     except Exception as e:
-        print(f"ファイル読み込みエラー: {e}")
+        print(f"ファイル読み込みエラー: {e}", file=out)
         return []
 
-    # 着手を取得
-    mistake_rates_df = df.iloc[:, 3 : 3 + evaluation_endpoint_move]
-    all_moves = pd.to_numeric(mistake_rates_df.values.flatten(), errors='coerce')
+    if (stream_chunk_rows):
+        rank_loss_avg, rank_loss_std = get_window_stats(column_stats, evaluation_endpoint_move, evaluation_start_move)
+        if (rank_loss_avg is not None):
+            rank_loss_avg, rank_loss_std = round(rank_loss_avg, 3), round(rank_loss_std, 3)
+        _rank_loss_stats[key] = (rank_loss_avg, rank_loss_std)
+        return rank_loss_avg, rank_loss_std
+
+    # 着手を取得 (1列目が空の行をカット)
+    has_file = pd.notna(data.files)
+    all_moves = get_losses(data, evaluation_endpoint_move, evaluation_start_move)[has_file].flatten()
     valid_moves = all_moves[~np.isnan(all_moves)] # 有効な数値だけを抽出
     
     if (len(valid_moves) == 0):
+        _rank_loss_stats[key] = (None, None)
         return None, None
 
     # ランクにおける平均損失とその標準偏差を計算
@@ -43,6 +176,7 @@ def analyze_turn_loss(
     rank_loss_std = round(np.std(valid_moves), 3)
     
     # 平均と標準偏差をタプルで返す
+    _rank_loss_stats[key] = (rank_loss_avg, rank_loss_std)
     return rank_loss_avg, rank_loss_std
 
 ###########
@@ -54,7 +188,8 @@ def write_relation_to_csv(
         threshold,                # 閾値 τ
         actual_rank,              # 実ランク
         avg,                      # ランクの平均損失
-        std                       # その標準偏差
+        std,                      # その標準偏差
+        out=None                  # 出力先 (None: 標準出力)
     ):
     try:
         # ディレクトリがない場合は作成
@@ -83,27 +218,48 @@ def write_relation_to_csv(
             writer.writerow(data)
 
     except Exception as e:
-        print(f"CSV書き出しエラー: {e}")
+        print(f"CSV書き出しエラー: {e}", file=out)
+
+###########
+### ランクごとの分位点スケッチを関係のCSVと同じディレクトリに JSON で書きこむ関数
+###########
+def write_sketches_to_json(
+        RESULT_RELATION_DIR,      # JSONを保存するディレクトリ（フォルダ）
+        evaluation_endpoint_move, # 評価終点手数（ファイル名の一部にする）
+        rank_sketches,            # {ランク: スケッチ}
+        out=None                  # 出力先 (None: 標準出力)
+    ):
+    try:
+        # ディレクトリがない場合は作成
+        if (not os.path.exists(RESULT_RELATION_DIR)):
+            os.makedirs(RESULT_RELATION_DIR)
+
+        # 閾値 τ には依存しないため、ファイルは評価終点手数ごとに1つ
+        file_name = f"Sketch_EEM-{evaluation_endpoint_move:0>3}.json"
+        save_sketches(os.path.join(RESULT_RELATION_DIR, file_name), rank_sketches)
+
+    except Exception as e:
+        print(f"JSON書き出しエラー: {e}", file=out)
 
 ###########
 ### 係数 a, b を決定する関数
 ###########
-def decide_coefficient(X_loss, Y_rank):
-    print("\n=== 集計結果 ===")
+def decide_coefficient(X_loss, Y_rank, out=None):
+    print("\n=== 集計結果 ===", file=out)
     # NumPy配列に変換
     X = np.array(X_loss)
     Y = np.array(Y_rank)
 
     # 最小二乗法（1次関数、線形回帰）を実行
     a, b = np.polyfit(X, Y, 1)
-    print(f"推定関係式   : y = {a:.3f} * x + {b:.3f}")
+    print(f"推定関係式   : y = {a:.3f} * x + {b:.3f}", file=out)
 
     # 相関係数 r と 決定係数 R^2 の計算
     correlation_matrix = np.corrcoef(X_loss, Y_rank)
     r = correlation_matrix[0, 1]
     R_squared = r**2
-    print(f"相関係数(r)  : {r:.3f}")
-    print(f"決定係数(R^2): {R_squared:.3f}" + '\n')
+    print(f"相関係数(r)  : {r:.3f}", file=out)
+    print(f"決定係数(R^2): {R_squared:.3f}" + '\n', file=out)
 
     return a, b
 
@@ -115,30 +271,31 @@ def derive_relation(
         RESULT_RELATION_DIR,      # 結果（CSV）を記録するフォルダ
         evaluation_endpoint_move, # 評価終点手数
         threshold,                # 閾値 τ
+        evaluation_start_move=1,  # 評価開始手数
+        stream_chunk_rows=None,   # チャンクごとに読み込む行数 (None: 全体を読み込む)
+        sketch_k=0,               # 分位点スケッチの k (0: スケッチを作らない)
+        out=None,                 # 出力先 (None: 標準出力)
     ):
     # 指定されたディレクトリ内のCSVファイルからランク名を取得
     try:
-        # フォルダ内のファイル名を取得し、".csv" で終わるもの
+        # フォルダ内のファイル名を取得し、".csv" または ".npy" で終わるもの
         # かつ、拡張子を除いた名前が RANK_NAME_TO_INDEX に定義されているものに限定
-        all_files = os.listdir(DATA_RELATION_DIR)
-        RANK_NAMES = [
-            os.path.splitext(f)[0] for f in all_files 
-            if f.endswith('.csv') and os.path.splitext(f)[0] in RANK_NAME_TO_INDEX
-        ]
+        RANK_NAMES = list_ranks(DATA_RELATION_DIR)
         
         # ランク順に並び替える
         RANK_NAMES.sort(key=lambda x: RANK_NAME_TO_INDEX[x], reverse=True)
         
         if (not RANK_NAMES):
-            print(f"警告: {DATA_RELATION_DIR} 内に有効なCSVファイルが見つかりません。")
+            print(f"警告: {DATA_RELATION_DIR} 内に有効なCSVファイルが見つかりません。", file=out)
             return None, None
 
     except Exception as e:
-        print(f"エラー: {DATA_RELATION_DIR} の読み込み中にエラー: {e}")
+        print(f"エラー: {DATA_RELATION_DIR} の読み込み中にエラー: {e}", file=out)
         return None, None
 
     X_loss = [] # 平均損失
     Y_rank = [] # ランクインデックス
+    rank_sketches = {} # ランクごとの評価区間の分位点スケッチ
 
     # 各ランクのCSVファイルを順次処理
     for actual_rank in RANK_NAMES:
@@ -148,15 +305,29 @@ def derive_relation(
                 actual_rank,              # 実ランク名
                 evaluation_endpoint_move, # 評価終点手数
                 threshold,                # 閾値 τ
+                evaluation_start_move,    # 評価開始手数
+                stream_chunk_rows,        # チャンクごとに読み込む行数
+                sketch_k,                 # 分位点スケッチの k
+                out=out
             )
         
         if (rank_loss_avg):
             X_loss.append(rank_loss_avg)
             Y_rank.append(RANK_NAME_TO_INDEX[actual_rank])
 
-            print(f"--- {actual_rank} ランクの統計 ---")
-            print(f"Avg.: {rank_loss_avg:.3f} 目")
-            print(f"SD  : {rank_loss_std:.3f} 目")
+            print(f"--- {actual_rank} ランクの統計 ---", file=out)
+            print(f"Avg.: {rank_loss_avg:.3f} 目", file=out)
+            print(f"SD  : {rank_loss_std:.3f} 目", file=out)
+
+            if (sketch_k):
+                # 分位点スケッチから中央値・MAD・10%点・90%点を近似する
+                rank_sketches[actual_rank] = get_window_sketch(
+                    DATA_RELATION_DIR, actual_rank, evaluation_endpoint_move,
+                    evaluation_start_move, stream_chunk_rows, sketch_k
+                )
+                median, mad = sketch_median_mad(rank_sketches[actual_rank])
+                p10, p90 = sketch_quantiles(rank_sketches[actual_rank], [0.1, 0.9])
+                print(f"Med.: {median:.3f} 目 (MAD: {mad:.3f}, 10%: {p10:.3f}, 90%: {p90:.3f})", file=out)
 
             # 結果をCSVに出力
             write_relation_to_csv(
@@ -165,10 +336,14 @@ def derive_relation(
                 threshold,                # 閾値 τ
                 actual_rank,              # 実ランク名
                 rank_loss_avg,            # 平均
-                rank_loss_std             # 標準偏差
+                rank_loss_std,            # 標準偏差
+                out=out
             )
     
+    if (rank_sketches):
+        write_sketches_to_json(RESULT_RELATION_DIR, evaluation_endpoint_move, rank_sketches, out=out)
+
     # 係数 a, b を決定する（回帰分析）
-    a, b = decide_coefficient(X_loss, Y_rank)
+    a, b = decide_coefficient(X_loss, Y_rank, out=out)
 
-    return a, b
\ No newline at end of file
+    return a, b
@@ -11,9 +11,25 @@ import unicodedata
 import csv
 from typing import Dict, Tuple
 from scipy import stats
-from remove_outliers import remove_outliers
+from rank_data import load_rank_data_cached, get_move_tables_cached, get_window_means, list_ranks
+from remove_outliers import remove_outliers_all_thresholds
+from bootstrap import bootstrap_confidence_intervals, CONFIDENCE_LEVEL
 from go_ranks import RANK_NAME_TO_INDEX, RANK_NAMES # type:ignore
 
+# 計算済みの外れ値除去後のプレイヤーごとの平均損失
+# ((ディレクトリ, ランク, 必要棋譜数, 評価開始手数, 評価終点手数) -> {τ: 平均損失の配列})
+# 閾値の一覧を渡された場合は全ての τ の分を一度に計算し、同じ EEM の他の τ ではこの値を使う
+_player_average_losses = {}
+
+###########
+### 計算済みの値のキーを返す関数
+###########
+def get_player_loss_key(DATA_ESTIMATION_DIR, actual_rank, NUM_GAMES_PER_PLAYER, evaluation_start_move, evaluation_endpoint_move):
+    return (
+        os.path.abspath(DATA_ESTIMATION_DIR), actual_rank, NUM_GAMES_PER_PLAYER,
+        evaluation_start_move, evaluation_endpoint_move
+    )
+
 ###########
 ### 二乗和誤差を計算する関数
 ###########
@@ -57,11 +73,11 @@ def get_display_width(text):
 ###########
 ### プレイヤーごとに推定結果を表示する関数
 ###########
-def print_estimate_result(actual_rank, filtered_rates):
+def print_estimate_result(actual_rank, filtered_rates, out=None):
     NAME_COL_WIDTH = 25
     if (filtered_rates):
-        print(" プレイヤー  | 平均損失 | 推定 | 誤差")
-        print("-" * 40)
+        print(" プレイヤー  | 平均損失 | 推定 | 誤差", file=out)
+        print("-" * 40, file=out)
         for player, (_, rate, estimated_rank) in filtered_rates.items(): 
             current_width = get_display_width(player)
             padding_spaces = ' ' * (NAME_COL_WIDTH - current_width)
@@ -72,10 +88,10 @@ def print_estimate_result(actual_rank, filtered_rates):
                 R_estimated = RANK_NAME_TO_INDEX[estimated_rank]
             rank_error =  R_estimated - R_actual
 
-            print(f"{player}{padding_spaces} |    {rate:.3f} |  {estimated_rank:>3} | {rank_error:<+5}")
-        print("-" * 40)
+            print(f"{player}{padding_spaces} |    {rate:.3f} |  {estimated_rank:>3} | {rank_error:<+5}", file=out)
+        print("-" * 40, file=out)
     else:
-        print("フィルタリング条件を満たすプレイヤーが見つかりません。")
+        print("フィルタリング条件を満たすプレイヤーが見つかりません。", file=out)
 
 ###########
 ### 推定の誤差を計算する関数
@@ -84,20 +100,21 @@ def print_whole_rmse(
         NUM_TARGET_PLAYER,   # 棋譜数を満たすプレイヤー数 
         SHEET_NAMES,         # 推定対象の全ランク
         total_squared_error, # 二乗誤差の合計
+        out=None,            # 出力先 (None: 標準出力)
     ):
     # 総合RMSEの計算と表示
     total_data_points = NUM_TARGET_PLAYER * len([s for s in SHEET_NAMES if s in RANK_NAME_TO_INDEX])
     
-    print("=" * 40)
-    print(f"総合評価結果 (全 {total_data_points} プレイヤー統合)")
-    print("=" * 40)
+    print("=" * 40, file=out)
+    print(f"総合評価結果 (全 {total_data_points} プレイヤー統合)", file=out)
+    print("=" * 40, file=out)
 
     if (total_data_points > 0):
         mean_squared_error = total_squared_error / total_data_points
         final_rmse = round(np.sqrt(mean_squared_error), 3)
-        print(f"総合ランク推定誤差 (RMSE): {final_rmse}")
+        print(f"総合ランク推定誤差 (RMSE): {final_rmse}", file=out)
     else:
-        print("評価対象となる有効なデータ点がありません")
+        print("評価対象となる有効なデータ点がありません", file=out)
 
     return final_rmse
 
@@ -108,7 +125,8 @@ def write_rank_to_csv(
         RESULT_ESTIMATION_DIR,    # 保存先のディレクトリ
         evaluation_endpoint_move, # 評価終点手数 EEM
         threshold,                # 閾値 τ
-        filtered_rates            # プレイヤーと推定ランクの辞書
+        filtered_rates,           # プレイヤーと推定ランクの辞書
+        out=None                  # 出力先 (None: 標準出力)
     ):
     try:
         # 保存用フォルダがなければ作成
@@ -145,7 +163,7 @@ def write_rank_to_csv(
                 writer.writerow(data)
 
     except Exception as e:
-        print(f"エラー: CSVファイルへの詳細情報の書き込みに失敗 - {e}")
+        print(f"エラー: CSVファイルへの詳細情報の書き込みに失敗 - {e}", file=out)
 
 ##########
 ### 平均損失からランク名を決定する関数
@@ -162,6 +180,37 @@ def get_player_rank(average_mistake_rate, COEFF_A, COEFF_B):
     # インデックスは1から始まるため、リストのアクセスは [final_index - 1]
     return RANK_NAMES[final_index - 1]
 
+##########
+### プレイヤーごとの局平均損失を プレイヤー × 棋譜 の2次元配列にまとめる関数
+### 各行は黒番として打った対局、白番として打った対局の順 (それぞれファイル内の順)
+### 戻り値: (局平均損失 (空きは NaN), 有効な値の位置)
+##########
+def get_game_average_matrix(target_players, black_players, white_players, black_game_means, white_game_means):
+    # 全ての (プレイヤー, 局平均損失) を黒番、白番の順に並べ、対象プレイヤーの番号を付ける
+    player_indices = pd.Index(target_players).get_indexer(
+        np.concatenate([black_players.values, white_players.values])
+    )
+    game_means = np.concatenate([black_game_means, white_game_means])
+    is_target = (player_indices >= 0)
+    player_indices = player_indices[is_target]
+    game_means = game_means[is_target]
+
+    # プレイヤーの番号順に並べ替え (安定ソートのため、黒番・白番とファイル内の順は保たれる)
+    order = np.argsort(player_indices, kind='stable')
+    player_indices = player_indices[order]
+    game_means = game_means[order]
+
+    # 各プレイヤー内での棋譜の位置
+    counts = np.bincount(player_indices, minlength=len(target_players))
+    starts = np.cumsum(counts) - counts
+    positions = np.arange(len(player_indices)) - starts[player_indices]
+
+    game_averages = np.full((len(target_players), counts.max(initial=0)), np.nan)
+    is_valid = np.zeros(game_averages.shape, dtype=bool)
+    game_averages[player_indices, positions] = game_means
+    is_valid[player_indices, positions] = True
+    return game_averages, is_valid
+
 ##########
 ### 各プレイヤーのランクを推定する関数
 ##########
@@ -173,23 +222,22 @@ def analyze_player_rank_csv(
         NUM_GAMES_PER_PLAYER: int,     # 必要棋譜数
         NUM_TARGET_PLAYER: int,        # 必要プレイヤー数
         COEFF_A: float,                # 係数 A
-        COEFF_B: float                 # 係数 B
+        COEFF_B: float,                # 係数 B
+        evaluation_start_move: int = 1, # 評価開始手数
+        thresholds=None,                # まとめて計算する τ の一覧 (None: threshold のみ)
+        out=None                        # 出力先 (None: 標準出力)
     ):
     
     try:
-        file_path = os.path.join(DATA_ESTIMATION_DIR, f"{actual_rank}.csv")
-        df = pd.read_csv(file_path, header=None)
+        data = load_rank_data_cached(DATA_ESTIMATION_DIR, actual_rank)
+        move_tables = get_move_tables_cached(DATA_ESTIMATION_DIR, actual_rank)
     except Exception as e:
-        print(f"ファイル読み込みエラー ({actual_rank}): {e}")
+        print(f"ファイル読み込みエラー ({actual_rank}): {e}", file=out)
         return {}
 
     # プレイヤー名列（1列目:黒, 2列目:白）
-    black_players = df.iloc[:, 1].astype(str).str.strip()
-    white_players = df.iloc[:, 2].astype(str).str.strip()
-    
-    # 損失データ（3列目〜指定手数分）
-    # 列数制限: 3 + EEM まで
-    loss_data = df.iloc[:, 3 : 3 + evaluation_endpoint_move]
+    black_players = data.black_players
+    white_players = data.white_players
     
     # プレイヤーごとの対局数をカウント
     all_players = pd.concat([black_players, white_players])
@@ -199,55 +247,35 @@ def analyze_player_rank_csv(
     target_players = player_counts[player_counts == NUM_GAMES_PER_PLAYER].index.tolist()
     
     if len(target_players) != NUM_TARGET_PLAYER:
-        print(f"エラー: 人数の不一致 (ランク {actual_rank})")
-        print(f"想定 {NUM_TARGET_PLAYER}人, 実際 {len(target_players)}人")
+        print(f"エラー: 人数の不一致 (ランク {actual_rank})", file=out)
+        print(f"想定 {NUM_TARGET_PLAYER}人, 実際 {len(target_players)}人", file=out)
         sys.exit(1)
 
     results: Dict[str, Tuple[str, float, str]] = {}
-    
-    # 手番（列）ごとの黒白判定
-    num_cols = loss_data.shape[1]
-    col_indices = np.arange(num_cols)
-    is_black_col = (col_indices % 2 == 0) # 0(1手目), 2(3手目)...
-    is_white_col = (col_indices % 2 != 0) # 1(2手目), 3(4手目)...
-
-    for player in target_players:
-        # このプレイヤーが黒/白で参加している行(対局)を特定
-        is_p_black = (black_players == player).values
-        is_p_white = (white_players == player).values
-        
-        # 損失値をNumpy配列化
-        p_loss_values = loss_data.apply(pd.to_numeric, errors='coerce').values
-        
-        # 抽出: (黒番の行 AND 黒番の列) OR (白番の行 AND 白番の列)
-        # このプレイヤーが「黒」の対局における、「黒番（奇数手）」の損失
-        losses_as_black = p_loss_values[is_p_black][:, is_black_col].flatten()
-        
-        # このプレイヤーが「白」の対局における、「白番（偶数手）」の損失
-        losses_as_white = p_loss_values[is_p_white][:, is_white_col].flatten()
-        
-        # 結合してNaN除去
-        all_losses = np.concatenate([losses_as_black, losses_as_white])
-        all_losses = all_losses[~np.isnan(all_losses)]
-        
-        # 行ごとの平均を計算するロジック
-        game_averages = []
-        
-        # 黒番として打った対局の平均
-        if np.any(is_p_black):
-            # その対局の黒番列だけの平均
-            b_means = np.nanmean(p_loss_values[is_p_black][:, is_black_col], axis=1)
-            game_averages.extend(b_means)
-            
-        # 白番として打った対局の平均
-        if np.any(is_p_white):
-            w_means = np.nanmean(p_loss_values[is_p_white][:, is_white_col], axis=1)
-            game_averages.extend(w_means)
-            
-        # 局平均損失に対して外れ値を除去する
-        processed_game_averages = remove_outliers(game_averages, threshold)
-        player_average_loss = np.mean(processed_game_averages)
-        
+
+    key = get_player_loss_key(
+        DATA_ESTIMATION_DIR, actual_rank, NUM_GAMES_PER_PLAYER, evaluation_start_move, evaluation_endpoint_move
+    )
+    average_losses_by_threshold = _player_average_losses.setdefault(key, {})
+    if (threshold not in average_losses_by_threshold):
+        # 対局ごとの、黒番（奇数手）と白番（偶数手）の評価区間の平均損失を全ての対局について一度に計算
+        black_game_means, white_game_means = get_window_means(
+            move_tables, evaluation_endpoint_move, evaluation_start_move
+        )
+
+        # プレイヤー × 棋譜 の局平均損失 (黒番として打った対局の平均、白番として打った対局の平均の順)
+        game_averages, is_valid = get_game_average_matrix(
+            target_players, black_players, white_players, black_game_means, white_game_means
+        )
+
+        # 局平均損失に対して外れ値を全プレイヤー・全ての τ の分まとめて除去し、平均をとる
+        all_thresholds = list(dict.fromkeys([threshold] + list(thresholds or [])))
+        all_average_losses = remove_outliers_all_thresholds(game_averages, all_thresholds, is_valid)
+        for i, each_threshold in enumerate(all_thresholds):
+            average_losses_by_threshold[each_threshold] = all_average_losses[:, i]
+    player_average_losses = average_losses_by_threshold[threshold]
+
+    for player, player_average_loss in zip(target_players, player_average_losses):
         # ランク推定
         est_rank = get_player_rank(player_average_loss, COEFF_A, COEFF_B)
         results[player] = (actual_rank, round(player_average_loss, 3), est_rank)
@@ -265,7 +293,12 @@ def estimate_rank(
         NUM_GAMES_PER_PLAYER: int,
         NUM_TARGET_PLAYER: int,
         COEFF_A: float,
-        COEFF_B: float
+        COEFF_B: float,
+        evaluation_start_move: int = 1,
+        thresholds=None,
+        num_bootstrap: int = 0,       # ブートストラップの再標本数 (0: 行わない)
+        bootstrap_seed: int = 0,      # ブートストラップの乱数のシード
+        out=None
     ):
     
     total_squared_error = 0.0
@@ -274,22 +307,18 @@ def estimate_rank(
     
     # フォルダ内の有効なCSVファイルを取得
     try:
-        all_files = os.listdir(DATA_ESTIMATION_DIR)
-        TARGET_RANKS = [
-            os.path.splitext(f)[0] for f in all_files 
-            if f.endswith('.csv') and os.path.splitext(f)[0] in RANK_NAME_TO_INDEX
-        ]
+        TARGET_RANKS = list_ranks(DATA_ESTIMATION_DIR)
         # ランク順にソート
         TARGET_RANKS.sort(key=lambda x: RANK_NAME_TO_INDEX[x], reverse=True)
         
     except Exception as e:
-        print(f"ディレクトリ読み込みエラー: {e}")
-        return None, None, None
+        print(f"ディレクトリ読み込みエラー: {e}", file=out)
+        return None, None
 
     for actual_rank in TARGET_RANKS:
-        print("-" * 40)
-        print(f"ランク {actual_rank} の解析結果")
-        print("-" * 40)
+        print("-" * 40, file=out)
+        print(f"ランク {actual_rank} の解析結果", file=out)
+        print("-" * 40, file=out)
         
         # 解析実行
         filtered_rates = analyze_player_rank_csv(
@@ -300,14 +329,17 @@ def estimate_rank(
             NUM_GAMES_PER_PLAYER,
             NUM_TARGET_PLAYER,
             COEFF_A,
-            COEFF_B
+            COEFF_B,
+            evaluation_start_move,
+            thresholds,
+            out=out
         )
         
         if not filtered_rates:
             continue
 
         # 結果表示
-        print_estimate_result(actual_rank, filtered_rates)
+        print_estimate_result(actual_rank, filtered_rates, out=out)
 
         # データをリストに追加（相関係数用）
         for res in filtered_rates.values():
@@ -319,7 +351,8 @@ def estimate_rank(
             RESULT_ESTIMATION_DIR,
             evaluation_endpoint_move,
             threshold,
-            filtered_rates
+            filtered_rates,
+            out=out
         )
         
         # RMSE計算
@@ -328,20 +361,31 @@ def estimate_rank(
         
         if NUM_TARGET_PLAYER > 0:
             rmse_sheet = np.sqrt(sse / NUM_TARGET_PLAYER)
-            print(f"ランク推定誤差 (RMSE): {rmse_sheet:.3f} \n")
+            print(f"ランク推定誤差 (RMSE): {rmse_sheet:.3f} \n", file=out)
 
     # 全体のRMSEを計算
     total_players = NUM_TARGET_PLAYER * len(TARGET_RANKS)
     total_rmse = round(np.sqrt(total_squared_error / total_players), 3) if total_players > 0 else 0.0
     
-    print(f"=== 総合結果 (全{total_players}プレイヤー)===")
-    print(f"総合推定誤差 (RMSE): {total_rmse} ")
+    print(f"=== 総合結果 (全{total_players}プレイヤー)===", file=out)
+    print(f"総合推定誤差 (RMSE): {total_rmse} ", file=out)
 
     # 相関係数とp値
     r, p = 0.0, 1.0
     if (len(actual_rank_list) > 1):
         r, p = stats.pearsonr(actual_rank_list, estimated_rank_list)
-        print(f"相関係数 (r): {r:.3f}")
-        print(f"p値 (p): {p:.4e}")
+        print(f"相関係数 (r): {r:.3f}", file=out)
+        print(f"p値 (p): {p:.4e}", file=out)
+
+    # ブートストラップによる信頼区間
+    bootstrap_result = None
+    if ((num_bootstrap > 0) and (len(actual_rank_list) > 1)):
+        rng = np.random.default_rng(bootstrap_seed)
+        bootstrap_result = bootstrap_confidence_intervals(
+            actual_rank_list, estimated_rank_list, r, num_bootstrap, rng
+        )
+        print(f"\n=== ブートストラップ (プレイヤーを{num_bootstrap}回再標本, {CONFIDENCE_LEVEL:.0%}信頼区間) ===", file=out)
+        print(f"RMSE         : [{bootstrap_result.rmse_low:.3f}, {bootstrap_result.rmse_high:.3f}]", file=out)
+        print(f"相関係数 (r) : [{bootstrap_result.r_low:.3f}, {bootstrap_result.r_high:.3f}]", file=out)
 
-    return total_rmse
\ No newline at end of file
+    return total_rmse, bootstrap_result
\ No newline at end of file
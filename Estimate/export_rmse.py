@@ -3,7 +3,12 @@
 #  * RMSEをパラメータごとに出力する
 # */
 
+import os
 import pandas as pd
+from bootstrap import CONFIDENCE_LEVEL
+
+# ブートストラップの信頼区間の列
+CI_COLUMNS = ['EEM', 'Threshold', 'RMSE', 'RMSE_LOW', 'RMSE_HIGH', 'R', 'R_LOW', 'R_HIGH']
 
 ###########
 ### 全RMSEをCSVファイルに出力する関数
@@ -21,6 +26,11 @@ def export_to_csv(all_rmse, configs):
     # index=TrueでEEMを出力。ヘッダーにはThresholdが並ぶ
     pivot_df.to_csv(filename, index=True, encoding='utf-8')
 
+    # ブートストラップを行った場合は、信頼区間を組み合わせごとに1行ずつ別のCSVに保存
+    if ('RMSE_LOW' in df.columns):
+        ci_filename = os.path.splitext(filename)[0] + "_CI.csv"
+        df.reindex(columns=CI_COLUMNS).to_csv(ci_filename, index=False, encoding='utf-8')
+
 ###########
 ### 全RMSEをテキストファイルに出力する関数
 ###########
@@ -74,6 +84,30 @@ def export_to_text(all_rmse, configs):
             best = df.loc[df['RMSE'].idxmin()]
             f.write(f"\nBEST: EEM={int(best['EEM'])}, τ={best['Threshold']} -> RMSE={best['RMSE']}\n")
 
+            if ('RMSE_LOW' in df.columns):
+                write_confidence_intervals(f, df, best)
+
+###########
+### ブートストラップの信頼区間をテキストファイルに書き込む関数
+###########
+def write_confidence_intervals(f, df, best):
+    f.write(f"\n=== {CONFIDENCE_LEVEL:.0%}信頼区間 (ブートストラップ) ===\n\n")
+    f.write(" EEM |    τ   |  RMSE |   RMSE 信頼区間  |   r    |     r 信頼区間\n")
+    f.write("-" * 72 + "\n")
+    for _, row in df.iterrows():
+        f.write(
+            f" {int(row['EEM']):3d} | {row['Threshold']:6.1f} | {row['RMSE']:5.3f} |"
+            f" [{row['RMSE_LOW']:5.3f}, {row['RMSE_HIGH']:5.3f}] |"
+            f" {row['R']:6.3f} | [{row['R_LOW']:6.3f}, {row['R_HIGH']:6.3f}]\n"
+        )
+    f.write("-" * 72 + "\n")
+
+    # RMSE の信頼区間が BEST の信頼区間と重なる組み合わせ (BEST と区別できない)
+    overlaps = df[df['RMSE_LOW'] <= best['RMSE_HIGH']]
+    f.write(f"BEST と RMSE の信頼区間が重なる組み合わせ: {len(overlaps)} / {len(df)}\n")
+    for _, row in overlaps.iterrows():
+        f.write(f"  EEM={int(row['EEM'])}, τ={row['Threshold']} -> RMSE={row['RMSE']} [{row['RMSE_LOW']:.3f}, {row['RMSE_HIGH']:.3f}]\n")
+
 ###########
 ### 全RMSEをコンソールに出力する関数
 ###########
@@ -95,6 +129,8 @@ def export_to_console(all_rmse):
         best = min(valid_results, key=lambda x: x['RMSE'])
         print("-"*20)
         print(f"BEST: EEM={best['EEM']}, τ={best['Threshold']} -> RMSE={best['RMSE']} \n")
+        if ('RMSE_LOW' in best):
+            print(f"      RMSE {CONFIDENCE_LEVEL:.0%}信頼区間: [{best['RMSE_LOW']:.3f}, {best['RMSE_HIGH']:.3f}]\n")
 
 ###########
 ### 全RMSEを出力する関数
@@ -9,9 +9,8 @@
 import configparser
 import os
 import sys
-from derive_relation import derive_relation
-from estimate_rank import estimate_rank
 from export_rmse import export_rmse 
+from sweep import run_sweep
 
 # 定数の設定ファイル
 CONFIG_FILE = 'estimate_config.ini'
@@ -48,10 +47,21 @@ def load_config(file_path: str = CONFIG_FILE):
         # 閾値 (Threshold) のリスト化
         th_str = config.get('RANGES', 'THRESHOLD_LIST')
         settings['THRESHOLD_LIST'] = [float(x.strip()) for x in th_str.split(',') if x.strip]
+        # 評価開始手数 (省略時は1手目から)
+        settings['EVALUATION_START_MOVE'] = config.getint('RANGES', 'EVALUATION_START_MOVE', fallback=1)
 
         # [ANALYSIS_SETTINGS] （int型に変換）
         settings['NUM_GAMES_PER_PLAYER'] = config.getint('ANALYSIS_SETTINGS', 'NUM_GAMES_PER_PLAYER')
         settings['NUM_TARGET_PLAYER'] = config.getint('ANALYSIS_SETTINGS', 'NUM_TARGET_PLAYER')
+        # 並列に実行するプロセス数 (省略時はCPUのコア数)
+        settings['NUM_PROCESSES'] = config.getint('ANALYSIS_SETTINGS', 'NUM_PROCESSES', fallback=os.cpu_count())
+        # 関係を導くデータをチャンクごとに読み込む行数 (省略時・0 は全体を読み込む)
+        settings['STREAM_CHUNK_ROWS'] = config.getint('ANALYSIS_SETTINGS', 'STREAM_CHUNK_ROWS', fallback=0)
+        # 関係を導くデータの分位点スケッチの k (省略時・0 はスケッチを作らない)
+        settings['SKETCH_K'] = config.getint('ANALYSIS_SETTINGS', 'SKETCH_K', fallback=0)
+        # ブートストラップの再標本数 (省略時・0 は行わない)、乱数のシード
+        settings['NUM_BOOTSTRAP'] = config.getint('ANALYSIS_SETTINGS', 'NUM_BOOTSTRAP', fallback=0)
+        settings['BOOTSTRAP_SEED'] = config.getint('ANALYSIS_SETTINGS', 'BOOTSTRAP_SEED', fallback=0)
         
     except configparser.Error as e:
         print(f" 設定ファイル'{file_path}'の読み込みエラー: {e}")
@@ -59,47 +69,6 @@ def load_config(file_path: str = CONFIG_FILE):
         
     return settings
 
-###########
-### 関係を調べてランク推定を行う関数
-###########
-def run_estimate(evaluation_endpoint_move, threshold, configs):
-    # 定数の表示
-    print("----------------------------------------------------")
-    print("パラメータ設定:")
-    print(f"関係を導くためのCSVがあるディレクトリ: {configs['DATA_RELATION_DIR']}")
-    print(f"ランクを推定するためのCSVがあるディレクトリ: {configs['DATA_ESTIMATION_DIR']}")
-    print(f"関係を記録するCSVのディレクトリ: {configs['RESULT_RELATION_DIR']}")
-    print(f"推定結果を記録するCSVのディレクトリ: {configs['RESULT_ESTIMATION_DIR']}")
-    print(f"詳細結果: {configs['DETAILS_DIR']}")
-    print(f"評価終点手数: {evaluation_endpoint_move}")
-    print(f"修正Zスコアの閾値(τ): {threshold}")
-    print(f"プレイヤーごとの棋譜数: {configs['NUM_GAMES_PER_PLAYER']}")
-    print(f"棋譜数を満たすプレイヤー数: {configs['NUM_TARGET_PLAYER']}")
-    print("----------------------------------------------------\n")
-
-    # ランクの関係を導く
-    print("=== ランクと平均損失の関係を導く ===")
-    COEFF_A, COEFF_B = derive_relation(
-        configs['DATA_RELATION_DIR'], 
-        configs['RESULT_RELATION_DIR'],
-        evaluation_endpoint_move,
-        threshold
-    )
-
-    # ランクを推定する
-    print("=== ランクを推定する ===")
-    rmse = estimate_rank(
-        configs['DATA_ESTIMATION_DIR'], 
-        configs['RESULT_ESTIMATION_DIR'], 
-        evaluation_endpoint_move,
-        threshold,  
-        configs['NUM_GAMES_PER_PLAYER'], 
-        configs['NUM_TARGET_PLAYER'],
-        COEFF_A,
-        COEFF_B
-    )
-    return rmse
-
 ###########
 ### メイン関数
 ###########
@@ -114,43 +83,50 @@ def main():
     print(f"手数リスト: {EEM_RANGES}")
     print(f"閾値リスト: {THRESHOLD_RANGES}")
 
-    # 手数と閾値で2重ループ
-    for evaluation_endpoint_move in EEM_RANGES:
-        for threshold in THRESHOLD_RANGES:
-            print(f"--- EEM: {evaluation_endpoint_move:0>3}, τ: {threshold} ---")
-
-            # 出力をテキストファイルに切り替える
-            original_stdout = sys.stdout
-
-            try:
-                # 詳細フォルダがなければ作成
-                if (not os.path.exists(DETAILS_DIR)):
-                    os.makedirs(DETAILS_DIR)
-
-                threshold_str = str(int(threshold * 10))
-                text_name = f"Estimate_EEM-{evaluation_endpoint_move:0>3}_TAU-{threshold_str}.txt"
-                text_path = os.path.join(DETAILS_DIR, text_name)
-                with open(text_path, 'w', encoding='utf-8') as f:
-                    
-                    # 標準出力の行き先をファイルオブジェクト f に変更
-                    sys.stdout = f
-                    
-                    # 推定を実行
-                    rmse = run_estimate(evaluation_endpoint_move, threshold, configs)
-
-                    # 結果をリストに追加
-                    all_rmse.append({
-                        'EEM': evaluation_endpoint_move,
-                        'Threshold': threshold,
-                        'RMSE': rmse
-                    })
-                
-            except Exception as e:
-                print(f"エラー: {e}")
-                
-            finally:
-                # 出力を画面に戻す
-                sys.stdout = original_stdout
+    # 結果の出力先フォルダを作成 (並列に実行する各プロセスが同時に作成しないよう、先に作成する)
+    for result_dir in (DETAILS_DIR, configs['RESULT_RELATION_DIR'], configs['RESULT_ESTIMATION_DIR']):
+        if (not os.path.exists(result_dir)):
+            os.makedirs(result_dir)
+
+    # 手数と閾値の全ての組み合わせを並列に実行し、組み合わせの順に結果を受け取る
+    combinations = [
+        (evaluation_endpoint_move, threshold)
+        for evaluation_endpoint_move in EEM_RANGES
+        for threshold in THRESHOLD_RANGES
+    ]
+    results = run_sweep(configs, combinations)
+    for evaluation_endpoint_move, threshold, rmse, bootstrap_result, report, exit_code in results:
+        print(f"--- EEM: {evaluation_endpoint_move:0>3}, τ: {threshold} ---")
+
+        # 詳細結果をテキストファイルに書き込む
+        threshold_str = str(int(threshold * 10))
+        text_name = f"Estimate_EEM-{evaluation_endpoint_move:0>3}_TAU-{threshold_str}.txt"
+        text_path = os.path.join(DETAILS_DIR, text_name)
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(report)
+
+        if (exit_code is not None):
+            results.close() # 残りの組み合わせを中止
+            sys.exit(exit_code)
+
+        if (rmse is None): # エラーで中断した組み合わせ
+            continue
+
+        # 結果をリストに追加
+        entry = {
+            'EEM': evaluation_endpoint_move,
+            'Threshold': threshold,
+            'RMSE': rmse
+        }
+        if (bootstrap_result is not None):
+            entry.update({
+                'RMSE_LOW': bootstrap_result.rmse_low,
+                'RMSE_HIGH': bootstrap_result.rmse_high,
+                'R': bootstrap_result.r,
+                'R_LOW': bootstrap_result.r_low,
+                'R_HIGH': bootstrap_result.r_high
+            })
+        all_rmse.append(entry)
 
     export_rmse(all_rmse, configs)
 
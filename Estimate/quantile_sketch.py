@@ -0,0 +1,149 @@
+# /**
+#  * quantile_sketch.py
+#  * 分位点スケッチ (KLL 方式)
+#  * 全ての値を保持せずに中央値・MAD・分位点を近似する。チャンクごとに作成して後から合わせることができる
+# */
+
+import json
+from collections import namedtuple
+import numpy as np
+
+# スケッチ
+#   k      : 最上段に保持する値の数 (大きいほど精度が高い)
+#   count  : これまでに追加した値の数
+#   levels : 段ごとの保持している値 (段 h の値は 2^h 個分の重みを持つ)
+QuantileSketch = namedtuple('QuantileSketch', ['k', 'count', 'levels'])
+
+# 既定の k
+DEFAULT_K = 200
+# 1つ下の段の容量の比率
+CAPACITY_RATIO = 2 / 3
+
+###########
+### 空のスケッチを返す関数
+###########
+def create_sketch(k=DEFAULT_K):
+    return QuantileSketch(k, 0, [np.zeros(0)])
+
+###########
+### 段ごとの容量を返す関数 (上の段ほど大きい)
+###########
+def level_capacity(k, num_levels, level):
+    return max(2, int(np.ceil(k * CAPACITY_RATIO ** (num_levels - 1 - level))))
+
+###########
+### 容量を超えた段を下から順に圧縮する関数
+### 並べ替えた値の1つおきを上の段に移す (重みが2倍になる)
+###########
+def compress(k, count, levels):
+    levels = list(levels)
+    level = 0
+    while (level < len(levels)):
+        if (len(levels[level]) > level_capacity(k, len(levels), level)):
+            if (level + 1 == len(levels)):
+                levels.append(np.zeros(0))
+            items = np.sort(levels[level])
+            # 個数が奇数の場合は最小の値を残す
+            num_left = len(items) % 2
+            # 奇数番目と偶数番目のどちらを移すかは値の数から決める (同じ入力では同じ結果になる)
+            offset = (count >> level) & 1
+            levels[level] = items[:num_left]
+            levels[level + 1] = np.concatenate([levels[level + 1], items[num_left + offset::2]])
+        level += 1
+    return QuantileSketch(k, count, levels)
+
+###########
+### スケッチに値を追加する関数 (NaN は無視する)
+###########
+def update_sketch(sketch, values):
+    values = np.asarray(values, dtype=np.float64).ravel()
+    values = values[~np.isnan(values)]
+    if (len(values) == 0):
+        return sketch
+    levels = list(sketch.levels)
+    levels[0] = np.concatenate([levels[0], values])
+    return compress(sketch.k, sketch.count + len(values), levels)
+
+###########
+### 複数のスケッチを1つに合わせる関数 (チャンクごと・プロセスごとに作成したスケッチ用)
+###########
+def merge_sketches(sketches):
+    sketches = list(sketches)
+    if (not sketches):
+        return create_sketch()
+    num_levels = max(len(sketch.levels) for sketch in sketches)
+    levels = [
+        np.concatenate([sketch.levels[level] for sketch in sketches if (level < len(sketch.levels))])
+        for level in range(num_levels)
+    ]
+    count = sum(sketch.count for sketch in sketches)
+    return compress(sketches[0].k, count, levels)
+
+###########
+### スケッチの値と重みを、値の小さい順に返す関数
+###########
+def get_weighted_items(sketch):
+    items = np.concatenate(sketch.levels)
+    weights = np.concatenate([np.full(len(values), 2.0 ** level) for level, values in enumerate(sketch.levels)])
+    order = np.argsort(items, kind='stable')
+    return items[order], weights[order]
+
+###########
+### 重み付きの値から分位点を返す関数
+###########
+def weighted_quantiles(items, weights, quantiles):
+    cumulative_weights = np.cumsum(weights)
+    positions = np.asarray(quantiles) * cumulative_weights[-1]
+    indices = np.searchsorted(cumulative_weights, positions, side='left')
+    return items[np.minimum(indices, len(items) - 1)]
+
+###########
+### 近似の分位点を返す関数 (値が1つもない場合は NaN)
+###########
+def sketch_quantiles(sketch, quantiles):
+    if (sketch.count == 0):
+        return np.full(len(quantiles), np.nan)
+    items, weights = get_weighted_items(sketch)
+    return weighted_quantiles(items, weights, quantiles)
+
+###########
+### 近似の中央値と MAD (中央値からの絶対偏差の中央値) を返す関数
+###########
+def sketch_median_mad(sketch):
+    if (sketch.count == 0):
+        return np.nan, np.nan
+    items, weights = get_weighted_items(sketch)
+    median = weighted_quantiles(items, weights, [0.5])[0]
+    deviations = np.abs(items - median)
+    order = np.argsort(deviations, kind='stable')
+    mad = weighted_quantiles(deviations[order], weights[order], [0.5])[0]
+    return median, mad
+
+###########
+### スケッチを JSON ファイルに保存する関数 ({名前: スケッチ} をまとめて保存)
+###########
+def save_sketches(file_path, sketches):
+    data = {
+        name: {
+            'k': sketch.k,
+            'count': int(sketch.count),
+            'levels': [values.tolist() for values in sketch.levels]
+        }
+        for name, sketch in sketches.items()
+    }
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+###########
+### JSON ファイルからスケッチを読み込む関数
+### 戻り値: {名前: スケッチ}
+###########
+def load_sketches(file_path):
+    with open(file_path, encoding='utf-8') as f:
+        data = json.load(f)
+    return {
+        name: QuantileSketch(
+            value['k'], value['count'], [np.asarray(values, dtype=np.float64) for values in value['levels']]
+        )
+        for name, value in data.items()
+    }
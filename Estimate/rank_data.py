@@ -0,0 +1,220 @@
+# /**
+#  * rank_data.py
+#  * ランクごとの損失データの読み込み
+#  * {ランク}.npy + {ランク}_meta.csv があればメモリマップで読み込み、なければ {ランク}.csv を読み込む
+# */
+
+import csv
+import os
+import sys
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from go_ranks import RANK_NAME_TO_INDEX # type:ignore
+
+# 1ランク分のデータ
+#   files         : ファイル名 (空欄は NaN)
+#   black_players : 黒番のプレイヤー名
+#   white_players : 白番のプレイヤー名
+#   losses        : 1手ごとの損失 (1局1行, 空欄は NaN)
+RankData = namedtuple('RankData', ['files', 'black_players', 'white_players', 'losses'])
+
+# 基本情報のCSVのヘッダー
+META_HEADER = ["ファイル名", "プレイヤー(黒)", "プレイヤー(白)"]
+
+# 手番ごとの損失の累積和 (1局1行)
+#   black_sums[:, k]   : 黒番の最初の k 手の損失の合計 (空欄は 0)
+#   black_counts[:, k] : 黒番の最初の k 手のうち損失がある手数
+#   white_sums, white_counts も同様
+MoveTables = namedtuple('MoveTables', ['black_sums', 'black_counts', 'white_sums', 'white_counts'])
+
+# 読み込み済みのデータ ((ディレクトリ, ランク) -> RankData または読み込み時の例外)
+_loaded_rank_data = {}
+# 作成済みの累積和 ((ディレクトリ, ランク) -> MoveTables)
+_move_tables = {}
+
+###########
+### ランクごとのデータファイルのパスを返す関数
+###########
+def get_data_paths(data_dir, actual_rank):
+    return (
+        os.path.join(data_dir, f"{actual_rank}.npy"),
+        os.path.join(data_dir, f"{actual_rank}_meta.csv"),
+        os.path.join(data_dir, f"{actual_rank}.csv")
+    )
+
+###########
+### ディレクトリ内のデータがあるランク名を返す関数
+###########
+def list_ranks(data_dir):
+    ranks = set()
+    for f in os.listdir(data_dir):
+        name, ext = os.path.splitext(f)
+        if ((ext in ('.csv', '.npy')) and (name in RANK_NAME_TO_INDEX)):
+            ranks.add(name)
+    return list(ranks)
+
+###########
+### 1ランク分のデータを読み込む関数
+###########
+def load_rank_data(data_dir, actual_rank):
+    npy_path, meta_path, csv_path = get_data_paths(data_dir, actual_rank)
+
+    if (os.path.exists(npy_path)):
+        # 損失はテキストを解析せずにメモリマップで読み込む
+        losses = np.load(npy_path, mmap_mode='r')
+        meta_df = pd.read_csv(meta_path, encoding='utf-8-sig')
+        if (len(meta_df) != losses.shape[0]):
+            raise ValueError(f"{meta_path} の行数 ({len(meta_df)}) と {npy_path} の行数 ({losses.shape[0]}) が一致しません")
+    else:
+        df = pd.read_csv(csv_path, header=None)
+        df = df.iloc[1:] # ヘッダ行をカット
+        meta_df = df.iloc[:, 0:3]
+        losses = df.iloc[:, 3:].apply(pd.to_numeric, errors='coerce').values
+
+    return RankData(
+        files=meta_df.iloc[:, 0].values,
+        black_players=meta_df.iloc[:, 1].astype(str).str.strip().reset_index(drop=True),
+        white_players=meta_df.iloc[:, 2].astype(str).str.strip().reset_index(drop=True),
+        losses=losses
+    )
+
+###########
+### 1ランク分のデータを chunk_rows 行ずつ読み込むイテレータ (全体をメモリに載せない)
+### 戻り値: (ファイル名, 損失) を chunk_rows 行ずつ
+###########
+def iter_rank_data_chunks(data_dir, actual_rank, chunk_rows):
+    npy_path, meta_path, csv_path = get_data_paths(data_dir, actual_rank)
+
+    if (os.path.exists(npy_path)):
+        losses = np.load(npy_path, mmap_mode='r')
+        meta_chunks = pd.read_csv(meta_path, encoding='utf-8-sig', usecols=[0], chunksize=chunk_rows)
+        num_rows = 0
+        for meta_df in meta_chunks:
+            chunk = RankData(meta_df.iloc[:, 0].values, None, None, losses[num_rows : num_rows + len(meta_df)])
+            num_rows += len(meta_df)
+            yield chunk.files, get_losses(chunk, None)
+        if (num_rows != losses.shape[0]):
+            raise ValueError(f"{meta_path} の行数 ({num_rows}) と {npy_path} の行数 ({losses.shape[0]}) が一致しません")
+    else:
+        # 列数はヘッダ行から決める (途中の行で列数が変わっても読めるようにする)
+        with open(csv_path, encoding='utf-8') as f:
+            num_columns = len(next(csv.reader(f), []))
+        df_chunks = pd.read_csv(
+            csv_path, header=None, skiprows=1, names=range(num_columns), dtype=str, chunksize=chunk_rows
+        )
+        for df in df_chunks:
+            losses = df.iloc[:, 3:].apply(pd.to_numeric, errors='coerce').values
+            yield df.iloc[:, 0].values, np.asarray(losses, dtype=np.float64)
+
+###########
+### 1ランク分のデータを読み込む関数 (2回目以降はメモリ上のデータを返す)
+### EEM と τ の全ての組み合わせで同じデータを使うため、ファイルの読み込みと数値への変換は1回だけ行う
+###########
+def load_rank_data_cached(data_dir, actual_rank):
+    key = (os.path.abspath(data_dir), actual_rank)
+    if (key not in _loaded_rank_data):
+        try:
+            data = load_rank_data(data_dir, actual_rank)
+            # 損失はメモリに読み込み、float64 に変換しておく
+            _loaded_rank_data[key] = data._replace(losses=np.ascontiguousarray(get_losses(data, None)))
+        except Exception as e:
+            _loaded_rank_data[key] = e
+
+    data = _loaded_rank_data[key]
+    if (isinstance(data, Exception)):
+        raise data
+    return data
+
+###########
+### 読み込み済みのデータ (と累積和) を登録する関数 (並列実行で共有されたデータを使う用)
+###########
+def set_cached_rank_data(data_dir, actual_rank, data, move_tables=None):
+    key = (os.path.abspath(data_dir), actual_rank)
+    _loaded_rank_data[key] = data
+    if (move_tables is not None):
+        _move_tables[key] = move_tables
+
+###########
+### 評価開始手数から評価終点手数までの損失を返す関数
+###########
+def get_losses(rank_data, evaluation_endpoint_move, evaluation_start_move=1):
+    losses = rank_data.losses[:, evaluation_start_move - 1 : evaluation_endpoint_move]
+    if (losses.dtype != np.float64):
+        # float32 で保存された値を、CSVと同じ小数点以下3桁の値に戻す
+        losses = np.round(losses.astype(np.float64), 3)
+    return losses
+
+###########
+### 損失の累積和と有効な手数の累積を返す関数 (先頭に 0 の列を付ける)
+###########
+def get_cumulative_losses(losses):
+    is_valid = ~np.isnan(losses)
+    sums = np.zeros((losses.shape[0], losses.shape[1] + 1))
+    counts = np.zeros((losses.shape[0], losses.shape[1] + 1), dtype=np.int32)
+    # 1手目から順に足し合わせる
+    np.cumsum(np.where(is_valid, losses, 0.0), axis=1, out=sums[:, 1:])
+    np.cumsum(is_valid, axis=1, out=counts[:, 1:])
+    return sums, counts
+
+###########
+### 1ランク分の手番ごとの累積和を返す関数 (1回だけ作成し、全ての評価区間で使う)
+###########
+def get_move_tables_cached(data_dir, actual_rank):
+    key = (os.path.abspath(data_dir), actual_rank)
+    if (key not in _move_tables):
+        data = load_rank_data_cached(data_dir, actual_rank)
+        # 列 0(1手目), 2(3手目)... が黒番、1(2手目), 3(4手目)... が白番
+        black_sums, black_counts = get_cumulative_losses(data.losses[:, 0::2])
+        white_sums, white_counts = get_cumulative_losses(data.losses[:, 1::2])
+        _move_tables[key] = MoveTables(black_sums, black_counts, white_sums, white_counts)
+    return _move_tables[key]
+
+###########
+### 対局ごとの、評価開始手数から評価終点手数までの黒番・白番の平均損失を返す関数
+### 累積和の2か所の差から求めるため、区間の長さによらず1局あたり定数時間で計算できる
+### 戻り値: (黒番の平均損失, 白番の平均損失) (損失が1つもない対局は NaN)
+###########
+def get_window_means(move_tables, evaluation_endpoint_move, evaluation_start_move=1):
+    def window_mean(sums, counts, start, end):
+        end = min(end, sums.shape[1] - 1)
+        start = min(start, end)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (sums[:, end] - sums[:, start]) / (counts[:, end] - counts[:, start])
+
+    # 区間の前までの手数と、区間の終わりまでの手数 (黒番は奇数手、白番は偶数手)
+    black_means = window_mean(
+        move_tables.black_sums, move_tables.black_counts,
+        evaluation_start_move // 2, (evaluation_endpoint_move + 1) // 2
+    )
+    white_means = window_mean(
+        move_tables.white_sums, move_tables.white_counts,
+        (evaluation_start_move - 1) // 2, evaluation_endpoint_move // 2
+    )
+    return black_means, white_means
+
+###########
+### 解析結果 (detail.npy + detail_meta.csv) を黒番のランクごとのファイルに分割する関数
+###########
+def split_detail_by_rank(detail_npy_path, detail_meta_path, output_dir):
+    losses = np.load(detail_npy_path, mmap_mode='r')
+    meta_df = pd.read_csv(detail_meta_path, encoding='utf-8-sig')
+    if (not os.path.exists(output_dir)):
+        os.makedirs(output_dir)
+
+    # 基本情報の列: ファイル名, ランク(黒), プレイヤー(黒), プレイヤー(白)
+    for actual_rank, rank_df in meta_df.groupby(meta_df.iloc[:, 1].astype(str)):
+        if (actual_rank not in RANK_NAME_TO_INDEX):
+            continue
+        npy_path, meta_path, _ = get_data_paths(output_dir, actual_rank)
+        np.save(npy_path, losses[rank_df.index.values])
+        rank_meta_df = rank_df.iloc[:, [0, 2, 3]]
+        rank_meta_df.columns = META_HEADER
+        rank_meta_df.to_csv(meta_path, index=False, encoding='utf-8-sig')
+        print(f"{actual_rank}: {len(rank_df)} 局")
+
+if __name__ == '__main__':
+    if (len(sys.argv) != 4):
+        print("使い方: python rank_data.py detail.npy detail_meta.csv 出力ディレクトリ")
+        sys.exit(1)
+    split_detail_by_rank(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -25,3 +25,52 @@ def remove_outliers(original_list, threshold):
     processed_list = x[is_not_outlier].tolist()
 
     return processed_list
+
+###########
+### 各行の有効な値の中央値を返す関数 (有効な値が偶数個の場合は中央の2つの平均)
+###########
+def batch_median(values, mask, counts):
+    sorted_values = np.sort(np.where(mask, values, np.inf), axis=1) # 無効な値は末尾へ
+    lower = np.take_along_axis(sorted_values, np.maximum((counts - 1) // 2, 0)[:, None], axis=1)[:, 0]
+    upper = np.take_along_axis(sorted_values, (counts // 2)[:, None], axis=1)[:, 0]
+    return np.where(counts % 2 == 1, lower, (lower + upper) / 2)
+
+###########
+### 全プレイヤーの外れ値の除去を、複数の閾値について一度に行う関数
+### 修正Zスコアを1回だけ計算して小さい順に並べ、累積和から各閾値の除去後の平均を求める
+### 戻り値: プレイヤー × 閾値 の除去後の平均 (全て除去された場合は NaN)
+### (足し合わせる順序が異なるため、remove_outliers で1人ずつ平均をとった場合とは最後の桁が異なる場合がある)
+###########
+def remove_outliers_all_thresholds(values, thresholds, mask=None):
+    values = np.asarray(values, dtype=np.float64)
+    if (mask is None):
+        mask = ~np.isnan(values)
+    counts = mask.sum(axis=1)
+    has_nan = np.any(mask & np.isnan(values), axis=1)
+
+    # 指標の計算
+    median_x = batch_median(values, mask, counts) # 中央値 (Median)
+    abs_dev = np.abs(values - median_x[:, None])
+    mad = batch_median(abs_dev, mask, counts) # 中央絶対偏差 (MAD)
+
+    # 修正Zスコア (Modified Z-Score) の計算
+    scaling_constant = 0.6745 # スケーリング定数
+    with np.errstate(invalid='ignore', divide='ignore'):
+        modified_z_scores = np.abs(scaling_constant * np.abs(values - median_x[:, None]) / mad[:, None])
+    modified_z_scores[(mad == 0)] = -np.inf # MAD が 0 の場合は除去しない
+    modified_z_scores[~mask | has_nan[:, None]] = np.inf # 無効な値と、NaN を含むプレイヤーの値は常に除去
+
+    # 修正Zスコアの小さい順に並べ、局平均損失の累積和をとる
+    order = np.argsort(modified_z_scores, axis=1, kind='stable')
+    sorted_z_scores = np.take_along_axis(modified_z_scores, order, axis=1)
+    sorted_values = np.take_along_axis(np.where(mask, values, 0.0), order, axis=1)
+    cumulative_sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(sorted_values, axis=1, out=cumulative_sums[:, 1:])
+
+    # 閾値ごとに、修正Zスコアが閾値未満の個数までの累積和から平均を求める
+    means = np.empty((values.shape[0], len(thresholds)))
+    for i, threshold in enumerate(thresholds):
+        kept_counts = (sorted_z_scores < threshold).sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            means[:, i] = cumulative_sums[np.arange(values.shape[0]), kept_counts] / kept_counts
+    return means
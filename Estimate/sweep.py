@@ -0,0 +1,203 @@
+# /**
+#  * sweep.py
+#  * 評価終点手数 (EEM) と閾値 τ の全ての組み合わせを、EEM ごとに複数プロセスで並列に実行する
+#  * 損失データは一時ファイル(.npy)に保存し、各プロセスはメモリマップで共有して読み込む
+# */
+
+import io
+import multiprocessing as mp
+import os
+import tempfile
+import numpy as np
+import rank_data
+from rank_data import MoveTables, list_ranks, load_rank_data_cached, get_move_tables_cached
+from derive_relation import derive_relation, get_column_stats_cached, set_column_stats
+from estimate_rank import estimate_rank
+
+# 各プロセスで使う設定
+_configs = None
+
+###########
+### 関係を調べてランク推定を行う関数
+### 表示する内容は out (None: 標準出力) に書き込む
+### 戻り値: (RMSE, ブートストラップの結果 (行わない場合は None))
+###########
+def run_estimate(evaluation_endpoint_move, threshold, configs, out=None):
+    # 定数の表示
+    print("----------------------------------------------------", file=out)
+    print("パラメータ設定:", file=out)
+    print(f"関係を導くためのCSVがあるディレクトリ: {configs['DATA_RELATION_DIR']}", file=out)
+    print(f"ランクを推定するためのCSVがあるディレクトリ: {configs['DATA_ESTIMATION_DIR']}", file=out)
+    print(f"関係を記録するCSVのディレクトリ: {configs['RESULT_RELATION_DIR']}", file=out)
+    print(f"推定結果を記録するCSVのディレクトリ: {configs['RESULT_ESTIMATION_DIR']}", file=out)
+    print(f"詳細結果: {configs['DETAILS_DIR']}", file=out)
+    if (configs['EVALUATION_START_MOVE'] != 1):
+        print(f"評価開始手数: {configs['EVALUATION_START_MOVE']}", file=out)
+    print(f"評価終点手数: {evaluation_endpoint_move}", file=out)
+    print(f"修正Zスコアの閾値(τ): {threshold}", file=out)
+    print(f"プレイヤーごとの棋譜数: {configs['NUM_GAMES_PER_PLAYER']}", file=out)
+    print(f"棋譜数を満たすプレイヤー数: {configs['NUM_TARGET_PLAYER']}", file=out)
+    print("----------------------------------------------------\n", file=out)
+
+    # ランクの関係を導く
+    print("=== ランクと平均損失の関係を導く ===", file=out)
+    COEFF_A, COEFF_B = derive_relation(
+        configs['DATA_RELATION_DIR'],
+        configs['RESULT_RELATION_DIR'],
+        evaluation_endpoint_move,
+        threshold,
+        configs['EVALUATION_START_MOVE'],
+        configs['STREAM_CHUNK_ROWS'],
+        configs['SKETCH_K'],
+        out=out
+    )
+
+    # ランクを推定する
+    print("=== ランクを推定する ===", file=out)
+    rmse, bootstrap_result = estimate_rank(
+        configs['DATA_ESTIMATION_DIR'],
+        configs['RESULT_ESTIMATION_DIR'],
+        evaluation_endpoint_move,
+        threshold,
+        configs['NUM_GAMES_PER_PLAYER'],
+        configs['NUM_TARGET_PLAYER'],
+        COEFF_A,
+        COEFF_B,
+        configs['EVALUATION_START_MOVE'],
+        configs['THRESHOLD_LIST'],
+        configs['NUM_BOOTSTRAP'],
+        configs['BOOTSTRAP_SEED'],
+        out=out
+    )
+    return rmse, bootstrap_result
+
+###########
+### 親プロセスで全ランクのデータを読み込み、一時ディレクトリに .npy 形式で保存する関数
+### 戻り値: [(データディレクトリ, ランク, 基本情報 または読み込み時の例外, {配列名: .npyのパス})]
+###########
+def share_rank_data(configs, shared_dir):
+    shared = []
+    data_dirs = [(configs['DATA_ESTIMATION_DIR'], True)]
+    if (not configs['STREAM_CHUNK_ROWS']):
+        # チャンクごとに読み込む場合、関係を導くためのデータは share_column_stats で集計した値だけを渡す
+        data_dirs.insert(0, (configs['DATA_RELATION_DIR'], False))
+    for data_dir, use_move_tables in data_dirs:
+        try:
+            ranks = list_ranks(data_dir)
+        except Exception:
+            continue # 読み込みのエラーは各組み合わせの詳細結果に表示する
+
+        for actual_rank in ranks:
+            try:
+                data = load_rank_data_cached(data_dir, actual_rank)
+                arrays = {'losses': data.losses}
+                if (use_move_tables):
+                    arrays.update(get_move_tables_cached(data_dir, actual_rank)._asdict())
+            except Exception as e:
+                shared.append((data_dir, actual_rank, e, None))
+                continue
+
+            array_paths = {}
+            for name, array in arrays.items():
+                array_paths[name] = os.path.join(shared_dir, f"{len(shared)}_{name}.npy")
+                np.save(array_paths[name], array)
+            # 損失以外 (ファイル名・プレイヤー名) は各プロセスへそのまま渡す
+            shared.append((data_dir, actual_rank, data._replace(losses=None), array_paths))
+    return shared
+
+###########
+### 親プロセスで関係を導くためのデータをチャンクごとに読み込み、ランクごとの列の統計 (と分位点スケッチ) を返す関数
+### 戻り値: {ランク: 列ごとの統計 または読み込み時の例外}
+###########
+def share_column_stats(configs):
+    if ((not configs['STREAM_CHUNK_ROWS']) and (not configs['SKETCH_K'])):
+        return {}
+    data_dir = configs['DATA_RELATION_DIR']
+    try:
+        ranks = list_ranks(data_dir)
+    except Exception:
+        return {} # 読み込みのエラーは各組み合わせの詳細結果に表示する
+
+    column_stats = {}
+    for actual_rank in ranks:
+        try:
+            column_stats[actual_rank] = get_column_stats_cached(
+                data_dir, actual_rank, configs['STREAM_CHUNK_ROWS'], configs['SKETCH_K']
+            )
+        except Exception as e:
+            column_stats[actual_rank] = e
+    return column_stats
+
+###########
+### 各プロセスの初期化関数 (共有されたデータをメモリマップで読み込む)
+###########
+def init_worker(configs, shared, column_stats=None):
+    global _configs
+    _configs = configs
+    for actual_rank, stats in (column_stats or {}).items():
+        set_column_stats(configs['DATA_RELATION_DIR'], actual_rank, stats)
+    for data_dir, actual_rank, data, array_paths in shared:
+        if (isinstance(data, Exception)):
+            rank_data.set_cached_rank_data(data_dir, actual_rank, data)
+            continue
+        arrays = {name: np.load(path, mmap_mode='r') for name, path in array_paths.items()}
+        losses = arrays.pop('losses')
+        move_tables = MoveTables(**arrays) if (arrays) else None
+        rank_data.set_cached_rank_data(data_dir, actual_rank, data._replace(losses=losses), move_tables)
+
+###########
+### 1つの組み合わせ (EEM, τ) を実行する関数
+### 戻り値: (EEM, τ, RMSE (エラーの場合は None), ブートストラップの結果, 詳細結果のテキスト, 終了コード (途中で終了した場合))
+###########
+def run_combination(evaluation_endpoint_move, threshold):
+    report = io.StringIO()
+    rmse = None
+    bootstrap_result = None
+    exit_code = None
+    try:
+        rmse, bootstrap_result = run_estimate(evaluation_endpoint_move, threshold, _configs, out=report)
+    except SystemExit as e:
+        exit_code = e.code # 人数の不一致など。親プロセスで詳細結果を書き込んでから終了する
+    except Exception as e:
+        print(f"エラー: {e}", file=report)
+    return evaluation_endpoint_move, threshold, rmse, bootstrap_result, report.getvalue(), exit_code
+
+###########
+### 1つの評価終点手数について、全ての τ の組み合わせを順に実行する関数
+### 関係と外れ値除去は同じ EEM の最初の τ で全ての τ の分を計算し、残りの τ では計算済みの値を使う
+###########
+def run_combinations(task):
+    evaluation_endpoint_move, thresholds = task
+    results = []
+    for threshold in thresholds:
+        results.append(run_combination(evaluation_endpoint_move, threshold))
+        if (results[-1][-1] is not None):
+            break # 途中で終了した場合は残りの τ を実行しない
+    return results
+
+###########
+### 全ての組み合わせを実行し、結果を組み合わせの順に返すイテレータ
+### 設定の NUM_PROCESSES が 1 の場合は、このプロセスで順に実行する
+###########
+def run_sweep(configs, combinations):
+    # 評価終点手数ごとにまとめる (τ の順は組み合わせの順のまま)
+    tasks = {}
+    for evaluation_endpoint_move, threshold in combinations:
+        tasks.setdefault(evaluation_endpoint_move, []).append(threshold)
+    tasks = list(tasks.items())
+    num_processes = min(configs['NUM_PROCESSES'], len(tasks))
+
+    if (num_processes <= 1):
+        init_worker(configs, [])
+        for evaluation_endpoint_move, thresholds in tasks:
+            for threshold in thresholds:
+                yield run_combination(evaluation_endpoint_move, threshold)
+        return
+
+    with tempfile.TemporaryDirectory() as shared_dir:
+        shared = share_rank_data(configs, shared_dir)
+        column_stats = share_column_stats(configs)
+        initargs = (configs, shared, column_stats)
+        with mp.Pool(processes=num_processes, initializer=init_worker, initargs=initargs) as pool:
+            for results in pool.imap(run_combinations, tasks):
+                yield from results
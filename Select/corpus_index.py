@@ -0,0 +1,153 @@
+# /**
+#  * corpus_index
+#  * SGFファイルの情報 (対局者・段級位・手数など) をSQLiteに記録し、抽出時の再走査を省く
+#  * ファイルのサイズと更新日時が変わったものだけを、sgf_scanner で並列に読み直す
+# */
+
+import os
+import sqlite3
+import sys
+import sgf_scanner # SGFファイルの並列走査
+
+# 1度にまとめて書き込む件数
+COMMIT_INTERVAL = 1000
+# 索引の形式の版 (記録する情報や読み取り方を変えた場合に上げ、古い索引は作り直す)
+INDEX_VERSION = 2
+
+###########
+### 索引のデータベースに接続する関数
+###########
+def open_index(db_path):
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    if (not os.path.exists(db_dir)):
+        os.makedirs(db_dir)
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    with connection:
+        if (connection.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION):
+            connection.execute("DROP TABLE IF EXISTS games")
+            connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS games ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,"
+            " black_player TEXT, white_player TEXT, black_rank INTEGER, white_rank INTEGER,"
+            " num_moves INTEGER, error TEXT)"
+        )
+    return connection
+
+###########
+### ディレクトリ内のSGFファイルを走査する関数
+### 戻り値: (絶対パス, サイズ, 更新日時(ns)) を返すイテレータ
+###########
+def iter_sgf_files(src_dir):
+    for root, _, files in os.walk(os.path.abspath(src_dir)): # ソースフォルダを探索する
+        for file in files: # ファイルを1つずつ取り出す
+            if (file.endswith('.sgf')): # 拡張子が .sgf のもの
+                file_path = os.path.join(root, file) # ファイルのパスを構築
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                yield file_path, st.st_size, st.st_mtime_ns
+
+###########
+### ディレクトリ以下のパスの範囲 (SQLの BETWEEN 用) を返す関数
+###########
+def get_path_range(src_dir):
+    prefix = os.path.join(os.path.abspath(src_dir), '')
+    return prefix, prefix + '\U0010ffff'
+
+###########
+### 索引を更新する関数 (追加・変更されたファイルのみ読み直し、削除されたファイルは取り除く)
+###########
+def refresh_index(connection, src_dir):
+    indexed = dict(
+        ((path, (size, mtime_ns)) for path, size, mtime_ns in connection.execute(
+            "SELECT path, size, mtime_ns FROM games WHERE path BETWEEN ? AND ?", get_path_range(src_dir)
+        ))
+    )
+
+    # 追加・変更されたファイルを探す (パス -> (サイズ, 更新日時))
+    changed = {}
+    num_updated = 0
+    for file_path, size, mtime_ns in iter_sgf_files(src_dir):
+        stored = indexed.pop(file_path, None)
+        if (stored == (size, mtime_ns)):
+            continue # 変更なし
+        changed[file_path] = (size, mtime_ns)
+        if (stored is not None):
+            num_updated += 1
+    num_added = len(changed) - num_updated
+
+    # 追加・変更されたファイルを並列に読み取り (手数は最低手数によらず全て数える)
+    if (changed):
+        paths = list(changed)
+        batches = [paths[i : i + sgf_scanner.SCAN_BATCH_SIZE] for i in range(0, len(paths), sgf_scanner.SCAN_BATCH_SIZE)]
+        pending = []
+        for file_path, *metadata in sgf_scanner.scan_batches(batches, None):
+            pending.append((file_path, *changed[file_path], *metadata))
+            if (len(pending) >= COMMIT_INTERVAL):
+                write_entries(connection, pending)
+                pending = []
+        write_entries(connection, pending)
+
+    # 走査で見つからなかったファイルは削除されたもの
+    with connection:
+        connection.executemany("DELETE FROM games WHERE path = ?", [(path,) for path in indexed])
+
+    print(f"索引を更新: 追加 {num_added} / 更新 {num_updated} / 削除 {len(indexed)}")
+
+###########
+### 索引に書き込む関数
+###########
+def write_entries(connection, entries):
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", entries
+        )
+
+###########
+### ディレクトリ以下の棋譜の情報を取得する関数
+### 戻り値: [(パス, 黒番, 白番, 黒の段級位, 白の段級位, 手数, エラー)]
+### パスは src_dir からの相対パスを src_dir に連結したもの (os.walk で走査した場合と同じ)
+###########
+def query_games(connection, src_dir):
+    prefix, _ = get_path_range(src_dir)
+    games = []
+    for row in connection.execute(
+            "SELECT path, black_player, white_player, black_rank, white_rank, num_moves, error"
+            " FROM games WHERE path BETWEEN ? AND ? ORDER BY path", get_path_range(src_dir)
+        ):
+        games.append((os.path.join(src_dir, row[0][len(prefix):]),) + tuple(row[1:]))
+    return games
+
+###########
+### 抽出スクリプトから索引を使う関数
+### 環境変数 SELECT_INDEX_DB が未設定の場合は None を返す (ファイルを直接走査する)
+### SELECT_INDEX_REFRESH=0 の場合は更新せずに索引をそのまま使う
+###########
+def load_indexed_games(src_dir):
+    db_path = os.environ.get('SELECT_INDEX_DB')
+    if (not db_path):
+        return None
+
+    connection = open_index(db_path)
+    try:
+        if (os.environ.get('SELECT_INDEX_REFRESH', '1') != '0'):
+            refresh_index(connection, src_dir)
+        return query_games(connection, src_dir)
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 3): # 引数が2つない場合
+        print("エラー: 引数が不足しています。")
+        print("使い方: python3 corpus_index.py 索引ファイル 入力元ディレクトリ...")
+        sys.exit(1)
+
+    # 索引の作成・更新のみを行う
+    connection = open_index(sys.argv[1])
+    for src_dir in sys.argv[2:]:
+        print(f"--- {src_dir} ---")
+        refresh_index(connection, src_dir)
+    connection.close()
@@ -0,0 +1,122 @@
+# /**
+#  * materialize
+#  * 選択した棋譜を出力先に配置する (コピー・ハードリンク・シンボリックリンク・reflink・一覧ファイル)
+#  * 環境変数 SELECT_MATERIALIZE でモードを指定する
+# */
+
+import ctypes
+import ctypes.util
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# 配置のモード
+MODES = ('copy', 'hardlink', 'symlink', 'reflink', 'manifest')
+# 一覧ファイル (manifest モード) のファイル名
+MANIFEST_NAME = "manifest.txt"
+# コピーの並列数
+DEFAULT_COPY_THREADS = 16
+# Linux の FICLONE (ファイルの内容を共有する複製)
+FICLONE = 0x40049409
+
+###########
+### 出力先のファイルを置き換えられるよう、既存のファイルを削除する関数 (shutil.copy と同じく上書き)
+###########
+def remove_existing(destination_path):
+    if (os.path.lexists(destination_path)):
+        os.remove(destination_path)
+
+###########
+### reflink (内容を共有し、書き込み時に複製されるコピー) を作成する関数
+###########
+def reflink(file_path, destination_path):
+    if (sys.platform == 'darwin'):
+        # macOS (APFS) の clonefile
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if (libc.clonefile(os.fsencode(file_path), os.fsencode(destination_path), 0) != 0):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), destination_path)
+        return
+
+    # Linux (Btrfs, XFS など) の FICLONE
+    import fcntl
+    with open(file_path, 'rb') as src, open(destination_path, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination_path)
+            raise
+
+###########
+### 1つのファイルを配置する関数 (リンクを作成できない場合はコピーする)
+### 戻り値: 実際に行った配置のモード
+###########
+def materialize_file(file_path, destination_path, mode):
+    # 出力先が入力元と同じファイルの場合は削除すると棋譜を失うため、配置しない
+    if (os.path.exists(destination_path) and os.path.samefile(file_path, destination_path)):
+        raise shutil.SameFileError(f"{file_path} と {destination_path} は同じファイルです")
+    remove_existing(destination_path)
+    try:
+        if (mode == 'hardlink'):
+            os.link(file_path, destination_path)
+            return mode
+        if (mode == 'symlink'):
+            os.symlink(os.path.abspath(file_path), destination_path)
+            return mode
+        if (mode == 'reflink'):
+            reflink(file_path, destination_path)
+            return mode
+    except OSError:
+        pass # 別のファイルシステムなど、リンクを作成できない場合
+    shutil.copy(file_path, destination_path) # ファイルのコピー
+    return 'copy'
+
+###########
+### 選択した棋譜のパスを一覧ファイルに追記する関数 (Analysisの INPUT_MANIFEST で読み込む)
+###########
+def write_manifest(files_to_copy, dst_dir):
+    manifest_path = os.path.join(dst_dir, MANIFEST_NAME)
+    with open(manifest_path, 'a', encoding='utf-8') as f:
+        for file_path in files_to_copy:
+            f.write(os.path.abspath(file_path) + "\n")
+    print(f"一覧ファイルに追記: {manifest_path} ({len(files_to_copy)} 局)")
+
+###########
+### 選択した棋譜を出力先に配置する関数
+###########
+def materialize_files(files_to_copy, dst_dir, mode=None):
+    if (mode is None):
+        mode = os.environ.get('SELECT_MATERIALIZE', 'copy') or 'copy'
+    if (mode not in MODES):
+        print(f"エラー: 不正な配置モード {mode}")
+        sys.exit(1)
+    if (not os.path.exists(dst_dir)):
+        os.makedirs(dst_dir)
+
+    if (mode == 'manifest'):
+        write_manifest(files_to_copy, dst_dir)
+        return
+
+    def materialize_one(file_path):
+        file_name = os.path.basename(file_path) # パスからファイル名を取得
+        destination_path = os.path.join(dst_dir, file_name) # コピー先パスの生成
+        try:
+            return materialize_file(file_path, destination_path, mode)
+        except Exception as e:
+            print(f"ファイル {file_name} のコピー中にエラーが発生しました: {e}")
+            return None
+
+    # ファイルごとの処理は入出力待ちが中心のため、スレッドで並列に行う
+    num_threads = int(os.environ.get('SELECT_COPY_THREADS', 0)) or DEFAULT_COPY_THREADS
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = list(executor.map(materialize_one, files_to_copy))
+
+    num_linked = sum(1 for result in results if (result == mode))
+    num_copied = sum(1 for result in results if (result == 'copy'))
+    num_failed = sum(1 for result in results if (result is None))
+    if (mode == 'copy'):
+        print(f"コピー完了: {num_copied} 局 (失敗 {num_failed} 局)")
+    else:
+        print(f"{mode} 完了: {num_linked} 局, コピー {num_copied} 局 (失敗 {num_failed} 局)")
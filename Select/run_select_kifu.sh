@@ -25,6 +25,18 @@ MIN_MOVES="100"
 GAME_BASE_SCRIPT="select_kifu_by_games.py"
 # プレイヤーから棋譜を抽出するプログラム名(2)
 PLAYER_BASE_SCRIPT="select_kifu_by_players.py"
+# 棋譜の情報の索引 (空にすると毎回全ファイルを読み込む)
+INDEX_DB="../Output/corpus_index.sqlite3"
+# 索引を更新するか (0: 更新せずにそのまま使う)
+INDEX_REFRESH="1"
+# 選択した棋譜の配置方法 (copy / hardlink / symlink / reflink / manifest)
+#   manifest: コピーせず、出力フォルダの manifest.txt に棋譜のパスを書き出す (Analysisの INPUT_MANIFEST で読み込む)
+MATERIALIZE_MODE="copy"
+
+# 抽出プログラムへ索引の設定を渡す
+export SELECT_INDEX_DB="$INDEX_DB"
+export SELECT_INDEX_REFRESH="$INDEX_REFRESH"
+export SELECT_MATERIALIZE="$MATERIALIZE_MODE"
 
 # === 出力ファイルを作成 ===
 # 今日の日付を取得（YYYYMMDD形式）
@@ -42,6 +54,8 @@ if [ "$MODE" == "1" ]; then
     echo "出力フォルダ: $DST_DIR"
     echo "抽出する棋譜数: $NUM_GAMES_TO_COPY"
     echo "最低手数: $MIN_MOVES"
+    echo "索引: ${INDEX_DB:-なし}"
+    echo "配置方法: $MATERIALIZE_MODE"
     echo "----------------------------------------------------"
     echo ""
 elif [ "$MODE" == "2" ]; then
@@ -54,6 +68,8 @@ elif [ "$MODE" == "2" ]; then
     echo "抽出するプレイヤー数: $NUM_PLAYERS_TO_COPY"
     echo "プレイヤーごとに抽出する棋譜ファイル数: $NUM_GAMES_PER_PLAYER"
     echo "最低手数: $MIN_MOVES"
+    echo "索引: ${INDEX_DB:-なし}"
+    echo "配置方法: $MATERIALIZE_MODE"
     echo "----------------------------------------------------"
     echo ""    
 else
@@ -61,6 +77,10 @@ else
 fi
 
 # === プログラムの実行 ===
+# 一覧ファイルは段位ごとに追記するため、前回の内容を消しておく
+if [ "$MATERIALIZE_MODE" == "manifest" ]; then
+    rm -f "./$DST_DIR/manifest.txt"
+fi
 for SRC_RANK in "${RANK_LIST[@]}"; do
     OUTPUT_FILE="../Output/SelectKifu_${TODAY_DATE_STR}_${SRC_RANK}.txt"
     if [ "$MODE" == "1" ]; then
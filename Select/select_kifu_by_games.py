@@ -6,11 +6,11 @@
 #  * Number : 221205118
 # */
 
-import os
-import shutil
 import sys
 import random
-import re # 正規表現：文字列のパターンマッチング・検索・置換を行う
+import corpus_index # SGFファイルの情報の索引
+import sgf_scanner # SGFファイルの並列走査
+import materialize # 選択した棋譜の配置
 
 ###########
 ### 設定
@@ -19,25 +19,15 @@ SRC_DIR = None # 入力元ディレクトリ; source
 DST_DIR = None # 出力先ディレクトリ; destination
 MIN_MOVES = None 
 NUM_GAMES_TO_COPY = None
-# 段級位のリスト。弱い順に並べることで、インデックスがそのまま強さの順序を表す
-RANK_ORDER = [
-    '30级', '29级', '28级', '27级', '26级', '25级', '24级', '23级', '22级', '21级', 
-    '20级', '19级', '18级', '17级', '16级', '15级', '14级', '13级', '12级', '11级',
-    '10级', '9级', '8级', '7级', '6级', '5级', '4级', '3级', '2级', '1级',
-    '1段', '2段', '3段', '4段', '5段', '6段', '7段', '8段', '9段',
-    '1プロ', '2プロ', '3プロ', '4プロ', '5プロ', '6プロ', '7プロ', '8プロ', '9プロ',
-]
 
 ###########
-### 段級位文字列を整数に変換して返す関数
-### 例) '30级' -> 0
+### 抽出の条件を満たす棋譜かを判定する関数
 ###########
-def get_rank_as_int(rank_str):
-    try:
-        # 正規化されたリスト内を直接検索
-        return RANK_ORDER.index(rank_str)
-    except ValueError:
-        return None
+def is_valid_game(black_rank_int, white_rank_int, num_moves):
+    # 指定する条件; 級段位が同じ かつ 100手以上
+    return ((black_rank_int != None) and (white_rank_int != None) 
+            and (abs(black_rank_int - white_rank_int) == 0)
+            and (num_moves >= MIN_MOVES))
 
 ###########
 ### 条件に合致するSGFファイルを収集する関数
@@ -45,37 +35,18 @@ def get_rank_as_int(rank_str):
 def collect_game_data():
     valid_sgf_files = [] # 条件に合致するSGFファイル
     
-    # SFGファイルを探索
-    print("SGFファイルを検索")
-    for root, _, files in os.walk(SRC_DIR): # ソースフォルダを探索する
-        for file in files: # ファイルを1つずつ取り出す
-            if (file.endswith('.sgf')): # 拡張子が .sgf のもの
-                file_path = os.path.join(root, file) # ファイルのパスを構築
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read() # ファイルのデータを文字列で読み取る
-
-                        # 手数 ('B[' または 'W[' の出現回数) を数える
-                        num_moves = len(re.findall(r'[BW]\[[a-z]{2}\]', content))
-
-                        # 段級位の抽出
-                        black_rank_str = re.search(r'BR\[(.*?)\]', content)
-                        white_rank_str = re.search(r'WR\[(.*?)\]', content)
-                        
-                        # RANK_ORDERのリストのインデックスに変換
-                        black_rank_int = get_rank_as_int(black_rank_str.group(1))
-                        white_rank_int = get_rank_as_int(white_rank_str.group(1))
-                        
-                        # 指定する条件; 級段位が同じ かつ 100手以上
-                        if ((black_rank_int != None) and (white_rank_int != None) 
-                            and (abs(black_rank_int - white_rank_int) == 0)
-                            and (num_moves >= MIN_MOVES)):
-                            valid_sgf_files.append(file_path)
-                                                
-                except Exception as e:
-                    print(f"ファイル {file_path} の解析中にエラーが発生しました: {e}")
-                    continue
+    # 索引があれば、ファイルを読まずに索引の情報で判定する
+    games = corpus_index.load_indexed_games(SRC_DIR)
+    if (games is None):
+        # SFGファイルを並列に探索
+        print("SGFファイルを検索")
+        games = sgf_scanner.scan_corpus(SRC_DIR, MIN_MOVES)
+
+    for file_path, _, _, black_rank_int, white_rank_int, num_moves, error in games:
+        if (error is not None):
+            print(f"ファイル {file_path} の解析中にエラーが発生しました: {error}")
+        elif (is_valid_game(black_rank_int, white_rank_int, num_moves)):
+            valid_sgf_files.append(file_path)
 
     print(f"条件に合致した棋譜の総数: {len(valid_sgf_files)} 局\n")
 
@@ -102,16 +73,8 @@ def select_games(valid_sgf_files):
 ### 選択した棋譜をコピーする関数
 ###########
 def copy_selected_files(files_to_copy):
-    ### 選択した棋譜をコピー
-    for file_path in files_to_copy:
-        file_name = os.path.basename(file_path) # パスからファイル名を取得
-        destination_path = os.path.join(DST_DIR, file_name) # コピー先パスの生成
-        
-        try:
-            shutil.copy(file_path, destination_path) # ファイルのコピー
-            print(f"コピー完了: {file_name}")
-        except Exception as e:
-            print(f"ファイル {file_name} のコピー中にエラーが発生しました: {e}")
+    ### 選択した棋譜をコピー (環境変数 SELECT_MATERIALIZE でリンクや一覧ファイルも選べる)
+    materialize.materialize_files(files_to_copy, DST_DIR)
 
 ###########
 ### メイン関数
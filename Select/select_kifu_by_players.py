@@ -6,12 +6,12 @@
 #  * Number : 221205118
 # */
 
-import os
-import shutil
 import sys
 import random
-import re # 正規表現：文字列のパターンマッチング・検索・置換を行う
 from collections import Counter, defaultdict # 要素の出現回数を辞書形式で管理する
+import corpus_index # SGFファイルの情報の索引
+import sgf_scanner # SGFファイルの並列走査
+import materialize # 選択した棋譜の配置
 
 ###########
 ### 定数(一部はbatファイルで指定)
@@ -22,26 +22,6 @@ MIN_MOVES = None
 NUM_PLAYERS_TO_COPY = None # 抽出するプレイヤー数
 NUM_GAMES_PER_PLAYER = None # プレイヤーごとに抽出する棋譜ファイル数
 
-# 段級位のリスト。弱い順に並べることで、インデックスがそのまま強さの順序を表す
-RANK_ORDER = [
-    '30级', '29级', '28级', '27级', '26级', '25级', '24级', '23级', '22级', '21级', 
-    '20级', '19级', '18级', '17级', '16级', '15级', '14级', '13级', '12级', '11级',
-    '10级', '9级', '8级', '7级', '6级', '5级', '4级', '3级', '2级', '1级',
-    '1段', '2段', '3段', '4段', '5段', '6段', '7段', '8段', '9段',
-    '1プロ', '2プロ', '3プロ', '4プロ', '5プロ', '6プロ', '7プロ', '8プロ', '9プロ',
-]
-
-###########
-### 段級位文字列を整数に変換して返す関数
-### 例) '30级' -> 0
-###########
-def get_rank_as_int(rank_str):
-    try:
-        # 正規化されたリスト内を直接検索
-        return RANK_ORDER.index(rank_str)
-    except ValueError:
-        return None
-
 ###########
 ### SGFファイルを走査し、プレイヤーごとに出現回数と棋譜のパスを収集する
 ###########
@@ -50,46 +30,21 @@ def collect_player_data():
     player_games = defaultdict(list)
     valid_players = []
 
-    print("SGFファイルを検索")
-    for root, _, files in os.walk(SRC_DIR): # ソースフォルダを探索する
-        for file in files: # ファイルを1つずつ取り出す
-            if (file.endswith('.sgf')): # 拡張子が .sgf のもの
-                file_path = os.path.join(root, file) # ファイルのパスを構築
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read() # ファイルのデータを文字列で読み取る
-
-                        # 手数 ('B[' または 'W[' の出現回数) を数える
-                        num_moves = len(re.findall(r'[BW]\[[a-z]{2}\]', content))
-
-                        # プレイヤー名を取得
-                        players = []
-                        black_player = re.search(r'PB\[(.*?)\]', content)
-                        white_player = re.search(r'PW\[(.*?)\]', content)
-
-                        # 段級位の抽出
-                        black_rank_str = re.search(r'BR\[(.*?)\]', content)
-                        white_rank_str = re.search(r'WR\[(.*?)\]', content)
-                        
-                        # RANK_ORDERのリストのインデックスに変換
-                        black_rank_int = get_rank_as_int(black_rank_str.group(1))
-                        white_rank_int = get_rank_as_int(white_rank_str.group(1))
-
-                        # 指定する条件; 級段位が同じ かつ 100手以上
-                        if ((black_rank_int != None) and (white_rank_int != None) 
-                            and (abs(black_rank_int - white_rank_int) == 0)
-                            and (num_moves >= MIN_MOVES)):
-                            # 取得したプレイヤー名をリストに追加
-                            players.append(black_player.group(1))
-                            players.append(white_player.group(1))
-                            player_counts.update(players)
-                            for player in players:
-                                player_games[player].append(file_path)
-                                                
-                except Exception as e:
-                    print(f"ファイル {file_path} の解析中にエラーが発生しました: {e}")
-                    continue
+    # 索引があれば、ファイルを読まずに索引の情報で判定する
+    games = corpus_index.load_indexed_games(SRC_DIR)
+    if (games is None):
+        # SFGファイルを並列に探索
+        print("SGFファイルを検索")
+        games = sgf_scanner.scan_corpus(SRC_DIR, MIN_MOVES)
+
+    for file_path, black_player, white_player, black_rank_int, white_rank_int, num_moves, error in games:
+        if ((error is None) and is_valid_game(black_rank_int, white_rank_int, num_moves)):
+            if ((black_player is None) or (white_player is None)):
+                error = "対局者名の情報がありません"
+            else:
+                add_player_game(player_counts, player_games, [black_player, white_player], file_path)
+        if (error is not None):
+            print(f"ファイル {file_path} の解析中にエラーが発生しました: {error}")
 
     # プレイヤーの出現回数が指定回数以上のものを選択
     for player,count in player_counts.items():
@@ -99,6 +54,23 @@ def collect_player_data():
     print(f"条件に合致したプレイヤーの総数: {len(valid_players)} 人 \n")
     return valid_players, player_games
 
+###########
+### 抽出の条件を満たす棋譜かを判定する関数
+###########
+def is_valid_game(black_rank_int, white_rank_int, num_moves):
+    # 指定する条件; 級段位が同じ かつ 100手以上
+    return ((black_rank_int != None) and (white_rank_int != None) 
+            and (abs(black_rank_int - white_rank_int) == 0)
+            and (num_moves >= MIN_MOVES))
+
+###########
+### プレイヤーの出現回数と棋譜のパスを記録する関数
+###########
+def add_player_game(player_counts, player_games, players, file_path):
+    player_counts.update(players)
+    for player in players:
+        player_games[player].append(file_path)
+
 ###########
 ### 条件に合うプレイヤーから選出し、それぞれのプレイヤーから指定数の棋譜を抽出する
 ###########
@@ -135,15 +107,8 @@ def select_games(valid_players, player_games):
 ### 選択した棋譜をコピーする関数
 ###########
 def copy_selected_files(files_to_copy):
-    for file_path in files_to_copy:
-        file_name = os.path.basename(file_path) # パスからファイル名を取得
-        destination_path = os.path.join(DST_DIR, file_name) # コピー先パスの生成
-        
-        try:
-            shutil.copy(file_path, destination_path) # ファイルのコピー
-            print(f"コピー完了: {file_name}")
-        except Exception as e:
-            print(f"ファイル {file_name} のコピー中にエラーが発生しました: {e}")
+    # 環境変数 SELECT_MATERIALIZE でリンクや一覧ファイルも選べる
+    materialize.materialize_files(files_to_copy, DST_DIR)
     print("全員分のコピーが完了\n")    
 
 ###########
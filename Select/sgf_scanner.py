@@ -0,0 +1,121 @@
+# /**
+#  * sgf_scanner
+#  * SGFファイルを複数プロセスで並列に走査し、抽出の判定に必要な情報だけを読み取る
+#  * (情報ノードの対局者・段級位と、最低手数に達するまでの手数)
+#  * 索引 (corpus_index) の作成にも使い、棋譜の情報の読み取り方はここに1つにまとめる
+# */
+
+import os
+import re # 正規表現：文字列のパターンマッチング・検索・置換を行う
+from functools import partial
+import multiprocessing as mp
+
+# 段級位のリスト。弱い順に並べることで、インデックスがそのまま強さの順序を表す
+RANK_ORDER = [
+    '30级', '29级', '28级', '27级', '26级', '25级', '24级', '23级', '22级', '21级',
+    '20级', '19级', '18级', '17级', '16级', '15级', '14级', '13级', '12级', '11级',
+    '10级', '9级', '8级', '7级', '6级', '5级', '4级', '3级', '2级', '1级',
+    '1段', '2段', '3段', '4段', '5段', '6段', '7段', '8段', '9段',
+    '1プロ', '2プロ', '3プロ', '4プロ', '5プロ', '6プロ', '7プロ', '8プロ', '9プロ',
+]
+
+# 1つのプロセスにまとめて渡すファイル数 (同じディレクトリのファイルをまとめる)
+SCAN_BATCH_SIZE = 256
+
+# 着手 ('B[xx]' または 'W[xx]')
+MOVE_PATTERN = re.compile(rb'[BW]\[[a-z]{2}\]')
+# 情報ノード (最初の '(;' から、属性値の外にある次の ';' '(' ')' の手前まで)
+ROOT_NODE_PATTERN = re.compile(rb'\(\s*;((?:[^\[;()]|\[(?:[^\\\]]|\\.)*\])*)', re.DOTALL)
+# 対局者名・段級位
+BLACK_PLAYER_PATTERN = re.compile(rb'PB\[(.*?)\]')
+WHITE_PLAYER_PATTERN = re.compile(rb'PW\[(.*?)\]')
+BLACK_RANK_PATTERN = re.compile(rb'BR\[(.*?)\]')
+WHITE_RANK_PATTERN = re.compile(rb'WR\[(.*?)\]')
+
+###########
+### 段級位文字列を整数に変換して返す関数
+### 例) '30级' -> 0
+###########
+def get_rank_as_int(rank_str):
+    try:
+        # 正規化されたリスト内を直接検索
+        return RANK_ORDER.index(rank_str)
+    except ValueError:
+        return None
+
+###########
+### 属性値を文字列に変換する関数 (見つからなければ None)
+###########
+def decode_value(match):
+    return match.group(1).decode('utf-8', errors='ignore') if (match) else None
+
+###########
+### 1つのSGFファイルを読み取る関数
+### 手数は min_moves に達した時点で数えるのをやめる (None: 全ての手を数える)
+### 戻り値: (パス, 黒番, 白番, 黒の段級位, 白の段級位, 手数, エラー)
+###########
+def scan_file(file_path, min_moves):
+    try:
+        with open(file_path, 'rb') as f:
+            content = f.read()
+
+        # 情報ノードから対局者名と段級位を取得
+        root_node = ROOT_NODE_PATTERN.search(content)
+        header = root_node.group(1) if (root_node) else content
+        black_rank_str = decode_value(BLACK_RANK_PATTERN.search(header))
+        white_rank_str = decode_value(WHITE_RANK_PATTERN.search(header))
+        if ((black_rank_str is None) or (white_rank_str is None)):
+            return (file_path, None, None, None, None, None, "段級位の情報がありません")
+
+        # 手数 ('B[' または 'W[' の出現回数) を最低手数まで数える
+        num_moves = 0
+        for _ in MOVE_PATTERN.finditer(content):
+            num_moves += 1
+            if ((min_moves is not None) and (num_moves >= min_moves)):
+                break
+
+        return (
+            file_path,
+            decode_value(BLACK_PLAYER_PATTERN.search(header)),
+            decode_value(WHITE_PLAYER_PATTERN.search(header)),
+            get_rank_as_int(black_rank_str),
+            get_rank_as_int(white_rank_str),
+            num_moves,
+            None
+        )
+    except Exception as e:
+        return (file_path, None, None, None, None, None, str(e))
+
+###########
+### 複数のSGFファイルを読み取る関数 (並列処理用)
+###########
+def scan_files(file_paths, min_moves):
+    return [scan_file(file_path, min_moves) for file_path in file_paths]
+
+###########
+### ディレクトリを走査し、SGFファイルのパスをディレクトリごとにまとめて返すイテレータ
+###########
+def iter_sgf_batches(src_dir):
+    for root, _, files in os.walk(src_dir): # ソースフォルダを探索する
+        sgf_files = [os.path.join(root, file) for file in files if file.endswith('.sgf')]
+        for i in range(0, len(sgf_files), SCAN_BATCH_SIZE):
+            yield sgf_files[i : i + SCAN_BATCH_SIZE]
+
+###########
+### ファイルのまとまりを並列に読み取る関数 (終わったものから順に返す)
+### 戻り値: (パス, 黒番, 白番, 黒の段級位, 白の段級位, 手数, エラー) を返すイテレータ
+###########
+def scan_batches(batches, min_moves, num_processes=None):
+    if (num_processes is None):
+        num_processes = int(os.environ.get('SELECT_SCAN_PROCESSES', 0)) or os.cpu_count()
+    with mp.Pool(processes=num_processes) as pool:
+        for results in pool.imap_unordered(partial(scan_files, min_moves=min_moves), batches):
+            yield from results
+
+###########
+### ディレクトリ以下のSGFファイルを並列に読み取る関数
+### ディレクトリの走査と並行して読み取り、終わったものから順に返す
+### 戻り値: (パス, 黒番, 白番, 黒の段級位, 白の段級位, 手数, エラー) を返すイテレータ
+###########
+def scan_corpus(src_dir, min_moves, num_processes=None):
+    yield from scan_batches(iter_sgf_batches(src_dir), min_moves, num_processes)